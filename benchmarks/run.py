@@ -0,0 +1,284 @@
+"""
+Benchmark de carga del Gateway y de los dos microservicios (sin Docker).
+
+Ejemplos (desde la raíz del repositorio):
+
+    python -m benchmarks.run --incidents 10000
+    python -m benchmarks.run --incidents 1000000 --scenarios gateway incidencias --save-baseline main
+    python -m benchmarks.run --incidents 1000000 --compare main
+
+Por defecto usa SQLite en benchmarks/.data (los datos se reutilizan entre ejecuciones).
+Con --users-db-url / --incidents-db-url se puede apuntar a un Postgres local.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+BASELINES_DIR = BENCH_DIR / "baselines"
+BULK_BATCH = 1000
+PASSWORD = "benchmark"
+STATUSES = ["abierta", "en_progreso", "cerrada"]
+
+
+def percentile(sorted_values: list[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# --- Carga de datos ---
+
+async def seed(stack, n_users: int, n_incidents: int, concurrency: int) -> dict:
+    """Crea usuarios e incidencias a través de las APIs reales. Lo ya existente se reutiliza."""
+    emails = [f"bench-user-{i}@example.com" for i in range(n_users)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def create_user(email: str):
+        async with semaphore:
+            r = await stack.users.post("/usuarios", json={"name": email.split("@")[0], "email": email, "password": PASSWORD})
+            # 400 = ya existía de una ejecución anterior
+            if r.status_code not in (201, 400):
+                raise RuntimeError(f"Error creando usuario {email}: {r.status_code} {r.text}")
+
+    async def login(email: str) -> str:
+        async with semaphore:
+            r = await stack.users.post("/auth/login", data={"username": email, "password": PASSWORD})
+            r.raise_for_status()
+            return r.json()["access_token"]
+
+    await asyncio.gather(*(create_user(email) for email in emails))
+    tokens = await asyncio.gather(*(login(email) for email in emails))
+    headers = [{"Authorization": f"Bearer {token}"} for token in tokens]
+
+    r = await stack.users.get("/usuarios", params={"limit": 1000}, headers=headers[0])
+    user_ids = [user["id"] for user in r.json()]
+
+    existing = await count_incidents(stack, headers[0])
+    missing = max(0, n_incidents - existing)
+    print(f"Usuarios: {len(emails)} | incidencias existentes: {existing} | a crear: {missing}")
+
+    started = time.perf_counter()
+    batches = [(start, min(BULK_BATCH, missing - start)) for start in range(0, missing, BULK_BATCH)]
+
+    async def create_batch(number: int, start: int, size: int):
+        async with semaphore:
+            payload = [
+                {"title": f"bench-{existing + start + i}", "description": "Incidencia de benchmark",
+                 "status": random.choice(STATUSES)}
+                for i in range(size)
+            ]
+            # Cada lote pertenece a un usuario distinto (el propietario es quien crea)
+            r = await stack.incidents.post("/incidencias/bulk", json=payload, headers=headers[number % len(headers)])
+            r.raise_for_status()
+
+    done = 0
+    for offset in range(0, len(batches), concurrency):
+        chunk = batches[offset:offset + concurrency]
+        await asyncio.gather(*(create_batch(offset + k, start, size) for k, (start, size) in enumerate(chunk)))
+        done += sum(size for _, size in chunk)
+        print(f"  {done}/{missing} incidencias", end="\r", flush=True)
+    if missing:
+        print(f"\nCarga completada en {time.perf_counter() - started:.1f}s")
+
+    r = await stack.incidents.get("/incidencias", params={"limit": 1000}, headers=headers[0])
+    incident_ids = [incident["id"] for incident in r.json()]
+    return {"emails": emails, "headers": headers, "user_ids": user_ids, "incident_ids": incident_ids}
+
+
+async def count_incidents(stack, headers: dict) -> int:
+    # Solo necesitamos saber si la carga ya está hecha: recorremos con cursor en páginas grandes
+    total, cursor = 0, None
+    while True:
+        params = {"limit": 1000, **({"cursor": cursor} if cursor else {})}
+        r = await stack.incidents.get("/incidencias", params=params, headers=headers)
+        r.raise_for_status()
+        total += len(r.json())
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            return total
+
+
+# --- Escenarios: cada operación devuelve la respuesta HTTP ---
+
+def build_scenarios(stack, data: dict) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    counter = iter(range(10**9))
+
+    def auth():
+        return random.choice(data["headers"])
+
+    async def list_incidents():
+        params = {"limit": 100}
+        if random.random() < 0.3:
+            params["status"] = random.choice(STATUSES)
+        return await stack.incidents.get("/incidencias", params=params, headers=auth())
+
+    async def create_incident():
+        payload = {"title": f"bench-{run_id}-{next(counter)}", "description": "Alta durante el benchmark"}
+        return await stack.incidents.post("/incidencias", json=payload, headers=auth())
+
+    async def update_incident():
+        incident_id = random.choice(data["incident_ids"])
+        return await stack.incidents.put(
+            f"/incidencias/{incident_id}", json={"status": random.choice(STATUSES)}, headers=auth()
+        )
+
+    async def users_batch():
+        ids = random.sample(data["user_ids"], min(100, len(data["user_ids"])))
+        return await stack.users.post("/usuarios/batch", json=ids, headers=auth())
+
+    async def login():
+        form = {"username": random.choice(data["emails"]), "password": PASSWORD}
+        return await stack.users.post("/auth/login", data=form)
+
+    async def detailed():
+        params = {}
+        if random.random() < 0.5:
+            params["user_id"] = random.choice(data["user_ids"])
+        return await stack.gateway.get("/incidencias-detalladas", params=params, headers=auth())
+
+    async def detailed_stream():
+        # Todas las incidencias de un usuario, paginadas por cursor e hidratadas en streaming
+        params = {"stream": "ndjson", "user_id": random.choice(data["user_ids"])}
+        return await stack.gateway.get("/incidencias-detalladas", params=params, headers=auth())
+
+    # Mezclas ponderadas de lectura/escritura: {nombre: [(peso, operación)]}
+    return {
+        "incidencias": [(80, list_incidents), (10, create_incident), (10, update_incident)],
+        "usuarios-batch": [(100, users_batch)],
+        "login": [(100, login)],
+        "gateway": [(100, detailed)],
+        "gateway-stream": [(100, detailed_stream)],
+    }
+
+
+async def run_scenario(mix: list, concurrency: int, duration: float) -> dict:
+    weights = [weight for weight, _ in mix]
+    operations = [operation for _, operation in mix]
+    latencies: list[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            operation = random.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                response = await operation()
+                ok = response.status_code < 400
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+# --- Informe y baselines ---
+
+def print_report(results: dict):
+    print(f"\n{'escenario':<16}{'peticiones':>11}{'errores':>9}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['requests']:>11}{r['errors']:>9}{r['rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Devuelve las regresiones: menos req/s o más p95/p99 que la baseline, más allá de la tolerancia."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline["results"].get(name)
+        if not previous:
+            continue
+        if current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: req/s {previous['rps']} -> {current['rps']}")
+        for key in ("p95_ms", "p99_ms"):
+            if current[key] > previous[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {previous[key]} -> {current[key]}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark del Gateway y los microservicios")
+    parser.add_argument("--incidents", type=int, default=10_000, help="Incidencias a cargar (1e3 - 1e6)")
+    parser.add_argument("--users", type=int, default=50, help="Usuarios a cargar (máx. 1000)")
+    parser.add_argument("--scenarios", nargs="+", default=["incidencias", "usuarios-batch", "login", "gateway"],
+                        help="incidencias, usuarios-batch, login, gateway, gateway-stream")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10, help="Segundos por escenario")
+    parser.add_argument("--data-dir", type=Path, default=BENCH_DIR / ".data")
+    parser.add_argument("--users-db-url", help="Por defecto SQLite en --data-dir")
+    parser.add_argument("--incidents-db-url", help="Por defecto SQLite en --data-dir")
+    parser.add_argument("--save-baseline", metavar="NOMBRE", help="Guarda los resultados en baselines/NOMBRE.json")
+    parser.add_argument("--compare", metavar="NOMBRE", help="Compara con baselines/NOMBRE.json (exit 1 si hay regresión)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Margen admitido frente a la baseline (0.2 = 20%%)")
+    return parser.parse_args()
+
+
+async def main(args) -> int:
+    from .stack import Stack
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    users_db_url = args.users_db_url or f"sqlite:///{args.data_dir / 'users.db'}"
+    incidents_db_url = args.incidents_db_url or f"sqlite+aiosqlite:///{args.data_dir / 'incidents.db'}"
+
+    async with Stack(users_db_url, incidents_db_url) as stack:
+        data = await seed(stack, args.users, args.incidents, args.concurrency)
+        scenarios = build_scenarios(stack, data)
+        results = {}
+        for name in args.scenarios:
+            print(f"Ejecutando '{name}' ({args.concurrency} concurrentes, {args.duration}s)...")
+            results[name] = await run_scenario(scenarios[name], args.concurrency, args.duration)
+
+    print_report(results)
+    report = {
+        "meta": {
+            "incidents": args.incidents, "users": args.users, "concurrency": args.concurrency,
+            "duration": args.duration, "database": incidents_db_url.split(":", 1)[0],
+        },
+        "results": results,
+    }
+
+    status = 0
+    if args.compare:
+        baseline = json.loads((BASELINES_DIR / f"{args.compare}.json").read_text())
+        if baseline["meta"] != report["meta"]:
+            print(f"\nAviso: la baseline se midió con otros parámetros: {baseline['meta']}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegresiones frente a la baseline:")
+            for line in regressions:
+                print(f"  - {line}")
+            status = 1
+        else:
+            print(f"\nSin regresiones frente a '{args.compare}'")
+    if args.save_baseline:
+        BASELINES_DIR.mkdir(exist_ok=True)
+        path = BASELINES_DIR / f"{args.save_baseline}.json"
+        path.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"Baseline guardada en {path}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
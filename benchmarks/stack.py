@@ -0,0 +1,128 @@
+"""
+Levanta el Gateway y los dos microservicios en un único proceso, sin Docker.
+
+Cada app es la aplicación FastAPI real; la red Docker se sustituye por transportes
+ASGI en memoria (httpx.ASGITransport) y las bases de datos por SQLite en un
+directorio temporal o por las URLs de Postgres que se indiquen.
+"""
+import importlib
+import importlib.util
+import os
+import sys
+import types
+from contextlib import AsyncExitStack
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+USERS_URL = "http://users-service"
+INCIDENTS_URL = "http://incidents-service"
+GATEWAY_URL = "http://gateway"
+
+
+def _import_service(alias: str, service_dir: Path, env: dict):
+    """
+    Importa el paquete 'app' de un microservicio. Los dos servicios usan el mismo nombre
+    de paquete, así que incidents-service se registra con un alias.
+    users-service conserva el nombre 'app' porque su pool de bcrypt arranca procesos
+    ('spawn') que vuelven a importar 'app.passwords' por su nombre real.
+    """
+    # DATABASE_URL y el resto de configuración se leen al importar los módulos
+    os.environ.update(env)
+    if alias == "app":
+        sys.path.insert(0, str(service_dir))
+    else:
+        package = types.ModuleType(alias)
+        package.__path__ = [str(service_dir / "app")]
+        sys.modules[alias] = package
+    return importlib.import_module(f"{alias}.main")
+
+
+def _import_gateway(env: dict):
+    os.environ.update(env)
+    gateway_dir = ROOT / "gateway"
+    sys.path.insert(0, str(gateway_dir))
+    spec = importlib.util.spec_from_file_location("gateway_main", gateway_dir / "main.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["gateway_main"] = module
+    spec.loader.exec_module(module)
+    return module, importlib.import_module("clients")
+
+
+class Stack:
+    """Las tres apps y un cliente HTTP por cada una, listos para usar dentro de 'async with'."""
+
+    def __init__(
+        self,
+        users_db_url: str,
+        incidents_db_url: str,
+        jwt_secret: str = "benchmark-secret",
+        internal_token: str = "benchmark-internal-token",
+        users_replica_url: str | None = None,
+        incidents_replica_url: str | None = None,
+    ):
+        common = {
+            "JWT_SECRET": jwt_secret,
+            "JWT_ALGORITHM": "HS256",
+            "INTERNAL_SERVICE_TOKEN": internal_token,
+            "USERS_SERVICE_URL": USERS_URL,
+            "INCIDENTS_SERVICE_URL": INCIDENTS_URL,
+        }
+        # Sin réplica se fija la variable vacía para que un servicio no herede la del otro
+        self.users_main = _import_service("app", ROOT / "users-service", {
+            **common, "DATABASE_URL": users_db_url, "DATABASE_REPLICA_URL": users_replica_url or "",
+        })
+        self.incidents_main = _import_service("incidents_app", ROOT / "incidents-service", {
+            **common, "DATABASE_URL": incidents_db_url, "DATABASE_REPLICA_URL": incidents_replica_url or "",
+        })
+        # ASGITransport no hace streaming: el feed de invalidación no terminaría de abrirse
+        self.gateway_main, self.gateway_clients = _import_gateway({**common, "GATEWAY_CACHE_INVALIDATION": "false"})
+        self.incidents_external = importlib.import_module("incidents_app.external")
+        self.users_notifier = importlib.import_module("app.notifier")
+        self.users_migrate = importlib.import_module("app.migrate")
+        self.incidents_migrate = importlib.import_module("incidents_app.migrate")
+        self._stack = AsyncExitStack()
+
+    def _transport(self, app) -> httpx.ASGITransport:
+        return httpx.ASGITransport(app=app)
+
+    def client(self, app, base_url: str) -> httpx.AsyncClient:
+        # Sin límite de conexiones: el nivel de concurrencia lo fija el benchmark
+        return httpx.AsyncClient(
+            transport=self._transport(app), base_url=base_url, timeout=None,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=None),
+        )
+
+    async def __aenter__(self):
+        users_app = self.users_main.app
+        incidents_app = self.incidents_main.app
+        gateway_app = self.gateway_main.app
+
+        # El esquema lo crea el paso de migración, como en docker-compose
+        self.users_migrate.migrate()
+        await self.incidents_migrate.migrate()
+
+        # ASGITransport no ejecuta el lifespan: lo arrancamos a mano (pools, clientes...)
+        for app in (users_app, incidents_app, gateway_app):
+            await self._stack.enter_async_context(app.router.lifespan_context(app))
+
+        # Los clientes internos apuntan a las apps en memoria en lugar de a la red Docker
+        await self.incidents_external.close_client()
+        await self.incidents_external.start_client(self._transport(users_app))
+        await self.users_notifier.close_client()
+        await self.users_notifier.start_client(self._transport(incidents_app))
+        await self.gateway_clients.close_clients()
+        await self.gateway_clients.start_clients({
+            "users": self._transport(users_app),
+            "incidents": self._transport(incidents_app),
+        })
+
+        self.users = await self._stack.enter_async_context(self.client(users_app, USERS_URL))
+        self.incidents = await self._stack.enter_async_context(self.client(incidents_app, INCIDENTS_URL))
+        self.gateway = await self._stack.enter_async_context(self.client(gateway_app, GATEWAY_URL))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._stack.aclose()
@@ -166,4 +166,34 @@ export const deleteIncident = (incidentId) => {
     method: 'DELETE',
     headers: { ...getAuthHeaders() }
   }).then(handleResponse);
-};
\ No newline at end of file
+};
+
+// --- Feed de cambios (Server-Sent Events) ---
+
+export const subscribeIncidentEvents = async (handlers) => {
+  // EventSource no permite enviar cabeceras: el Gateway guarda el token en una cookie
+  // HttpOnly (nunca en la URL, que acaba en los logs) y el navegador la envía al abrir el feed
+  await fetch(`${API_BASE_URL}/incident-events/session`, {
+    method: 'POST',
+    headers: { ...getAuthHeaders() },
+    credentials: 'include'
+  }).then(handleResponse);
+  const source = new EventSource(`${API_BASE_URL}/incident-events/`, { withCredentials: true });
+
+  // created / updated traen la incidencia hidratada; deleted solo el id;
+  // reset indica que se perdieron eventos y hay que recargar el listado
+  ['created', 'updated', 'deleted', 'reset'].forEach((type) => {
+    source.addEventListener(type, (event) => handlers[type]?.(JSON.parse(event.data)));
+  });
+  // El navegador reconecta solo (enviando Last-Event-ID) salvo que el servidor rechace la conexión
+  source.onerror = () => handlers.error?.(source);
+  return source;
+};
+
+// Borra la cookie del feed al cerrar sesión
+export const closeIncidentEvents = () => {
+  return fetch(`${API_BASE_URL}/incident-events/session`, {
+    method: 'DELETE',
+    credentials: 'include'
+  }).catch(() => {});
+};
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+from typing import Optional
+import httpx
+
+from metrics import InstrumentedTransport
+
+# URLs internas de la red Docker
+USERS_SERVICE_URL = os.getenv("USERS_SERVICE_URL")
+INCIDENTS_SERVICE_URL = os.getenv("INCIDENTS_SERVICE_URL")
+
+# Configuración del pool de conexiones (compartido durante toda la vida del Gateway)
+# Límites POR UPSTREAM: cada microservicio tiene su propio cliente y su propio pool
+HTTP_MAX_CONNECTIONS = int(os.getenv("GATEWAY_HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("GATEWAY_HTTP_MAX_KEEPALIVE", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("GATEWAY_HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_POOL_TIMEOUT = float(os.getenv("GATEWAY_HTTP_POOL_TIMEOUT", 5))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("GATEWAY_HTTP_CONNECT_TIMEOUT", 2))
+# HTTP/2 es opcional (requiere el extra httpx[http2])
+HTTP2_ENABLED = os.getenv("GATEWAY_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Timeouts de lectura por upstream (segundos)
+USERS_SERVICE_TIMEOUT = float(os.getenv("USERS_SERVICE_TIMEOUT", 5))
+INCIDENTS_SERVICE_TIMEOUT = float(os.getenv("INCIDENTS_SERVICE_TIMEOUT", 10))
+
+# Presupuesto total de una petición al Gateway (segundos), repartido entre los upstreams
+REQUEST_DEADLINE = float(os.getenv("GATEWAY_REQUEST_DEADLINE", 8))
+# Tiempo máximo esperando a users-service antes de responder sin 'owner' (degradado)
+USERS_HYDRATION_BUDGET = float(os.getenv("GATEWAY_USERS_HYDRATION_BUDGET", 1.5))
+
+
+class Deadline:
+    """Instante límite de una petición: cada llamada a un upstream consume del mismo presupuesto."""
+
+    def __init__(self, seconds: float = REQUEST_DEADLINE):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, cap: float) -> float:
+        # Lo que quede del presupuesto, pero nunca más que el límite propio del upstream
+        return min(cap, self.remaining())
+
+
+# Clientes vivos: se crean en el arranque y se cierran en el apagado del Gateway
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _build_client(
+    base_url: str, read_timeout: float, target: str, transport: Optional[httpx.AsyncBaseTransport] = None
+) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        read_timeout,
+        connect=HTTP_CONNECT_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+    # El transporte lleva el pool de conexiones; lo envolvemos para medir la latencia por upstream
+    transport = transport or httpx.AsyncHTTPTransport(limits=limits, http2=HTTP2_ENABLED)
+    return httpx.AsyncClient(
+        base_url=base_url,
+        timeout=timeout,
+        transport=InstrumentedTransport(transport, target),
+    )
+
+
+async def start_clients(transports: Optional[dict[str, httpx.AsyncBaseTransport]] = None):
+    """
+    Crea un cliente (y su pool de conexiones) por cada microservicio.
+    'transports' permite sustituir la red por otro transporte (p. ej. ASGI en los benchmarks).
+    """
+    transports = transports or {}
+    _clients["users"] = _build_client(USERS_SERVICE_URL, USERS_SERVICE_TIMEOUT, "users", transports.get("users"))
+    _clients["incidents"] = _build_client(
+        INCIDENTS_SERVICE_URL, INCIDENTS_SERVICE_TIMEOUT, "incidents", transports.get("incidents")
+    )
+
+
+async def warm_up():
+    """Abre una conexión con cada upstream y comprueba que están listos (/ready)."""
+    responses = await asyncio.gather(*(client.get("/ready") for client in _clients.values()))
+    for response in responses:
+        response.raise_for_status()
+
+
+async def close_clients():
+    """Cierra ordenadamente las conexiones keep-alive abiertas."""
+    for client in _clients.values():
+        await client.aclose()
+    _clients.clear()
+
+
+def users_client() -> httpx.AsyncClient:
+    return _clients["users"]
+
+
+def incidents_client() -> httpx.AsyncClient:
+    return _clients["incidents"]
@@ -105,13 +105,18 @@ def run_seed():
         except Exception as e:
             print(f"❌ Excepción conectando con Users Service: {e}")
 
-    print("\n--- 2. Creando Incidencias (Usando JWT) ---")
+    print("\n--- 2. Creando Incidencias (Usando JWT, en bloque por usuario) ---")
+    # Agrupamos las incidencias por autor: una sola petición (y transacción) por usuario
+    incidents_by_email = {}
     for inc in mock_incidents:
         user_email = inc.pop("user_email") 
+        incidents_by_email.setdefault(user_email, []).append(inc)
+
+    for user_email, incidents in incidents_by_email.items():
         token = user_tokens.get(user_email)
 
         if not token:
-            print(f"⏭️  Saltando incidencia '{inc['title']}': No tenemos token para {user_email}")
+            print(f"⏭️  Saltando {len(incidents)} incidencias: No tenemos token para {user_email}")
             continue
 
         # Header de autorización
@@ -122,16 +127,22 @@ def run_seed():
         # Nota: Ya NO enviamos 'user_id' porque lo eliminamos del esquema en SCRUM-94
         try:
             response = httpx.post(
-                f"{INCIDENTS_SERVICE_URL}/incidencias", 
-                json=inc,
+                f"{INCIDENTS_SERVICE_URL}/incidencias/bulk", 
+                json=incidents,
                 headers=headers
             )
             
-            if response.status_code == 201:
-                data = response.json()
-                print(f"✅ Incidencia creada: '{data['title']}' (ID: {data['id']})")
-            else:
-                print(f"❌ Error creando incidencia: {response.status_code} - {response.text}")
+            if response.status_code != 200:
+                print(f"❌ Error creando incidencias: {response.status_code} - {response.text}")
+                continue
+
+            # El endpoint devuelve un resultado por elemento
+            for item in response.json():
+                title = incidents[item["index"]]["title"]
+                if item["status_code"] == 201:
+                    print(f"✅ Incidencia creada: '{title}' (ID: {item['id']})")
+                else:
+                    print(f"❌ Error creando incidencia '{title}': {item['status_code']} - {item['detail']}")
                 
         except Exception as e:
             print(f"❌ Excepción conectando con Incidents Service: {e}")
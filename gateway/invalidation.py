@@ -0,0 +1,118 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Iterable
+import httpx
+
+import clients
+import metrics
+from response_cache import response_cache
+from user_cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+# Vaciado de las cachés con el feed de cambios de incidents-service (false = solo caducan por TTL)
+CACHE_INVALIDATION = os.getenv("GATEWAY_CACHE_INVALIDATION", "true").lower() in ("1", "true", "yes")
+# Segundos entre reintentos si el feed no está disponible o se corta
+CACHE_INVALIDATION_RETRY_SECONDS = float(os.getenv("GATEWAY_CACHE_INVALIDATION_RETRY_SECONDS", 2))
+# Credencial de las rutas internas de incidents-service. El Gateway no tiene el secreto JWT:
+# no puede firmar tokens de usuario
+INTERNAL_SERVICE_TOKEN = os.getenv("INTERNAL_SERVICE_TOKEN")
+
+# Etiquetas de las respuestas cacheadas (response_cache.put(..., tags=...)):
+# - agregados (/estadisticas): cambian con cualquier incidencia
+# - listados: las incidencias que contienen y, según el filtro, el usuario, el estado o
+#   "todas" (ahí aparece cualquier incidencia nueva, porque van de la más reciente a la más antigua)
+AGGREGATE_TAG = "aggregate"
+ALL_INCIDENTS_TAG = "incidents"
+# Listados cuyas filas no se pueden identificar (proyección sin 'id'): cualquier cambio los invalida
+OPAQUE_TAG = "opaque"
+
+
+def listing_tags(filters: dict, incidents: list[dict]) -> set[str]:
+    """Etiquetas de la primera página de /incidencias-detalladas con estos filtros."""
+    if filters.get("user_id") is not None:
+        tags = {f"user:{filters['user_id']}"}
+    elif filters.get("status") is not None:
+        tags = {f"status:{filters['status']}"}
+    else:
+        tags = {ALL_INCIDENTS_TAG}
+    for incident in incidents:
+        incident_id = incident.get("id")
+        if incident_id is None:
+            return tags | {OPAQUE_TAG}
+        tags.add(f"incident:{incident_id}")
+    return tags
+
+
+def _affected_tags(event_type: str, incident: dict) -> Iterable[str]:
+    yield AGGREGATE_TAG
+    yield OPAQUE_TAG
+    yield f"incident:{incident['id']}"
+    if event_type in ("created", "updated"):
+        # Puede entrar en listados donde aún no estaba: los de su usuario y su estado
+        yield f"user:{incident.get('user_id')}"
+        yield f"status:{incident.get('status')}"
+    if event_type == "created":
+        yield ALL_INCIDENTS_TAG
+
+
+def apply_event(event_type: str, data: str):
+    """
+    Invalida solo lo que el evento puede haber cambiado. Un 'reset' (cambios en bloque:
+    archivado, importaciones) vacía la caché de respuestas entera. Una incidencia creada o
+    editada solo puede tener un propietario que existe: si estaba cacheado como "no
+    encontrado", se olvida.
+    """
+    if event_type == "reset":
+        response_cache.clear()
+        return
+    incident = json.loads(data)
+    response_cache.invalidate(_affected_tags(event_type, incident))
+    if event_type in ("created", "updated") and incident.get("user_id") is not None:
+        user_cache.forget_missing(incident["user_id"])
+
+
+async def _follow_feed():
+    client = clients.incidents_client()
+    request = client.build_request(
+        "GET", "/incidencias/eventos/interno",
+        headers={"X-Internal-Token": INTERNAL_SERVICE_TOKEN},
+        timeout=httpx.Timeout(None, connect=clients.HTTP_CONNECT_TIMEOUT),
+    )
+    upstream = await client.send(request, stream=True)
+    try:
+        if upstream.status_code != 200:
+            raise httpx.HTTPStatusError(
+                f"Feed de incidencias: {upstream.status_code}", request=request, response=upstream
+            )
+        # Mientras no estábamos suscritos se han podido perder cambios
+        response_cache.clear()
+        event = {}
+        async for line in upstream.aiter_lines():
+            if line.startswith(":"):
+                continue
+            if line:
+                field, _, value = line.partition(":")
+                event[field] = value.removeprefix(" ")
+                continue
+            if event:
+                apply_event(event.get("event", "message"), event.get("data", "{}"))
+                event = {}
+    finally:
+        await upstream.aclose()
+
+
+async def follow_changes():
+    """Tarea de fondo de cada worker (las cachés son por proceso): sigue el feed y reconecta si se corta."""
+    if not INTERNAL_SERVICE_TOKEN:
+        logger.warning("Sin INTERNAL_SERVICE_TOKEN: las cachés del Gateway solo caducan por TTL")
+        return
+    while True:
+        try:
+            await _follow_feed()
+        except Exception as e:
+            logger.warning("Invalidación de cachés sin feed de incidencias: %s", e)
+            metrics.UPSTREAM_ERRORS.labels("cache_invalidation").inc()
+        await asyncio.sleep(CACHE_INVALIDATION_RETRY_SECONDS)
@@ -1,65 +1,439 @@
+import asyncio
+import json
+import logging
 import os
 import httpx
-from fastapi import FastAPI, HTTPException, Header
-from typing import List, Optional
+from contextlib import asynccontextmanager
+from fastapi import Cookie, FastAPI, HTTPException, Header, Query, Request, Response
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from typing import List, Literal, Optional
 
-app = FastAPI(title="BFF Gateway")
+import clients
+import invalidation
+import metrics
+from projection import OWNER_FIELDS, DetailProjection
+from readiness import Readiness
+from user_cache import user_cache
+from response_cache import CachedResponse, GZIP_MIN_SIZE, build_response, response_cache, scope_key
+
+logger = logging.getLogger(__name__)
+
+# Cookie con el token para el feed SSE (EventSource no envía cabeceras y el token no debe
+# viajar en la URL, que acaba en los logs de los proxies)
+EVENTS_COOKIE = "events_token"
+EVENTS_COOKIE_MAX_AGE = int(os.getenv("GATEWAY_EVENTS_COOKIE_MAX_AGE", 1800))
+EVENTS_COOKIE_SECURE = os.getenv("GATEWAY_EVENTS_COOKIE_SECURE", "false").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un único pool de conexiones por upstream para todo el Gateway
+    await clients.start_clients()
+    # Conexiones abiertas y upstreams listos antes de aceptar tráfico (si falla, /ready lo reintenta)
+    await readiness.check()
+    invalidation_task = asyncio.create_task(invalidation.follow_changes()) if invalidation.CACHE_INVALIDATION else None
+    yield
+    if invalidation_task is not None:
+        invalidation_task.cancel()
+    await clients.close_clients()
+    metrics.mark_process_dead()
+
+
+readiness = Readiness(clients.warm_up)
+
+
+app = FastAPI(title="BFF Gateway", lifespan=lifespan)
+# Comprime el resto de respuestas (incluido el streaming); las ya comprimidas se respetan
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    # Listo = conexiones abiertas y ambos microservicios listos (distinto de /health: el proceso vive)
+    if not await readiness.check():
+        raise HTTPException(status_code=503, detail="Gateway no preparado")
+    return {"status": "ready"}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    # Formato de exposición de Prometheus
+    return metrics.metrics_response()
+
+
+async def fetch_incidents_page(
+    forward_headers: dict, limit: int, cursor: Optional[str] = None, filters: Optional[dict] = None,
+    deadline: Optional[clients.Deadline] = None,
+) -> tuple[list, Optional[str]]:
+    """
+    Obtiene una página de incidencias del microservicio y el cursor de la siguiente.
+    Cada incidencia trae ya su 'owner' (copia desnormalizada en incidents-service) o null si no la tiene.
+    """
+    deadline = deadline or clients.Deadline()
+    params = {"limit": limit, **(filters or {})}
+    if cursor:
+        params["cursor"] = cursor
+    try:
+        # Sin incidencias no hay respuesta posible: agotado el presupuesto -> 504
+        incidents_resp = await asyncio.wait_for(
+            clients.incidents_client().get(
+                "/incidencias/detalladas",
+                params=params,
+                headers=forward_headers
+            ),
+            timeout=deadline.budget(clients.INCIDENTS_SERVICE_TIMEOUT),
+        )
+
+        # Si el token expiró o es inválido, el microservicio devolverá 401
+        if incidents_resp.status_code == 401:
+            raise HTTPException(status_code=401, detail="Token inválido o expirado")
+
+        incidents_resp.raise_for_status()
+        return incidents_resp.json(), incidents_resp.headers.get("X-Next-Cursor")
+    except HTTPException:
+        raise
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        raise HTTPException(status_code=504, detail="Timeout al obtener incidencias")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al obtener incidencias: {str(e)}")
+
+
+def _consume_result(task: asyncio.Task):
+    # La consulta sigue en segundo plano tras el timeout; evitamos el aviso de excepción no recogida
+    if not task.cancelled() and task.exception() is not None:
+        metrics.UPSTREAM_ERRORS.labels("users_background").inc()
+        logger.warning("Error recuperando usuarios en segundo plano", exc_info=task.exception())
+
+
+async def fetch_users_map(
+    forward_headers: dict, incidents: list, deadline: Optional[clients.Deadline] = None
+) -> tuple[dict, bool]:
+    """
+    Obtiene los usuarios de un bloque de incidencias. Pasa por la caché del Gateway:
+    solo los IDs que faltan se piden a users-service, en una sola llamada (Batch).
+
+    Devuelve (mapa, parcial). Si users-service falla o no responde dentro del presupuesto,
+    se devuelve lo que haya y parcial=True: la respuesta se degrada en vez de bloquearse.
+    """
+    # Recolectar IDs de usuarios únicos
+    user_ids = {inc['user_id'] for inc in incidents if 'user_id' in inc}
+    if not user_ids:
+        return {}, False
+
+    async def fetch(missing_ids: list[int]) -> dict:
+        users_resp = await clients.users_client().post(
+            "/usuarios/batch",
+            json=missing_ids,
+            # Proyección: users-service lee solo estas columnas y no valida el modelo completo
+            params={"fields": ",".join(OWNER_FIELDS)},
+            headers=forward_headers
+        )
+        users_resp.raise_for_status()
+        # Crear diccionario para búsqueda rápida: {id: {datos_usuario}}
+        return {u['id']: u for u in users_resp.json()}
+
+    deadline = deadline or clients.Deadline()
+    task = asyncio.ensure_future(user_cache.get_many(user_ids, fetch))
+    try:
+        # shield: si vence el plazo, la consulta termina en segundo plano y llena la caché
+        users = await asyncio.wait_for(
+            asyncio.shield(task), timeout=deadline.budget(clients.USERS_HYDRATION_BUDGET)
+        )
+    except asyncio.TimeoutError:
+        logger.warning("users-service no respondió a tiempo: respuesta sin 'owner'")
+        metrics.UPSTREAM_ERRORS.labels("users_timeout").inc()
+        metrics.PARTIAL_HYDRATIONS.inc()
+        task.add_done_callback(_consume_result)
+        return {}, True
+    except Exception:
+        logger.exception("Error recuperando usuarios: respuesta sin 'owner'")
+        metrics.UPSTREAM_ERRORS.labels("users").inc()
+        metrics.PARTIAL_HYDRATIONS.inc()
+        # Continuamos sin datos de usuario
+        return {}, True
+    # Los IDs sin usuario (caché negativa) se quedan sin 'owner'
+    return {user_id: user for user_id, user in users.items() if user is not None}, False
+
+
+def hydrate(
+    incidents: list, users_map: dict, partial: bool = False, projection: Optional[DetailProjection] = None
+) -> list:
+    projection = projection or DetailProjection()
+    # Los dicts vienen recién parseados del JSON: los completamos in-place sin copiarlos
+    for inc in incidents:
+        # La copia de incidents-service tiene prioridad; si no hay, usamos el mapa de usuarios
+        owner = inc.get('owner') or users_map.get(inc.get('user_id'), None)
+        # Inyectamos el objeto 'owner' (recortado a los campos pedidos)
+        projection.apply(inc, owner)
+        if partial and owner is None:
+            # owner=None porque no se pudo consultar, no porque el usuario no exista
+            inc['partial'] = True
+    return incidents
+
+
+async def hydrate_page(
+    forward_headers: dict, page: list, deadline: clients.Deadline, projection: DetailProjection
+) -> tuple[list, bool]:
+    # Solo se llama a users-service para las incidencias sin copia del propietario
+    # (anteriores a la copia desnormalizada) y nunca si no se pidió 'owner'
+    users_map, partial = {}, False
+    pending = [inc for inc in page if inc.get('owner') is None] if projection.with_owner else []
+    if pending:
+        users_map, partial = await fetch_users_map(forward_headers, pending, deadline)
+    return hydrate(page, users_map, partial, projection), partial
+
+
+async def stream_hydrated(
+    forward_headers: dict, first_page: list, next_cursor: Optional[str], page_size: int, filters: dict, fmt: str,
+    projection: DetailProjection,
+):
+    """
+    Recorre todas las páginas de incidencias (paginación por cursor) y emite cada bloque
+    hidratado en cuanto está listo. La página siguiente se pide mientras se hidrata la
+    actual, así que solo hay en memoria la página en curso y la que está llegando.
+    Cada página tiene su propio presupuesto de tiempo.
+    """
+    page = first_page
+    first = True
+    next_page_task = None
+    if fmt == "json":
+        yield "["
+    try:
+        while page:
+            deadline = clients.Deadline()
+            # Lanzamos la siguiente página en paralelo con la hidratación de esta
+            next_page_task = None
+            if next_cursor:
+                next_page_task = asyncio.ensure_future(
+                    fetch_incidents_page(forward_headers, page_size, next_cursor, filters, deadline)
+                )
+            hydrated, _ = await hydrate_page(forward_headers, page, deadline, projection)
+            chunk = []
+            for inc in hydrated:
+                line = json.dumps(inc, ensure_ascii=False)
+                if fmt == "ndjson":
+                    chunk.append(line + "\n")
+                else:
+                    chunk.append(line if first else "," + line)
+                    first = False
+            yield "".join(chunk)
+
+            # Sin cursor siguiente no quedan más páginas
+            if next_page_task is None:
+                break
+            try:
+                page, next_cursor = await next_page_task
+            except HTTPException as e:
+                # Las cabeceras ya se enviaron: solo podemos cortar el stream
+                logger.warning("Error paginando incidencias (cursor=%s): %s", next_cursor, e.detail)
+                metrics.UPSTREAM_ERRORS.labels("incidents_stream").inc()
+                break
+    finally:
+        # Si el cliente se desconecta no dejamos la página siguiente descargándose
+        if next_page_task is not None and not next_page_task.done():
+            next_page_task.cancel()
+    if fmt == "json":
+        yield "]"
 
-# URLs internas de la red Docker
-USERS_SERVICE_URL = os.getenv("USERS_SERVICE_URL")
-INCIDENTS_SERVICE_URL = os.getenv("INCIDENTS_SERVICE_URL")
 
 @app.get("/incidencias-detalladas")
-async def get_incidents_with_details(authorization: Optional[str] = Header(None)):
+async def get_incidents_with_details(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    stream: Optional[Literal["ndjson", "json"]] = Query(None, description="Recorre todas las incidencias y las emite en streaming"),
+    page_size: int = Query(500, ge=1, le=1000),
+    status: Optional[str] = Query(None, description="Filtra por estado (se resuelve en incidents-service)"),
+    user_id: Optional[int] = Query(None, description="Filtra por usuario propietario"),
+    fields: Optional[str] = Query(None, description="Campos a devolver, p. ej. id,title,status,owner.name"),
+    include_archived: bool = Query(False, description="Incluye las incidencias cerradas archivadas"),
+):
     # Si no hay token, rechazamos antes de intentar nada (ahorra tiempo)
     if not authorization:
         raise HTTPException(status_code=401, detail="Token de autenticación no proporcionado")
     # Preparamos las cabeceras para las peticiones internas
     forward_headers = {"Authorization": authorization}
-    async with httpx.AsyncClient() as client:
-        # 1. Obtener todas las incidencias
+    # Los filtros se delegan al microservicio (se resuelven en SQL)
+    filters = {k: v for k, v in {"status": status, "user_id": user_id}.items() if v is not None}
+    if include_archived:
+        filters["include_archived"] = "true"
+    # Proyección: incidents-service solo selecciona las columnas necesarias
+    projection = DetailProjection(fields)
+    if projection.upstream_fields:
+        filters["fields"] = projection.upstream_fields
+
+    if stream:
+        # La primera página se pide antes de empezar a responder para poder devolver 401/500
+        first_page, next_cursor = await fetch_incidents_page(forward_headers, page_size, filters=filters)
+        media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+        return StreamingResponse(
+            stream_hydrated(forward_headers, first_page, next_cursor, page_size, filters, stream, projection),
+            media_type=media_type,
+        )
+
+    # Los pollings repetidos dentro del TTL se sirven desde la caché (por token)
+    cache_key = scope_key(authorization, request)
+    entry = response_cache.get(cache_key)
+    partial = False
+    if entry is None:
+        # Presupuesto único para toda la petición, compartido por los dos upstreams
+        deadline = clients.Deadline()
+
+        # 1. Obtener la primera página de incidencias
+        incidents, _ = await fetch_incidents_page(forward_headers, limit=100, filters=filters, deadline=deadline)
+
+        # 2. Obtener detalles de sus usuarios en una sola llamada (Batch) y mezclar (Hidratación)
+        hydrated, partial = await hydrate_page(forward_headers, incidents, deadline, projection)
+
+        # 3. Serializar una sola vez
+        body = json.dumps(hydrated, ensure_ascii=False, separators=(",", ":"))
+        entry = CachedResponse(body.encode())
+        # Una respuesta degradada no se cachea: el siguiente polling debe intentar completarla
+        if not partial:
+            response_cache.put(cache_key, entry, invalidation.listing_tags(filters, incidents))
+
+    # 4. ETag + If-None-Match (304) y gzip precalculado
+    response = build_response(entry, request)
+    if partial:
+        response.headers["X-Partial-Content"] = "true"
+    return response
+
+
+@app.get("/estadisticas")
+async def get_incident_stats(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    days: int = Query(30, ge=1, le=366),
+    top_users: int = Query(50, ge=1, le=1000),
+    include_archived: bool = Query(False, description="Incluye las incidencias cerradas archivadas"),
+):
+    """Agregados de incidencias calculados en incidents-service (para dashboards)."""
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Token de autenticación no proporcionado")
+
+    # Los dashboards refrescan a menudo: mismas reglas de caché y ETag que el listado
+    cache_key = scope_key(authorization, request)
+    entry = response_cache.get(cache_key)
+    if entry is None:
         try:
-            incidents_resp = await client.get(
-                f"{INCIDENTS_SERVICE_URL}/incidencias",
-                headers=forward_headers
+            stats_resp = await clients.incidents_client().get(
+                "/incidencias/stats",
+                params={"days": days, "top_users": top_users, "include_archived": include_archived},
+                headers={"Authorization": authorization},
             )
+        except httpx.TimeoutException:
+            raise HTTPException(status_code=504, detail="Timeout al obtener estadísticas")
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas: {str(e)}")
+        if stats_resp.status_code == 401:
+            raise HTTPException(status_code=401, detail="Token inválido o expirado")
+        if stats_resp.status_code != 200:
+            raise HTTPException(status_code=500, detail=f"Error al obtener estadísticas: {stats_resp.status_code}")
+        # El cuerpo ya es JSON: se reenvía tal cual, sin volver a parsearlo
+        entry = CachedResponse(stats_resp.content)
+        response_cache.put(cache_key, entry, {invalidation.AGGREGATE_TAG})
 
-            # Si el token expiró o es inválido, el microservicio devolverá 401
-            if incidents_resp.status_code == 401:
-                raise HTTPException(status_code=401, detail="Token inválido o expirado")
-            
-            incidents_resp.raise_for_status()
-            incidents = incidents_resp.json()
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error al obtener incidencias: {str(e)}")
-
-        # 2. Recolectar IDs de usuarios únicos
-        user_ids = list({inc['user_id'] for inc in incidents if 'user_id' in inc})
-
-        # 3. Obtener detalles de esos usuarios en una sola llamada (Batch)
-        users_map = {}
-        if user_ids:
-            try:
-                users_resp = await client.post(
-                    f"{USERS_SERVICE_URL}/usuarios/batch", 
-                    json=user_ids,
-                    headers=forward_headers
-                )
-                users_resp.raise_for_status()
-                users_list = users_resp.json()
-                # Crear diccionario para búsqueda rápida: {id: {datos_usuario}}
-                users_map = {u['id']: u for u in users_list}
-            except Exception as e:
-                print(f"Error recuperando usuarios: {e}")
-                # Opcional: Continuar sin datos de usuario o fallar
-
-        # 4. Mezclar datos (Hidratación)
-        results = []
-        for inc in incidents:
-            # Creamos una copia para no mutar si no es necesario
-            inc_extended = inc.copy()
-            # Inyectamos el objeto 'owner' completo usando el mapa
-            inc_extended['owner'] = users_map.get(inc['user_id'], None)
-            results.append(inc_extended)
-
-        return results
\ No newline at end of file
+    return build_response(entry, request)
+
+
+async def relay_hydrated_events(upstream: httpx.Response, forward_headers: dict):
+    """
+    Reenvía el feed SSE de incidents-service manteniendo los IDs de evento (para que
+    el cliente pueda reanudar con Last-Event-ID) e hidratando 'owner' en created/updated.
+    """
+    event = {}
+    try:
+        async for line in upstream.aiter_lines():
+            if line.startswith(":"):
+                # Heartbeat: lo propagamos para que los proxies no cierren la conexión
+                yield line + "\n\n"
+                continue
+            if line:
+                field, _, value = line.partition(":")
+                event[field] = value.removeprefix(" ")
+                continue
+            if not event:
+                continue
+
+            data = event.get("data", "{}")
+            if event.get("event") in ("created", "updated"):
+                incident = json.loads(data)
+                users_map, partial = await fetch_users_map(forward_headers, [incident])
+                data = json.dumps(hydrate([incident], users_map, partial)[0], ensure_ascii=False)
+            yield f"id: {event.get('id', '')}\nevent: {event.get('event', 'message')}\ndata: {data}\n\n"
+            event = {}
+    except httpx.HTTPError as e:
+        # El cliente (EventSource) reconectará solo enviando el último ID recibido
+        logger.warning("Feed de incidencias interrumpido: %s", e)
+        metrics.UPSTREAM_ERRORS.labels("events_feed").inc()
+    finally:
+        await upstream.aclose()
+
+
+@app.post("/incidencias-detalladas/eventos/sesion", status_code=204)
+async def open_incident_events_session(response: Response, authorization: Optional[str] = Header(None)):
+    """
+    Guarda el token de la cabecera Authorization en una cookie HttpOnly para que el
+    EventSource del navegador pueda abrir el feed. La cookie no es legible desde JS y solo
+    se envía al mismo sitio; el token se valida al abrir el feed.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Token de autenticación no proporcionado")
+    # Sin 'path': el navegador la limita a la ruta pública del feed (la que ve tras el proxy)
+    response.set_cookie(
+        EVENTS_COOKIE, token, max_age=EVENTS_COOKIE_MAX_AGE, path=None,
+        httponly=True, samesite="strict", secure=EVENTS_COOKIE_SECURE,
+    )
+
+
+@app.delete("/incidencias-detalladas/eventos/sesion", status_code=204)
+async def close_incident_events_session(response: Response):
+    response.delete_cookie(EVENTS_COOKIE, path=None, httponly=True, samesite="strict", secure=EVENTS_COOKIE_SECURE)
+
+
+@app.get("/incidencias-detalladas/eventos")
+async def incident_events_with_details(
+    authorization: Optional[str] = Header(None),
+    events_token: Optional[str] = Cookie(None, alias=EVENTS_COOKIE, description="Cookie creada por POST /incidencias-detalladas/eventos/sesion"),
+    last_event_id: Optional[str] = Header(None),
+):
+    if not authorization and events_token:
+        authorization = f"Bearer {events_token}"
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Token de autenticación no proporcionado")
+    forward_headers = {"Authorization": authorization}
+
+    upstream_headers = dict(forward_headers)
+    if last_event_id:
+        upstream_headers["Last-Event-ID"] = last_event_id
+
+    # Conexión de larga duración: sin timeout de lectura (el upstream envía heartbeats)
+    client = clients.incidents_client()
+    request = client.build_request(
+        "GET", "/incidencias/eventos",
+        headers=upstream_headers,
+        timeout=httpx.Timeout(None, connect=clients.HTTP_CONNECT_TIMEOUT),
+    )
+    try:
+        upstream = await client.send(request, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=503, detail=f"Feed de incidencias no disponible: {str(e)}")
+
+    if upstream.status_code != 200:
+        await upstream.aclose()
+        if upstream.status_code == 401:
+            raise HTTPException(status_code=401, detail="Token inválido o expirado")
+        raise HTTPException(status_code=500, detail=f"Error al abrir el feed de incidencias: {upstream.status_code}")
+
+    return StreamingResponse(
+        relay_hydrated_events(upstream, forward_headers),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,130 @@
+import os
+import time
+import httpx
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, GCCollector, Histogram, PlatformCollector,
+    ProcessCollector, generate_latest, multiprocess,
+)
+
+# Con varios workers (uvicorn --workers) cada proceso escribe sus métricas en este
+# directorio y /metrics las agrega todas (modo multiproceso de prometheus_client)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Registro propio del servicio (no el global): así varios servicios pueden convivir
+# en un mismo proceso, como en los benchmarks
+registry = CollectorRegistry()
+if not PROMETHEUS_MULTIPROC_DIR:
+    # Las métricas del proceso solo tienen sentido con un único proceso
+    ProcessCollector(registry=registry)
+    PlatformCollector(registry=registry)
+    GCCollector(registry=registry)
+
+# --- Peticiones HTTP ---
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Tiempo hasta enviar la respuesta (cabeceras), por ruta",
+    ["method", "route", "status"],
+    registry=registry,
+)
+# Los Gauge usan multiprocess_mode="livesum": suma de los workers vivos (ignorado con un solo proceso)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Peticiones en curso", multiprocess_mode="livesum", registry=registry
+)
+
+# --- Llamadas a los microservicios ---
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Latencia de las llamadas a otros servicios",
+    ["target", "method", "status"],
+    registry=registry,
+)
+PARTIAL_HYDRATIONS = Counter(
+    "partial_hydrations_total", "Bloques hidratados sin 'owner' por fallo o lentitud de users-service",
+    registry=registry,
+)
+USER_CACHE_LOOKUPS = Counter("user_cache_lookups_total", "Consultas a la caché de usuarios", ["result"], registry=registry)
+# Fallos de upstream que no llegan al cliente como error (se degrada o se corta un stream)
+UPSTREAM_ERRORS = Counter(
+    "gateway_upstream_errors_total", "Fallos de upstream absorbidos por el Gateway", ["operation"], registry=registry
+)
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia por ruta y peticiones en curso."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status_code):
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            # La ruta se resuelve durante la petición; sin ruta (404) no usamos la URL (cardinalidad)
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], route.path if route else "unmatched", str(status_code)
+            ).observe(time.perf_counter() - started)
+
+        async def send_wrapper(message):
+            # Medimos hasta las cabeceras: un stream (SSE) no infla la latencia de su ruta
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            record(500)
+            raise
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Envuelve el transporte de un cliente httpx y mide la latencia de cada llamada al upstream."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, target: str):
+        self.transport = transport
+        self.target = target
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status_label = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status_label = str(response.status_code)
+            return response
+        finally:
+            UPSTREAM_LATENCY.labels(self.target, request.method, status_label).observe(
+                time.perf_counter() - started
+            )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def metrics_response() -> Response:
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Agregamos los ficheros de todos los workers en un registro nuevo por petición
+        scrape_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(scrape_registry)
+        return Response(generate_latest(scrape_registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead():
+    """Al parar el worker: sus Gauge 'livesum' dejan de contar en la agregación."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,74 @@
+from typing import Optional
+
+from fastapi import HTTPException
+
+# Campos públicos de IncidentOut (incidents-service) y UserOut (users-service)
+INCIDENT_FIELDS = ("id", "title", "description", "status", "user_id", "created_at")
+OWNER_FIELDS = ("id", "name", "email")
+
+
+class DetailProjection:
+    """
+    Campos pedidos en /incidencias-detalladas?fields=...
+
+    - "id,title,status": solo esos campos de la incidencia y sin 'owner' (no se llama a users-service).
+    - "owner": el propietario completo; "owner.name": solo ese campo del propietario.
+    Sin 'fields' se devuelve todo, como antes.
+    """
+
+    def __init__(self, fields: Optional[str] = None):
+        self.incident_fields: Optional[list[str]] = None
+        self.owner_fields: Optional[list[str]] = None
+        self.with_owner = True
+        if not fields:
+            return
+
+        incident_fields, owner_fields, unknown = [], [], []
+        full_owner = False
+        for field in dict.fromkeys(f.strip() for f in fields.split(",") if f.strip()):
+            if field == "owner":
+                full_owner = True
+            elif field.startswith("owner."):
+                name = field.removeprefix("owner.")
+                if name in OWNER_FIELDS:
+                    owner_fields.append(name)
+                else:
+                    unknown.append(field)
+            elif field in INCIDENT_FIELDS:
+                incident_fields.append(field)
+            else:
+                unknown.append(field)
+        if unknown:
+            available = ", ".join([*INCIDENT_FIELDS, "owner", *(f"owner.{f}" for f in OWNER_FIELDS)])
+            raise HTTPException(
+                status_code=400, detail=f"Campos no permitidos: {', '.join(unknown)}. Disponibles: {available}"
+            )
+
+        self.incident_fields = incident_fields
+        self.with_owner = full_owner or bool(owner_fields)
+        self.owner_fields = None if full_owner else owner_fields
+
+    @property
+    def upstream_fields(self) -> Optional[str]:
+        """
+        Campos a pedir a incidents-service: 'owner' trae su copia del propietario y user_id
+        hace falta para hidratar con users-service las incidencias que no la tienen.
+        """
+        if self.incident_fields is None:
+            return None
+        fields = list(self.incident_fields)
+        if self.with_owner:
+            fields.append("owner")
+            if "user_id" not in fields:
+                fields.append("user_id")
+        return ",".join(fields)
+
+    def apply(self, incident: dict, owner: Optional[dict]) -> dict:
+        if self.with_owner:
+            if owner is not None and self.owner_fields is not None:
+                owner = {field: owner.get(field) for field in self.owner_fields}
+            incident["owner"] = owner
+        # user_id solo se pidió para hidratar: no se devuelve si no estaba en 'fields'
+        if self.incident_fields is not None and "user_id" not in self.incident_fields:
+            incident.pop("user_id", None)
+        return incident
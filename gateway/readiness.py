@@ -0,0 +1,30 @@
+import asyncio
+import os
+
+# Tiempo máximo para calentar los pools al arrancar (o en cada /ready mientras no lo consiga)
+READY_WARMUP_TIMEOUT = float(os.getenv("READY_WARMUP_TIMEOUT", 10))
+
+
+class Readiness:
+    """
+    Estado de /ready (distinto de /health, que solo indica que el proceso vive).
+    Cada worker calienta sus pools (BD y HTTP) al arrancar y solo se declara listo si lo
+    consigue. Si falló (p. ej. la BD aún no aceptaba conexiones), /ready lo reintenta.
+    """
+
+    def __init__(self, warm_up):
+        self.warm_up = warm_up
+        self.ready = False
+        self._lock = asyncio.Lock()
+
+    async def check(self) -> bool:
+        if self.ready:
+            return True
+        async with self._lock:
+            if not self.ready:
+                try:
+                    await asyncio.wait_for(self.warm_up(), timeout=READY_WARMUP_TIMEOUT)
+                    self.ready = True
+                except Exception:
+                    self.ready = False
+        return self.ready
@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import os
+import time
+from collections import OrderedDict, defaultdict
+from typing import Iterable, Optional
+
+from fastapi import Request, Response
+
+# Vida de las respuestas hidratadas en caché (segundos). 0 desactiva la caché
+RESPONSE_CACHE_TTL = float(os.getenv("GATEWAY_RESPONSE_CACHE_TTL", 2))
+# Memoria máxima ocupada por la caché (cuerpos sin comprimir + comprimidos)
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("GATEWAY_RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Por debajo de este tamaño no compensa comprimir
+GZIP_MIN_SIZE = int(os.getenv("GATEWAY_GZIP_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("GATEWAY_GZIP_LEVEL", 6))
+
+
+class CachedResponse:
+    """Cuerpo JSON ya serializado con su ETag fuerte y (si compensa) su versión gzip."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.gzip_body = gzip.compress(body, GZIP_LEVEL) if len(body) >= GZIP_MIN_SIZE else None
+        self.expires_at = time.monotonic() + RESPONSE_CACHE_TTL
+        # Etiquetas para invalidar solo las respuestas afectadas por un cambio (ver invalidation.py)
+        self.tags: frozenset[str] = frozenset()
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + len(self.gzip_body or b"")
+
+    def etag(self, gzipped: bool) -> str:
+        # Un ETag fuerte distinto por representación (identidad / gzip)
+        return f'"{self.digest}-gzip"' if gzipped else f'"{self.digest}"'
+
+
+class ResponseCache:
+    """LRU con TTL corto y acotada por bytes totales. Las entradas se pueden invalidar por etiqueta."""
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, CachedResponse] = OrderedDict()
+        # {etiqueta: claves de las entradas que la llevan}
+        self._tagged: defaultdict[str, set[str]] = defaultdict(set)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: CachedResponse, tags: Iterable[str] = ()):
+        if RESPONSE_CACHE_TTL <= 0 or entry.size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        entry.tags = frozenset(tags)
+        self._entries[key] = entry
+        self.size += entry.size
+        for tag in entry.tags:
+            self._tagged[tag].add(key)
+        # Expulsamos las entradas menos usadas hasta volver al límite de memoria
+        while self.size > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+
+    def invalidate(self, tags: Iterable[str]):
+        """Expulsa las entradas que llevan alguna de estas etiquetas."""
+        keys = set()
+        for tag in tags:
+            keys |= self._tagged.get(tag, set())
+        for key in keys:
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._tagged.clear()
+        self.size = 0
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+        for tag in entry.tags:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+
+def scope_key(authorization: str, request: Request) -> str:
+    """
+    Clave de caché por ámbito de autorización: cada token solo ve sus propias
+    respuestas. Se guarda el hash del token, no el token.
+    """
+    token_digest = hashlib.sha256(authorization.encode()).hexdigest()
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    return f"{token_digest}:{request.url.path}?{query}"
+
+
+def _etag_matches(if_none_match: str, entry: CachedResponse) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return entry.etag(False) in candidates or entry.etag(True) in candidates
+
+
+def build_response(entry: CachedResponse, request: Request) -> Response:
+    """Devuelve 304 si el cliente ya tiene esta versión; si no, el cuerpo (gzip si lo acepta)."""
+    use_gzip = entry.gzip_body is not None and "gzip" in request.headers.get("accept-encoding", "")
+    headers = {
+        "ETag": entry.etag(use_gzip),
+        # El cliente puede guardarla, pero debe revalidar (If-None-Match) antes de usarla
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding, Authorization",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, entry):
+        return Response(status_code=304, headers=headers)
+
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(entry.gzip_body, media_type="application/json", headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Iterable, Optional
+
+from metrics import USER_CACHE_LOOKUPS
+
+# Vida de un usuario en caché (segundos)
+USER_CACHE_TTL = float(os.getenv("GATEWAY_USER_CACHE_TTL", 60))
+# Vida de un "no encontrado" (IDs colgantes de usuarios borrados)
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("GATEWAY_USER_CACHE_NEGATIVE_TTL", 30))
+# Número máximo de usuarios (encontrados o no) en memoria
+USER_CACHE_MAXSIZE = int(os.getenv("GATEWAY_USER_CACHE_MAXSIZE", 10000))
+
+# fetch(ids) -> {id: usuario} con los que existen; lanza excepción si el upstream falla
+FetchUsers = Callable[[list[int]], Awaitable[dict[int, dict]]]
+
+
+class UserCache:
+    """
+    Caché read-through de usuarios (UserOut) para la hidratación del Gateway.
+
+    - Solo se piden a users-service los IDs que faltan o han caducado.
+    - Los IDs que el upstream no devuelve se guardan como None (caché negativa).
+    - Peticiones concurrentes que necesitan el mismo ID esperan a la misma llamada
+      en curso en vez de lanzar otra (coalescing).
+    - Un fallo del upstream nunca se cachea.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[float, Optional[dict]]] = OrderedDict()
+        self._inflight: dict[int, asyncio.Future] = {}
+
+    def _lookup(self, user_id: int, now: float):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return False, None
+        expires_at, user = entry
+        if expires_at <= now:
+            del self._entries[user_id]
+            return False, None
+        self._entries.move_to_end(user_id)
+        return True, user
+
+    def _store(self, user_id: int, user: Optional[dict], now: float):
+        ttl = USER_CACHE_TTL if user is not None else USER_CACHE_NEGATIVE_TTL
+        if self.maxsize <= 0 or ttl <= 0:
+            return
+        self._entries[user_id] = (now + ttl, user)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def forget_missing(self, user_id: int):
+        # Solo la entrada negativa: el usuario existe aunque lo tuviéramos como "no encontrado"
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[1] is None:
+            del self._entries[user_id]
+
+    async def get_many(self, user_ids: Iterable[int], fetch: FetchUsers) -> dict[int, Optional[dict]]:
+        now = time.monotonic()
+        result: dict[int, Optional[dict]] = {}
+        missing: list[int] = []
+        waiting: dict[int, asyncio.Future] = {}
+
+        for user_id in set(user_ids):
+            found, user = self._lookup(user_id, now)
+            if found:
+                self.hits += 1
+                USER_CACHE_LOOKUPS.labels("hit").inc()
+                result[user_id] = user
+            elif user_id in self._inflight:
+                waiting[user_id] = self._inflight[user_id]
+            else:
+                self.misses += 1
+                USER_CACHE_LOOKUPS.labels("miss").inc()
+                missing.append(user_id)
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            futures = {user_id: loop.create_future() for user_id in missing}
+            self._inflight.update(futures)
+            try:
+                fetched = await fetch(missing)
+            except BaseException as e:
+                # Despertamos a quien esperaba estos IDs con el mismo error
+                # (si nos cancelan, los demás no deben quedarse esperando para siempre)
+                if not isinstance(e, Exception):
+                    e = RuntimeError("Consulta de usuarios cancelada")
+                for future in futures.values():
+                    future.set_result(e)
+                raise
+            finally:
+                for user_id in missing:
+                    self._inflight.pop(user_id, None)
+
+            stored_at = time.monotonic()
+            for user_id, future in futures.items():
+                user = fetched.get(user_id)
+                self._store(user_id, user, stored_at)
+                future.set_result(user)
+                result[user_id] = user
+
+        for user_id, future in waiting.items():
+            user = await future
+            if isinstance(user, Exception):
+                raise user
+            result[user_id] = user
+
+        return result
+
+
+user_cache = UserCache()
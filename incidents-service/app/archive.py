@@ -0,0 +1,163 @@
+"""
+Archivado de incidencias cerradas. Mueve a la tabla fría 'incidents_archive' las
+incidencias cerradas con más de ARCHIVE_AFTER_DAYS días, para que los listados, la
+unicidad del título y los índices de 'incidents' solo trabajen con las vivas:
+
+    python -m app.archive                                # una pasada
+    ARCHIVE_INTERVAL_SECONDS=3600 python -m app.archive  # en bucle (docker-compose)
+
+En Postgres, 'incidents_archive' está particionada por meses de created_at: cada pasada
+crea las particiones que va a necesitar (y ARCHIVE_PARTITIONS_AHEAD meses más) y, si se
+configura ARCHIVE_RETENTION_MONTHS, desengancha las más antiguas (DETACH PARTITION): quedan
+como tablas sueltas para exportarlas o borrarlas y dejan de aparecer con include_archived.
+"""
+import asyncio
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, insert, select, text
+from .db import engine
+from .enums import StatusEnum
+from .events import EVENTS_CHANNEL, broker, notify_payload
+from . import models
+
+# Antigüedad (por created_at) a partir de la cual se archiva una incidencia cerrada
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 90))
+# Filas movidas por transacción (cada lote bloquea solo sus filas)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 5000))
+# Meses de particiones creados por adelantado tras el mes de corte
+ARCHIVE_PARTITIONS_AHEAD = int(os.getenv("ARCHIVE_PARTITIONS_AHEAD", 3))
+# Meses de archivo consultables; los anteriores se desenganchan (0 = nunca)
+ARCHIVE_RETENTION_MONTHS = int(os.getenv("ARCHIVE_RETENTION_MONTHS", 0))
+# Segundos entre pasadas (0 = una sola pasada y termina)
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", 0))
+
+ARCHIVE_TABLE = models.IncidentArchive.__tablename__
+# Origen de los NOTIFY del archivado (distinto del de cualquier worker de la API)
+EVENTS_ORIGIN = f"archive-{os.getpid()}"
+_PARTITION_NAME = re.compile(rf"{ARCHIVE_TABLE}_(\d{{4}})_(\d{{2}})")
+
+
+def _month_start(moment: datetime) -> datetime:
+    moment = moment.astimezone(timezone.utc) if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _shift_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+async def create_default_partition(conn):
+    # Recoge lo que caiga fuera de las particiones mensuales (no debería pasar: se crean antes)
+    await conn.exec_driver_sql(
+        f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE}_default PARTITION OF {ARCHIVE_TABLE} DEFAULT"
+    )
+
+
+async def ensure_partitions(conn, first: datetime, last: datetime):
+    """Crea (si no existen) las particiones mensuales de 'first' a 'last', ambos incluidos."""
+    month, last = _month_start(first), _month_start(last)
+    while month <= last:
+        following = _shift_months(month, 1)
+        await conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE}_{month:%Y_%m} PARTITION OF {ARCHIVE_TABLE} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d} 00:00:00+00') TO ('{following:%Y-%m-%d} 00:00:00+00')"
+        )
+        month = following
+
+
+async def archive_closed(older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Mueve por lotes las incidencias cerradas anteriores al corte. Cada lote es una
+    transacción: INSERT ... SELECT en el archivo y DELETE en 'incidents', y tras confirmarla
+    se publica un 'reset' (feed SSE, índice de búsqueda, cachés del Gateway). Devuelve cuántas movió.
+    """
+    hot, cold = models.Incident.__table__, models.IncidentArchive.__table__
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    archivable = (hot.c.status == StatusEnum.cerrada) & (hot.c.created_at < cutoff)
+    # FOR UPDATE: nadie reabre o edita el lote entre la copia y el borrado
+    # (SKIP LOCKED: las filas que se están editando se quedan para la siguiente pasada)
+    candidates = (
+        select(hot.c.id, hot.c.created_at).where(archivable)
+        .order_by(hot.c.created_at, hot.c.id).limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    columns = [column.name for column in hot.columns]
+
+    archived = 0
+    while True:
+        async with engine.begin() as conn:
+            batch = (await conn.execute(candidates)).all()
+            if not batch:
+                break
+            ids = [incident_id for incident_id, _ in batch]
+            if conn.dialect.name == "postgresql":
+                await ensure_partitions(conn, batch[0].created_at, batch[-1].created_at)
+            await conn.execute(
+                insert(cold).from_select(columns, select(*(hot.c[column] for column in columns)).where(hot.c.id.in_(ids)))
+            )
+            await conn.execute(delete(hot).where(hot.c.id.in_(ids)))
+            if conn.dialect.name == "postgresql":
+                # Un 'reset' por lote (los IDs no caben en un NOTIFY). Postgres lo entrega al
+                # confirmar la transacción a los relays de todos los workers de la API
+                await conn.execute(
+                    text("SELECT pg_notify(:channel, :payload)"),
+                    {"channel": EVENTS_CHANNEL, "payload": notify_payload(EVENTS_ORIGIN, "reset", {})},
+                )
+        if engine.dialect.name != "postgresql":
+            # Sin Postgres no hay relay: solo existe el broker de este proceso
+            broker.publish("reset", {})
+        archived += len(batch)
+    return archived
+
+
+async def detach_old_partitions(retention_months: int = ARCHIVE_RETENTION_MONTHS) -> list[str]:
+    """Desengancha las particiones mensuales anteriores a los últimos 'retention_months' meses."""
+    oldest_kept = _shift_months(_month_start(datetime.now(timezone.utc)), -retention_months)
+    detached = []
+    async with engine.begin() as conn:
+        rows = await conn.execute(
+            text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "WHERE parent.relname = :parent"
+            ),
+            {"parent": ARCHIVE_TABLE},
+        )
+        for (name,) in rows.all():
+            match = _PARTITION_NAME.fullmatch(name)
+            if match and datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc) < oldest_kept:
+                await conn.exec_driver_sql(f"ALTER TABLE {ARCHIVE_TABLE} DETACH PARTITION {name}")
+                detached.append(name)
+    return detached
+
+
+async def run_once():
+    archived = await archive_closed()
+    detached = []
+    if engine.dialect.name == "postgresql":
+        # Particiones de los próximos meses de corte, antes de que lleguen filas
+        cutoff = datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS)
+        async with engine.begin() as conn:
+            await ensure_partitions(conn, cutoff, _shift_months(_month_start(cutoff), ARCHIVE_PARTITIONS_AHEAD))
+        if ARCHIVE_RETENTION_MONTHS > 0:
+            detached = await detach_old_partitions()
+    print(f"Incidencias archivadas: {archived} | particiones desenganchadas: {', '.join(detached) or '-'}")
+    return archived
+
+
+async def main():
+    try:
+        while True:
+            await run_once()
+            if ARCHIVE_INTERVAL_SECONDS <= 0:
+                break
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
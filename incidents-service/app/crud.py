@@ -1,36 +1,89 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import ARRAY, DateTime, select, delete, func, tuple_, type_coerce, union_all, update
+from sqlalchemy.dialects.postgresql import array, insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException, status
-from . import models, schemas
+from datetime import datetime, timedelta, timezone
+from . import models, schemas, pagination
+from .events import broker
+from .enums import StatusEnum
 
-def create_incident(db: Session, data: schemas.IncidentCreate, user_id: int):
-    # Verificamos si ya existe un incidente con el mismo título
-    if db.scalar(select(models.Incident).where(models.Incident.title == data.title)):
+def publish_incident(event_type: str, incident: models.Incident):
+    # Se publica tras el COMMIT: los suscriptores nunca ven cambios que luego se deshacen
+    data = schemas.IncidentOut.model_validate(incident, from_attributes=True).model_dump(mode="json")
+    broker.publish(event_type, data)
+
+def owner_columns(owner: dict | None) -> dict:
+    # Copia desnormalizada del propietario (None = sin copia)
+    return {
+        "owner_name": owner["name"] if owner else None,
+        "owner_email": owner["email"] if owner else None,
+    }
+
+def owner_of(row) -> dict | None:
+    """Objeto 'owner' (como lo hidrata el Gateway) a partir de la copia guardada en la fila."""
+    if row["owner_name"] is None:
+        return None
+    return {"id": row["user_id"], "name": row["owner_name"], "email": row["owner_email"]}
+
+async def create_incident(
+    db: AsyncSession, data: schemas.IncidentCreate, user_id: int, owner: dict | None = None
+):
+    # La unicidad del título la garantiza el índice único de la BD (sin SELECT previo):
+    # si el título ya existe, ON CONFLICT DO NOTHING no devuelve fila
+    stmt = (
+        pg_insert(models.Incident)
+        .values(
+            title=data.title, 
+            description=data.description,
+            status=data.status, # Aseguramos que se pasa el status (por defecto abierta)
+            user_id=user_id,    # <--- AQUÍ VINCULAMOS LA AUTORÍA
+            **owner_columns(owner),
+        )
+        .on_conflict_do_nothing(index_elements=[models.Incident.title])
+        .returning(models.Incident)
+    )
+    incident = await db.scalar(stmt)
+    if incident is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, 
             detail="Incidente con este título ya existe"
         )
-    
-    # Creamos la instancia del modelo usando los datos del esquema + el user_id seguro
-    incident = models.Incident(
-        title=data.title, 
-        description=data.description,
-        status=data.status, # Aseguramos que se pasa el status (por defecto abierta)
-        user_id=user_id     # <--- AQUÍ VINCULAMOS LA AUTORÍA
-    )
-    db.add(incident)
-    db.commit()
-    db.refresh(incident)
+    await db.commit()
+    publish_incident("created", incident)
+    return incident
+
+async def commit_or_conflict(db: AsyncSession):
+    # Un cambio de título puede chocar con el índice único: lo traducimos al mismo 400
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, 
+            detail="Incidente con este título ya existe"
+        )
+
+async def find_incident(
+    db: AsyncSession, incident_id: int, include_archived: bool = False
+) -> models.Incident | models.IncidentArchive | None:
+    incident = await db.get(models.Incident, incident_id)
+    if incident is None and include_archived:
+        # La clave primaria del archivo es (id, created_at): se busca por id
+        Archive = models.IncidentArchive
+        incident = await db.scalar(select(Archive).where(Archive.id == incident_id))
     return incident
 
-def get_incident(db: Session, incident_id: int):
-    incident = db.get(models.Incident, incident_id)
+async def get_incident(db: AsyncSession, incident_id: int, include_archived: bool = False):
+    incident = await find_incident(db, incident_id, include_archived)
     if not incident:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Incidente no encontrado")
     return incident
 
-def update_incident(db: Session, incident_id: int, data: schemas.IncidentUpdate):
-    incident = get_incident(db, incident_id)
+async def update_incident(
+    db: AsyncSession, incident_id: int, data: schemas.IncidentUpdate, owner: dict | None = None
+):
+    incident = await get_incident(db, incident_id)
     if data.title is not None:
         incident.title = data.title
     if data.description is not None:
@@ -39,21 +92,333 @@ def update_incident(db: Session, incident_id: int, data: schemas.IncidentUpdate)
         incident.status = data.status
     if data.user_id is not None:
         incident.user_id = data.user_id
+        # 'owner' es la copia del nuevo propietario (ya validado contra users-service)
+        for column, value in owner_columns(owner).items():
+            setattr(incident, column, value)
 
-    db.commit()
-    db.refresh(incident)
+    await commit_or_conflict(db)
+    await db.refresh(incident)
+    publish_incident("updated", incident)
     return incident
 
-def list_incidents(db: Session, limit: int = 100, offset: int = 0):
-    stmt = select(models.Incident).offset(offset).limit(limit)
-    return list(db.scalars(stmt).all())
+def incidents_source(include_archived: bool = False):
+    """
+    Tabla de la que se lee: 'incidents' (solo las vivas) o, con include_archived, su UNION ALL
+    con 'incidents_archive'. Postgres aplica los filtros y el orden dentro de cada rama,
+    así que cada una sigue usando sus índices.
+    """
+    hot = models.Incident.__table__
+    if not include_archived:
+        return hot
+    cold = models.IncidentArchive.__table__
+    return union_all(
+        select(*hot.columns),
+        select(*(cold.c[column.name] for column in hot.columns)),
+    ).subquery("incidents_all")
+
+def _filter_incidents(stmt, Incident, incident_status, user_id, created_from, created_to):
+    # Filtros resueltos en SQL (respaldados por los índices compuestos del modelo)
+    if incident_status is not None:
+        stmt = stmt.where(Incident.status == incident_status)
+    if user_id is not None:
+        stmt = stmt.where(Incident.user_id == user_id)
+    if created_from is not None:
+        stmt = stmt.where(Incident.created_at >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(Incident.created_at < created_to)
+    return stmt
+
+EXPORT_COLUMNS = [*schemas.IncidentOut.model_fields, "owner_name", "owner_email"]
+
+def export_query(
+    incident_status: StatusEnum | None = None,
+    user_id: int | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    include_archived: bool = False,
+):
+    """Consulta de /incidencias/export: todas las columnas públicas y la copia del propietario, por id."""
+    Incident = incidents_source(include_archived).c
+    stmt = select(*(Incident[column] for column in EXPORT_COLUMNS))
+    stmt = _filter_incidents(stmt, Incident, incident_status, user_id, created_from, created_to)
+    return stmt.order_by(Incident.id)
+
+async def list_incidents(
+    db: AsyncSession,
+    limit: int = 100,
+    offset: int = 0,
+    cursor: str | None = None,
+    incident_status: StatusEnum | None = None,
+    user_id: int | None = None,
+    created_from: datetime | None = None,
+    created_to: datetime | None = None,
+    fields: list[str] | None = None,
+    with_owner: bool = False,
+    include_archived: bool = False,
+):
+    """
+    Lista incidencias ordenadas de más reciente a más antigua (created_at, id).
+    Devuelve (incidencias, next_cursor). next_cursor es None si no hay más páginas.
 
-def delete_incident(db: Session, incident_id: int):
-    incident = db.get(models.Incident, incident_id)
+    Se seleccionan columnas (SQLAlchemy Core), no entidades ORM: las filas son RowMapping
+    listas para serializarse sin pasar por IncidentOut. Con 'fields' solo se leen esas
+    columnas (más created_at e id, necesarias para el cursor). Con 'with_owner' se añade la
+    copia del propietario (ver owner_of). Con 'include_archived' se incluyen las archivadas.
+    """
+    Incident = incidents_source(include_archived).c
+    columns = dict.fromkeys(["id", "created_at", *(fields or schemas.IncidentOut.model_fields)])
+    if with_owner:
+        columns.update(dict.fromkeys(["user_id", "owner_name", "owner_email"]))
+    stmt = select(*(Incident[column] for column in columns))
+    stmt = _filter_incidents(stmt, Incident, incident_status, user_id, created_from, created_to)
+
+    if cursor:
+        # Keyset: continuamos justo después de la última fila de la página anterior
+        cursor_created_at, cursor_id = pagination.decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Incident.created_at, Incident.id) < (cursor_created_at, cursor_id))
+    elif offset:
+        stmt = stmt.offset(offset)
+
+    # Pedimos una fila extra para saber si existe una página siguiente
+    stmt = stmt.order_by(Incident.created_at.desc(), Incident.id.desc()).limit(limit + 1)
+    incidents = list((await db.execute(stmt)).mappings().all())
+
+    next_cursor = None
+    if len(incidents) > limit:
+        incidents = incidents[:limit]
+        last = incidents[-1]
+        next_cursor = pagination.encode_cursor(last["created_at"], last["id"])
+    return incidents, next_cursor
+
+async def delete_incident(db: AsyncSession, incident_id: int):
+    incident = await db.get(models.Incident, incident_id)
     if not incident:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="Incidente no encontrado"
         )
-    db.delete(incident)
-    db.commit()
+    await db.delete(incident)
+    await db.commit()
+    broker.publish("deleted", {"id": incident_id})
+
+# --- Operaciones en bloque: una sola transacción para todo el lote ---
+
+async def create_incidents_bulk(
+    db: AsyncSession, items: list[schemas.IncidentCreate], user_id: int, owner: dict | None = None
+):
+    Incident = models.Incident
+    results: list[schemas.BulkItemResult | None] = [None] * len(items)
+
+    # Los títulos repetidos dentro del propio lote se rechazan sin tocar la BD
+    seen_titles = set()
+    to_insert = []
+    for index, item in enumerate(items):
+        if item.title in seen_titles:
+            results[index] = schemas.BulkItemResult(
+                index=index, status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Incidente con este título ya existe"
+            )
+            continue
+        seen_titles.add(item.title)
+        to_insert.append((index, {
+            "title": item.title,
+            "description": item.description,
+            "status": item.status,
+            "user_id": user_id,
+            **owner_columns(owner),
+        }))
+
+    if to_insert:
+        # INSERT multi-fila con RETURNING (executemany). Los títulos que ya existen en la BD
+        # se descartan con ON CONFLICT y no aparecen en el RETURNING
+        stmt = (
+            pg_insert(Incident)
+            .on_conflict_do_nothing(index_elements=[Incident.title])
+            .returning(Incident)
+        )
+        created = {inc.title: inc for inc in (await db.scalars(stmt, [values for _, values in to_insert])).all()}
+        await db.commit()
+        for index, values in to_insert:
+            incident = created.get(values["title"])
+            if incident is None:
+                results[index] = schemas.BulkItemResult(
+                    index=index, status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Incidente con este título ya existe"
+                )
+                continue
+            results[index] = schemas.BulkItemResult(
+                index=index, status_code=status.HTTP_201_CREATED, id=incident.id,
+                incident=schemas.IncidentOut.model_validate(incident, from_attributes=True)
+            )
+            broker.publish("created", results[index].incident.model_dump(mode="json"))
+    return results
+
+async def update_incidents_bulk(
+    db: AsyncSession, items: list[schemas.IncidentBulkUpdate], owners: dict[int, dict] | None = None
+):
+    Incident = models.Incident
+    ids = {item.id for item in items}
+    incidents = {inc.id: inc for inc in (await db.scalars(select(Incident).where(Incident.id.in_(ids)))).all()}
+    # Títulos pedidos que ya usa otra incidencia: una sola consulta para todo el lote
+    titles = {item.title for item in items if item.title is not None}
+    taken = dict((await db.execute(select(Incident.title, Incident.id).where(Incident.title.in_(titles)))).all()) if titles else {}
+
+    results = []
+    seen_titles = set()
+    for index, item in enumerate(items):
+        incident = incidents.get(item.id)
+        if incident is None:
+            results.append(schemas.BulkItemResult(
+                index=index, status_code=status.HTTP_404_NOT_FOUND, id=item.id,
+                detail="Incidente no encontrado"
+            ))
+            continue
+        # Un título en uso (en la BD o por un elemento anterior del lote) se rechaza solo
+        # para ese elemento, sin deshacer el resto
+        if item.title is not None and (item.title in seen_titles or taken.get(item.title, item.id) != item.id):
+            results.append(schemas.BulkItemResult(
+                index=index, status_code=status.HTTP_400_BAD_REQUEST, id=item.id,
+                detail="Incidente con este título ya existe"
+            ))
+            continue
+        # user_id validado previamente contra users-service (en una sola llamada por lote):
+        # 'owners' solo contiene los propietarios que existen
+        if item.user_id is not None and item.user_id not in (owners or {}):
+            results.append(schemas.BulkItemResult(
+                index=index, status_code=status.HTTP_404_NOT_FOUND, id=item.id,
+                detail=f"El usuario con ID {item.user_id} no existe."
+            ))
+            continue
+        if item.title is not None:
+            seen_titles.add(item.title)
+        values = item.model_dump(exclude={"id"}, exclude_none=True)
+        if item.user_id is not None:
+            values.update(owner_columns(owners[item.user_id]))
+        for field, value in values.items():
+            setattr(incident, field, value)
+        # Copia del estado tras este elemento: un mismo ID puede repetirse más adelante en el lote
+        results.append(schemas.BulkItemResult(
+            index=index, status_code=status.HTTP_200_OK, id=item.id,
+            incident=schemas.IncidentOut.model_validate(incident, from_attributes=True)
+        ))
+
+    # El flush agrupa los UPDATE del lote y se confirman en un único COMMIT
+    # (commit_or_conflict solo salta si otra petición ocupa el título entretanto)
+    await commit_or_conflict(db)
+    for result in results:
+        if result.status_code == status.HTTP_200_OK:
+            broker.publish("updated", result.incident.model_dump(mode="json"))
+    return results
+
+async def delete_incidents_bulk(db: AsyncSession, incident_ids: list[int]):
+    Incident = models.Incident
+    stmt = delete(Incident).where(Incident.id.in_(set(incident_ids))).returning(Incident.id)
+    deleted = set((await db.scalars(stmt)).all())
+    await db.commit()
+    for incident_id in deleted:
+        broker.publish("deleted", {"id": incident_id})
+
+    # Un ID repetido solo se borra una vez: las repeticiones se informan como 404
+    results = []
+    for index, incident_id in enumerate(incident_ids):
+        if incident_id in deleted:
+            deleted.discard(incident_id)
+            results.append(schemas.BulkItemResult(index=index, status_code=status.HTTP_204_NO_CONTENT, id=incident_id))
+        else:
+            results.append(schemas.BulkItemResult(
+                index=index, status_code=status.HTTP_404_NOT_FOUND, id=incident_id,
+                detail="Incidente no encontrado"
+            ))
+    return results
+
+async def set_owner_snapshot(db: AsyncSession, user_id: int, owner: dict | None) -> int:
+    """
+    Actualiza la copia del propietario en todas sus incidencias (un único UPDATE sobre el
+    índice de user_id), también en las archivadas. Con owner=None se vacía (p. ej. el
+    usuario se ha borrado). Devuelve cuántas incidencias vivas cambió.
+    """
+    values = owner_columns(owner)
+    result = await db.execute(update(models.Incident).where(models.Incident.user_id == user_id).values(**values))
+    Archive = models.IncidentArchive
+    await db.execute(update(Archive).where(Archive.user_id == user_id).values(**values))
+    await db.commit()
+    return result.rowcount
+
+# --- Estadísticas ---
+
+OPEN_AGE_PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99, "max": 1.0}
+
+async def get_incident_stats(
+    db: AsyncSession, days: int = 30, top_users: int = 50, include_archived: bool = False
+) -> schemas.IncidentStats:
+    """
+    Agregados calculados en la BD (GROUP BY sobre los índices existentes): solo viajan
+    unas pocas filas en lugar de la tabla completa. Por defecto solo las incidencias vivas.
+    """
+    source = incidents_source(include_archived)
+    Incident = source.c
+    now = datetime.now(timezone.utc)
+
+    # 1. Conteo por estado (todos los estados aparecen, aunque sea con 0)
+    rows = await db.execute(select(Incident.status, func.count()).group_by(Incident.status))
+    by_status = {s: 0 for s in StatusEnum}
+    by_status.update({incident_status: count for incident_status, count in rows})
+
+    # 2. Usuarios con más incidencias
+    rows = await db.execute(
+        select(Incident.user_id, func.count().label("count"))
+        .group_by(Incident.user_id)
+        .order_by(func.count().desc(), Incident.user_id)
+        .limit(top_users)
+    )
+    by_user = [schemas.UserIncidentCount(user_id=user_id, count=count) for user_id, count in rows]
+
+    # 3. Percentiles de antigüedad de las no cerradas, ordenadas de más reciente a más antigua
+    open_filter = Incident.status != StatusEnum.cerrada
+    if db.bind.dialect.name == "postgresql":
+        # Todos los percentiles en una sola pasada: percentile_disc(ARRAY[...]) WITHIN GROUP
+        percentile_disc = func.percentile_disc(array(list(OPEN_AGE_PERCENTILES.values())))
+        created = await db.scalar(
+            select(type_coerce(
+                percentile_disc.within_group(Incident.created_at.desc()), ARRAY(DateTime(timezone=True))
+            ))
+            .where(open_filter)
+        )
+        percentiles = dict(zip(OPEN_AGE_PERCENTILES, created or []))
+    else:
+        # SQLite no tiene percentile_disc (nearest-rank): el percentil p es la fila en la
+        # posición p * (n - 1), una consulta por percentil
+        open_count = await db.scalar(select(func.count()).select_from(source).where(open_filter))
+        percentiles = {}
+        for name, pct in OPEN_AGE_PERCENTILES.items():
+            if not open_count:
+                break
+            percentiles[name] = await db.scalar(
+                select(Incident.created_at).where(open_filter)
+                .order_by(Incident.created_at.desc())
+                .offset(round(pct * (open_count - 1))).limit(1)
+            )
+    open_age = {}
+    for name, created_at in percentiles.items():
+        if created_at.tzinfo is None:
+            # SQLite devuelve fechas sin zona (guardadas en UTC)
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        open_age[name] = round((now - created_at).total_seconds(), 3)
+
+    # 4. Altas por día de los últimos 'days' días
+    day = func.date(Incident.created_at)
+    rows = await db.execute(
+        select(day, func.count())
+        .where(Incident.created_at >= now - timedelta(days=days))
+        .group_by(day)
+        .order_by(day)
+    )
+    created_per_day = [schemas.DailyCount(day=str(d), count=count) for d, count in rows]
+
+    return schemas.IncidentStats(
+        total=sum(by_status.values()),
+        by_status=by_status,
+        by_user=by_user,
+        open_age_seconds=schemas.OpenAgePercentiles(**open_age),
+        created_per_day=created_per_day,
+    )
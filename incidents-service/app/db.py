@@ -1,7 +1,12 @@
 import os
+import time
 import urllib.parse
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from sqlalchemy import event, inspect, text
+from contextlib import AsyncExitStack, asynccontextmanager
+from fastapi import Request
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import DeclarativeBase, Session
+from .metrics import TimedPool
 
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
@@ -9,23 +14,174 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
-if not DB_USER or not DB_PASSWORD or not DB_HOST:
-    raise ValueError("Faltan variables de entorno críticas para la base de datos.")
+# DATABASE_URL completa tiene prioridad (p. ej. SQLite en los benchmarks locales)
+DATABASE_URL = os.getenv("DATABASE_URL")
 
-#Codificamos la contraseña para permitir caracteres especiales
-encoded_password = urllib.parse.quote_plus(DB_PASSWORD)
+if not DATABASE_URL:
+    if not DB_USER or not DB_PASSWORD or not DB_HOST:
+        raise ValueError("Faltan variables de entorno críticas para la base de datos.")
 
-DATABASE_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    #Codificamos la contraseña para permitir caracteres especiales
+    encoded_password = urllib.parse.quote_plus(DB_PASSWORD)
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
+    # psycopg 3 tiene driver asíncrono nativo: SQLAlchemy lo usa automáticamente con create_async_engine
+    DATABASE_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+# Réplica de solo lectura opcional: URL completa o DB_REPLICA_HOST con las mismas credenciales.
+# Sin réplica todas las lecturas van al primario
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST")
+if not DATABASE_REPLICA_URL and DB_REPLICA_HOST:
+    DATABASE_REPLICA_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_REPLICA_HOST}:{DB_PORT}/{DB_NAME}"
+# Segundos que las lecturas de un token que acaba de escribir siguen yendo al primario
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+REPLICA_STICKY_MAXSIZE = int(os.getenv("REPLICA_STICKY_MAXSIZE", 10000))
+
+# Tamaño del pool de conexiones (ajustable por entorno, el mismo para primario y réplica)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Conexiones que cada worker abre al arrancar, antes de declararse listo (/ready)
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", 2))
+
+def _create_engine(url: str):
+    return create_async_engine(
+        url,
+        # Pool con medición del tiempo de espera por conexión (ver metrics.py)
+        poolclass=TimedPool,
+        pool_pre_ping=True,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+
+engine = _create_engine(DATABASE_URL)
+replica_engine = _create_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None
+
+class PrimarySession(Session):
+    """Sesiones del primario (las únicas que escriben): ver _remember_writer."""
+
+# expire_on_commit=False: los objetos siguen siendo legibles tras el commit sin lazy-loads
+SessionLocal = async_sessionmaker(
+    bind=engine, autoflush=False, expire_on_commit=False, sync_session_class=PrimarySession
+)
+ReplicaSessionLocal = (
+    async_sessionmaker(bind=replica_engine, autoflush=False, expire_on_commit=False, info={"replica": True})
+    if replica_engine is not None else None
+)
+
+
+class RecentWriters:
+    """
+    Read-your-writes: recuerda qué tokens han confirmado escrituras en los últimos
+    REPLICA_STICKY_SECONDS. Sus lecturas van al primario hasta que la réplica se pone al día.
+    Es por proceso: con varios workers solo cubre las peticiones que caen en el mismo worker.
+    """
+
+    def __init__(self, seconds: float = REPLICA_STICKY_SECONDS, maxsize: int = REPLICA_STICKY_MAXSIZE):
+        self.seconds = seconds
+        self.maxsize = maxsize
+        self._until: dict[str, float] = {}
+
+    def mark(self, key: str):
+        now = time.monotonic()
+        if len(self._until) >= self.maxsize:
+            self._until = {k: until for k, until in self._until.items() if until > now}
+            if len(self._until) >= self.maxsize:
+                self._until.clear()
+        self._until[key] = now + self.seconds
+
+    def is_recent(self, key: str | None) -> bool:
+        until = self._until.get(key) if key else None
+        return until is not None and until > time.monotonic()
+
+
+recent_writers = RecentWriters()
+
+@event.listens_for(PrimarySession, "after_commit")
+def _remember_writer(session):
+    writer = session.info.get("writer")
+    if writer:
+        recent_writers.mark(writer)
 
 class Base(DeclarativeBase):
     pass
 
-def get_db():
-    db = SessionLocal()
-    try:
+def add_missing_columns(conn, table):
+    """
+    create_all no modifica tablas que ya existen: añade (vacías) las columnas nuevas
+    del modelo que aún no estén en la BD. Solo vale para columnas que admiten NULL.
+    """
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+
+def add_missing_indexes(conn, table):
+    """
+    create_all tampoco añade índices a tablas existentes: crea los del modelo que falten
+    (checkfirst) y un índice único por cada columna unique=True sin restricción en la BD.
+    """
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+    inspector = inspect(conn)
+    unique_sets = [constraint["column_names"] for constraint in inspector.get_unique_constraints(table.name)]
+    unique_sets += [index["column_names"] for index in inspector.get_indexes(table.name) if index["unique"]]
+    for column in table.columns:
+        if column.unique and [column.name] not in unique_sets:
+            # Mismo nombre que la restricción que crea create_all en Postgres
+            conn.execute(text(f"CREATE UNIQUE INDEX {table.name}_{column.name}_key ON {table.name} ({column.name})"))
+
+async def warm_pool(connections: int = DB_POOL_WARMUP):
+    """Abre 'connections' conexiones a la vez (en cada engine) y las deja en el pool para la primera petición."""
+    async with AsyncExitStack() as stack:
+        for pool_engine in filter(None, (engine, replica_engine)):
+            for _ in range(min(connections, DB_POOL_SIZE)):
+                conn = await stack.enter_async_context(pool_engine.connect())
+                await conn.exec_driver_sql("SELECT 1")
+
+async def get_db(request: Request):
+    """Sesión del primario (escrituras). Al confirmar, el token queda 'pegado' al primario."""
+    async with SessionLocal() as db:
+        db.info["writer"] = request.headers.get("authorization")
+        yield db
+
+def _reads_from_primary(request: Request) -> bool:
+    return replica_engine is None or recent_writers.is_recent(request.headers.get("authorization"))
+
+async def get_read_db(request: Request):
+    """
+    Sesión de lectura: la réplica si está configurada y el token no ha escrito en los
+    últimos REPLICA_STICKY_SECONDS; si no, el primario.
+    """
+    if _reads_from_primary(request):
+        session_factory = SessionLocal
+    else:
+        session_factory = ReplicaSessionLocal
+    async with session_factory() as db:
+        yield db
+
+def get_read_engine(request: Request):
+    """
+    Engine de lectura para consultas fuera de sesión (exportaciones en streaming), con el
+    mismo criterio que get_read_db.
+    """
+    return engine if _reads_from_primary(request) else replica_engine
+
+def is_replica(db: AsyncSession) -> bool:
+    return db.info.get("replica", False)
+
+@asynccontextmanager
+async def primary_for(db: AsyncSession):
+    """
+    La propia sesión si ya es del primario; si es de la réplica, una del primario. Para
+    confirmar una búsqueda que falla en la réplica (p. ej. una fila recién creada por otro).
+    """
+    if not is_replica(db):
         yield db
-    finally:
-        db.close()
+        return
+    async with SessionLocal() as primary:
+        yield primary
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+import psycopg
+
+# Número de eventos recientes que se conservan para reanudar (Last-Event-ID)
+EVENTS_HISTORY_SIZE = int(os.getenv("EVENTS_HISTORY_SIZE", 1000))
+# Eventos pendientes por suscriptor antes de considerarlo demasiado lento
+EVENTS_SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_SUBSCRIBER_QUEUE_SIZE", 1000))
+# Cada cuántos segundos se envía un comentario SSE para mantener viva la conexión
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", 15))
+# Canal de Postgres (LISTEN/NOTIFY) que reparte los eventos entre workers y réplicas
+EVENTS_CHANNEL = "incident_events"
+# Espera antes de reconectar el relay si se pierde la conexión con Postgres
+EVENTS_RELAY_RETRY_SECONDS = float(os.getenv("EVENTS_RELAY_RETRY_SECONDS", 1))
+
+logger = logging.getLogger(__name__)
+
+
+def notify_payload(origin: str, event_type: str, data: dict) -> str:
+    """Mensaje NOTIFY del relay. 'origin' evita que un proceso vuelva a publicar sus propios eventos."""
+    return json.dumps({"origin": origin, "type": event_type, "data": data}, default=str)
+
+
+class _Subscriber:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class IncidentEventBroker:
+    """
+    Broker en proceso de eventos de incidencias (created / updated / deleted). Los cambios
+    en bloque (archivado, importaciones) publican un 'reset' por lote: el cliente recarga.
+
+    Los IDs de evento son "<arranque>-<secuencia>": si el proceso se reinicia, un cliente
+    que reanuda con un ID de otro arranque (o demasiado antiguo para el historial)
+    recibe un evento 'reset' y debe volver a cargar el listado completo.
+    """
+
+    def __init__(self, history_size: int = EVENTS_HISTORY_SIZE):
+        self.epoch = str(int(time.time() * 1000))
+        self._seq = 0
+        self._history: deque[tuple[int, str, str]] = deque(maxlen=history_size)
+        self._subscribers: set[_Subscriber] = set()
+        # Callbacks en proceso (p. ej. el índice de búsqueda en memoria) que reciben cada evento
+        self._listeners: list = []
+        # Reenvío a los demás procesos (PostgresEventRelay), si está activo
+        self.relay: "PostgresEventRelay | None" = None
+
+    def add_listener(self, callback):
+        """Registra callback(event_type, data) para cada evento publicado."""
+        self._listeners.append(callback)
+
+    def publish(self, event_type: str, data: dict, remote: bool = False):
+        """remote=True: el evento llega de otro proceso y no se vuelve a reenviar."""
+        for listener in self._listeners:
+            listener(event_type, data)
+        if self.relay is not None and not remote:
+            self.relay.send(event_type, data)
+        self._seq += 1
+        event = (self._seq, event_type, json.dumps(data, default=str))
+        self._history.append(event)
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Cliente demasiado lento: lo desconectamos con un 'reset'
+                subscriber.overflowed = True
+                self._subscribers.discard(subscriber)
+
+    def reset_subscribers(self):
+        """Se han podido perder eventos: todos los suscriptores reciben 'reset' y se desconectan."""
+        for subscriber in list(self._subscribers):
+            subscriber.overflowed = True
+            self._subscribers.discard(subscriber)
+
+    def _parse_event_id(self, last_event_id: str | None) -> int | None:
+        """Devuelve la secuencia desde la que reanudar, o None si hay que hacer 'reset'."""
+        if not last_event_id:
+            return self._seq
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        oldest = self._history[0][0] if self._history else self._seq + 1
+        # Se perdieron eventos que ya no están en el historial
+        if seq < oldest - 1:
+            return None
+        return seq
+
+    def _format(self, seq: int, event_type: str, data: str) -> str:
+        return f"id: {self.epoch}-{seq}\nevent: {event_type}\ndata: {data}\n\n"
+
+    async def stream(self, last_event_id: str | None = None):
+        """Generador SSE: primero los eventos perdidos, después los nuevos en vivo."""
+        subscriber = _Subscriber()
+        self._subscribers.add(subscriber)
+        try:
+            resume_from = self._parse_event_id(last_event_id)
+            if resume_from is None:
+                resume_from = self._seq
+                yield self._format(self._seq, "reset", "{}")
+            else:
+                for seq, event_type, data in list(self._history):
+                    if seq > resume_from:
+                        yield self._format(seq, event_type, data)
+                        resume_from = seq
+
+            while True:
+                try:
+                    seq, event_type, data = await asyncio.wait_for(
+                        subscriber.queue.get(), timeout=EVENTS_HEARTBEAT_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    if subscriber.overflowed:
+                        yield self._format(self._seq, "reset", "{}")
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                # Los eventos ya enviados desde el historial no se repiten
+                if seq > resume_from:
+                    yield self._format(seq, event_type, data)
+                if subscriber.overflowed and subscriber.queue.empty():
+                    yield self._format(self._seq, "reset", "{}")
+                    break
+        finally:
+            self._subscribers.discard(subscriber)
+
+
+class PostgresEventRelay:
+    """
+    Con varios workers (o réplicas) cada proceso tiene su propio broker. Los eventos
+    publicados en uno se envían al resto con NOTIFY y cada proceso los recibe con LISTEN,
+    así un cliente SSE ve los cambios hechos en cualquier worker. Usa dos conexiones
+    propias (fuera del pool de SQLAlchemy) y se reconecta solo si se pierden.
+
+    Los IDs de evento siguen siendo por proceso: un cliente que reanuda en otro worker
+    recibe 'reset' y recarga el listado.
+    """
+
+    def __init__(self, broker: "IncidentEventBroker", dsn: str):
+        self.broker = broker
+        self.dsn = dsn
+        self.origin = f"{os.getpid()}-{broker.epoch}"
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._send_loop()), asyncio.create_task(self._listen_loop())]
+        self.broker.relay = self
+
+    async def stop(self):
+        self.broker.relay = None
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def send(self, event_type: str, data: dict):
+        self._outbox.put_nowait(notify_payload(self.origin, event_type, data))
+
+    async def _send_loop(self):
+        payload = None
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    while True:
+                        if payload is None:
+                            payload = await self._outbox.get()
+                        await conn.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, payload))
+                        # Solo se descarta cuando se ha enviado: tras reconectar se reintenta
+                        payload = None
+            except psycopg.OperationalError as e:
+                logger.warning("Relay de eventos (NOTIFY) desconectado, reintentando: %s", e)
+                await asyncio.sleep(EVENTS_RELAY_RETRY_SECONDS)
+            except Exception:
+                # Cualquier otro fallo no debe parar el relay. El evento se descarta
+                # (p. ej. demasiado grande para NOTIFY): reenviarlo fallaría igual
+                logger.exception("Error enviando un evento por NOTIFY: se descarta")
+                payload = None
+                await asyncio.sleep(EVENTS_RELAY_RETRY_SECONDS)
+
+    async def _listen_loop(self):
+        connected_before = False
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {EVENTS_CHANNEL}")
+                    if connected_before:
+                        # Mientras estuvo desconectado se pudieron perder eventos de otros workers
+                        self.broker.reset_subscribers()
+                    connected_before = True
+                    async for notify in conn.notifies():
+                        message = json.loads(notify.payload)
+                        if message["origin"] != self.origin:
+                            self.broker.publish(message["type"], message["data"], remote=True)
+            except psycopg.OperationalError as e:
+                logger.warning("Relay de eventos (LISTEN) desconectado, reintentando: %s", e)
+                await asyncio.sleep(EVENTS_RELAY_RETRY_SECONDS)
+            except Exception:
+                # Se reconecta igual que tras perder la conexión (los suscriptores reciben 'reset')
+                logger.exception("Error recibiendo eventos por LISTEN, reconectando")
+                await asyncio.sleep(EVENTS_RELAY_RETRY_SECONDS)
+
+
+broker = IncidentEventBroker()
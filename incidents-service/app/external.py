@@ -1,32 +1,179 @@
 import os
+import time
+from collections import OrderedDict
 import httpx
 from fastapi import HTTPException, status
+from .metrics import InstrumentedTransport
 
 # Leemos la URL del servicio de usuarios de las variables de entorno
 USERS_SERVICE_URL = os.getenv("USERS_SERVICE_URL")
+# Timeout corto para no bloquear la API si el otro servicio es lento
+USERS_SERVICE_TIMEOUT = float(os.getenv("USERS_SERVICE_TIMEOUT", 5))
+USERS_HTTP_MAX_CONNECTIONS = int(os.getenv("USERS_HTTP_MAX_CONNECTIONS", 20))
+# Segundos que un usuario validado no vuelve a consultarse
+USER_VALIDATION_CACHE_TTL = float(os.getenv("USER_VALIDATION_CACHE_TTL", 300))
+USER_VALIDATION_CACHE_MAXSIZE = int(os.getenv("USER_VALIDATION_CACHE_MAXSIZE", 10000))
+# Circuit breaker: fallos seguidos para abrirlo y segundos hasta volver a probar
+USERS_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("USERS_CIRCUIT_FAILURE_THRESHOLD", 5))
+USERS_CIRCUIT_RESET_SECONDS = float(os.getenv("USERS_CIRCUIT_RESET_SECONDS", 30))
 
-def validate_user_exists(user_id: int):
-    url = f"{USERS_SERVICE_URL}/usuarios/{user_id}"
-    try:
-        # Timeout corto para no bloquear la API si el otro servicio es lento
-        response = httpx.get(url, timeout=5.0)
-        
-        if response.status_code == 404:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                detail=f"El usuario con ID {user_id} no existe."
-            )
-        
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, 
-                detail="Error validando el usuario en el servicio externo."
-            )
-            
+
+class CircuitBreaker:
+    """
+    Tras N fallos seguidos deja de llamar al servicio durante un tiempo y falla
+    al instante (503). Pasado ese tiempo deja pasar una única llamada de prueba;
+    el resto sigue fallando al instante hasta conocer su resultado.
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.probe_started_at: float | None = None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at < self.reset_seconds:
+            return False
+        # Semiabierto: una sola prueba en curso (si no termina nunca, otra tras reset_seconds)
+        if self.probe_started_at is not None and now - self.probe_started_at < self.reset_seconds:
+            return False
+        self.probe_started_at = now
         return True
 
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_started_at = None
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker(USERS_CIRCUIT_FAILURE_THRESHOLD, USERS_CIRCUIT_RESET_SECONDS)
+
+# Cliente con pool de conexiones compartido (se abre y se cierra en el lifespan de la app)
+_client: httpx.AsyncClient | None = None
+# {user_id: (instante de caducidad, {"name", "email"})} de los usuarios que ya sabemos que existen
+# (LRU: al llenarse se descartan los menos usados)
+_owners: OrderedDict[int, tuple[float, dict]] = OrderedDict()
+
+
+async def start_client(transport: httpx.AsyncBaseTransport | None = None):
+    global _client
+    # 'transport' permite sustituir la red (p. ej. ASGI en los benchmarks)
+    limits = httpx.Limits(max_connections=USERS_HTTP_MAX_CONNECTIONS)
+    transport = transport or httpx.AsyncHTTPTransport(limits=limits)
+    _client = httpx.AsyncClient(
+        base_url=USERS_SERVICE_URL,
+        timeout=USERS_SERVICE_TIMEOUT,
+        transport=InstrumentedTransport(transport, "users"),
+    )
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def warm_up():
+    """Abre la conexión con users-service antes de la primera petición (si no responde, se sigue)."""
+    try:
+        await _client.get("/health")
+    except httpx.HTTPError:
+        pass
+
+
+def _unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="No se pudo conectar con el servicio de usuarios."
+    )
+
+
+async def lookup_owners(user_ids, token: str) -> dict[int, dict]:
+    """
+    Devuelve {user_id: {"name", "email"}} de los IDs que existen en users-service (los que
+    no aparecen no existen). Los ya conocidos se sirven desde caché y el resto se pide
+    en una sola llamada a /usuarios/batch.
+    """
+    now = time.monotonic()
+    owners, pending = {}, []
+    for user_id in set(user_ids):
+        cached = _owners.get(user_id)
+        if cached is not None and cached[0] > now:
+            _owners.move_to_end(user_id)
+            owners[user_id] = cached[1]
+        else:
+            pending.append(user_id)
+    if not pending:
+        return owners
+
+    if not breaker.allow():
+        raise _unavailable()
+
+    try:
+        # Los endpoints de users-service están protegidos: reenviamos el token del usuario
+        response = await _client.post(
+            "/usuarios/batch",
+            json=pending,
+            params={"fields": "id,name,email"},
+            headers={"Authorization": f"Bearer {token}"},
+        )
     except httpx.RequestError:
+        breaker.record_failure()
+        raise _unavailable()
+
+    if response.status_code >= 500:
+        breaker.record_failure()
+        raise _unavailable()
+    breaker.record_success()
+
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Error validando el usuario en el servicio externo."
+        )
+
+    users = response.json()
+    expires_at = time.monotonic() + USER_VALIDATION_CACHE_TTL
+    for user in users:
+        owner = {"name": user["name"], "email": user["email"]}
+        _owners[user["id"]] = (expires_at, owner)
+        _owners.move_to_end(user["id"])
+        owners[user["id"]] = owner
+    while len(_owners) > USER_VALIDATION_CACHE_MAXSIZE:
+        _owners.popitem(last=False)
+    return owners
+
+
+async def validate_user_exists(user_id: int, token: str) -> dict:
+    """Comprueba que el usuario existe y devuelve su copia {"name", "email"}."""
+    owner = (await lookup_owners([user_id], token)).get(user_id)
+    if owner is None:
         raise HTTPException(
-            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
-            detail="No se pudo conectar con el servicio de usuarios."
-        )
\ No newline at end of file
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"El usuario con ID {user_id} no existe."
+        )
+    return owner
+
+
+async def owner_snapshot(user_id: int, token: str) -> dict | None:
+    """Copia del propietario para una incidencia nueva. Sin users-service se crea sin copia."""
+    try:
+        return (await lookup_owners([user_id], token)).get(user_id)
+    except HTTPException:
+        return None
+
+
+def forget_owner(user_id: int):
+    # users-service notificó un cambio: la próxima consulta vuelve a pedirlo
+    _owners.pop(user_id, None)
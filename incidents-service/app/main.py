@@ -1,68 +1,337 @@
-from fastapi import FastAPI, Depends, Query
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Literal, Optional
+from fastapi import FastAPI, Body, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from .db import Base, engine, get_db
-from . import models, schemas, crud
+from sqlalchemy.ext.asyncio import AsyncSession
+from .enums import StatusEnum
+from .db import engine, replica_engine, recent_writers, get_db, get_read_db, get_read_engine, primary_for, warm_pool
+from .events import PostgresEventRelay, broker
+from .readiness import Readiness
+from . import models, schemas, crud, external, metrics, projection, search, transfer, transfer_format
 # Importamos nuestro módulo de seguridad
 from . import security 
 
-Base.metadata.create_all(bind=engine)
-app = FastAPI(title="Microservicio de Incidencias")
+async def warm_up():
+    await warm_pool()
+    await external.warm_up()
+
+readiness = Readiness(warm_up)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El esquema lo crea el paso de migración (python -m app.migrate), no cada worker
+    await external.start_client()
+    relay = None
+    if engine.dialect.name == "postgresql":
+        # Reparte los eventos SSE entre los workers (LISTEN/NOTIFY)
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        relay = PostgresEventRelay(broker, dsn)
+        await relay.start()
+    # Pools calientes antes de aceptar tráfico (si falla, /ready lo reintenta)
+    await readiness.check()
+    yield
+    if relay is not None:
+        await relay.stop()
+    await external.close_client()
+    await engine.dispose()
+    metrics.mark_process_dead()
+
+app = FastAPI(title="Microservicio de Incidencias", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine)
+if replica_engine is not None:
+    metrics.instrument_engine(replica_engine, "replica")
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Next-Offset"],
 )
 
 @app.get("/health")
-def health():
+async def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    # Listo = pools de BD y HTTP calientes (distinto de /health: el proceso vive)
+    if not await readiness.check():
+        raise HTTPException(status_code=503, detail="Servicio no preparado")
+    return {"status": "ready"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    # Formato de exposición de Prometheus
+    return metrics.metrics_response()
+
 # --- PROTEGIDO (Ya lo tenías) ---
 @app.post("/incidencias", response_model=schemas.IncidentOut, status_code=201)
-def create_incident_endpoint(
+async def create_incident_endpoint(
     payload: schemas.IncidentCreate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    token: str = Depends(security.oauth2_scheme),
     current_user_id: int = Depends(security.get_current_user_id)
 ):
-
+    # Copia del propietario para el listado hidratado (en caché tras la primera vez)
+    owner = await external.owner_snapshot(current_user_id, token)
     # Llamamos al CRUD pasando el ID del token por separado
-    return crud.create_incident(db, payload, user_id=current_user_id)
+    return await crud.create_incident(db, payload, user_id=current_user_id, owner=owner)
 
 
 @app.get("/incidencias", response_model=list[schemas.IncidentOut])
-def list_incidents_endpoint(
-    db: Session = Depends(get_db), 
+async def list_incidents_endpoint(
+    db: AsyncSession = Depends(get_read_db), 
     limit: int = Query(100, ge=1, le=1000), 
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto en la cabecera X-Next-Cursor"),
+    status: Optional[StatusEnum] = Query(None),
+    user_id: Optional[int] = Query(None),
+    created_from: Optional[datetime] = Query(None),
+    created_to: Optional[datetime] = Query(None),
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por comas (p. ej. id,title,status)"),
+    include_archived: bool = Query(False, description="Incluye las incidencias cerradas archivadas"),
     _ : int = Depends(security.get_current_user_id) 
 ):
-    return crud.list_incidents(db, limit, offset)
+    selected = projection.parse_fields(fields, schemas.IncidentOut.model_fields)
+    incidents, next_cursor = await crud.list_incidents(
+        db, limit, offset,
+        cursor=cursor,
+        incident_status=status,
+        user_id=user_id,
+        created_from=created_from,
+        created_to=created_to,
+        fields=selected,
+        include_archived=include_archived,
+    )
+    # El cuerpo sigue siendo una lista; el cursor de la siguiente página va en cabecera.
+    # response_model solo documenta: las filas se serializan directamente a bytes JSON
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return projection.rows_response(incidents, selected or list(schemas.IncidentOut.model_fields), headers)
+
+# --- LISTADO HIDRATADO (copia desnormalizada del propietario) ---
+# Declarado antes de /incidencias/{incident_id}
+
+DETAIL_FIELDS = [*schemas.IncidentOut.model_fields, "owner"]
+
+@app.get("/incidencias/detalladas", response_model=list[schemas.IncidentDetailOut])
+async def list_detailed_incidents_endpoint(
+    db: AsyncSession = Depends(get_read_db),
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursor opaco devuelto en la cabecera X-Next-Cursor"),
+    status: Optional[StatusEnum] = Query(None),
+    user_id: Optional[int] = Query(None),
+    created_from: Optional[datetime] = Query(None),
+    created_to: Optional[datetime] = Query(None),
+    fields: Optional[str] = Query(None, description="Campos a devolver separados por comas (p. ej. id,title,owner)"),
+    include_archived: bool = Query(False, description="Incluye las incidencias cerradas archivadas"),
+    _ : int = Depends(security.get_current_user_id)
+):
+    """
+    Igual que /incidencias pero con 'owner' incluido, leído de la propia fila: una sola
+    consulta y ninguna llamada a users-service. owner es null si la fila aún no tiene copia.
+    """
+    selected = projection.parse_fields(fields, DETAIL_FIELDS) or DETAIL_FIELDS
+    incident_fields = [field for field in selected if field != "owner"]
+    with_owner = "owner" in selected
+    incidents, next_cursor = await crud.list_incidents(
+        db, limit, offset,
+        cursor=cursor,
+        incident_status=status,
+        user_id=user_id,
+        created_from=created_from,
+        created_to=created_to,
+        fields=incident_fields or ["id"],
+        with_owner=with_owner,
+        include_archived=include_archived,
+    )
+    if with_owner:
+        incidents = [{**row, "owner": crud.owner_of(row)} for row in incidents]
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return projection.rows_response(incidents, selected, headers)
+
+@app.delete("/incidencias/owners/{user_id}", status_code=204)
+async def clear_owner_snapshot_endpoint(
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    _ : None = Depends(security.require_internal_service)
+):
+    # Lo llama users-service al borrar un usuario (con la credencial interna, no con el
+    # token de quien borra): sus incidencias se quedan sin copia
+    external.forget_owner(user_id)
+    await crud.set_owner_snapshot(db, user_id, None)
+    return
+
+# --- BÚSQUEDA ---
+# Declarada antes de /incidencias/{incident_id} para que "search" no se interprete como un ID
+
+@app.get("/incidencias/search", response_model=list[schemas.IncidentSearchResult])
+async def search_incidents_endpoint(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200, description="Texto a buscar en título y descripción"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_read_db),
+    _ : int = Depends(security.get_current_user_id)
+):
+    # Pedimos una fila de más para saber si hay página siguiente
+    results = await search.search_incidents(db, q, limit + 1, offset)
+    if len(results) > limit:
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    return results[:limit]
+
+# --- ESTADÍSTICAS ---
+# Declarada antes de /incidencias/{incident_id} para que "stats" no se interprete como un ID
+
+@app.get("/incidencias/stats", response_model=schemas.IncidentStats)
+async def incident_stats_endpoint(
+    db: AsyncSession = Depends(get_read_db),
+    days: int = Query(30, ge=1, le=366, description="Días del histograma de altas"),
+    top_users: int = Query(50, ge=1, le=1000, description="Usuarios incluidos en el conteo por usuario"),
+    include_archived: bool = Query(False, description="Incluye las incidencias cerradas archivadas"),
+    _ : int = Depends(security.get_current_user_id)
+):
+    return await crud.get_incident_stats(db, days=days, top_users=top_users, include_archived=include_archived)
+
+# --- EXPORTACIÓN / IMPORTACIÓN MASIVA ---
+# Declaradas antes de /incidencias/{incident_id} para que "export" no se interprete como un ID
+
+@app.get("/incidencias/export", response_class=StreamingResponse)
+async def export_incidents_endpoint(
+    fmt: Literal["csv", "ndjson"] = Query("ndjson", alias="format"),
+    status: Optional[StatusEnum] = Query(None),
+    user_id: Optional[int] = Query(None),
+    created_from: Optional[datetime] = Query(None),
+    created_to: Optional[datetime] = Query(None),
+    include_archived: bool = Query(False, description="Incluye las incidencias cerradas archivadas"),
+    read_engine = Depends(get_read_engine),
+    _ : int = Depends(security.get_current_user_id)
+):
+    """Todas las incidencias (filtradas) en streaming: COPY TO STDOUT en Postgres, sin paginar."""
+    stmt = crud.export_query(status, user_id, created_from, created_to, include_archived)
+    # Las extracciones largas van a la réplica si la hay (salvo tras escribir: read-your-writes)
+    return StreamingResponse(
+        transfer.export_rows(read_engine, stmt, fmt),
+        media_type=transfer_format.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="incidencias.{fmt}"'},
+    )
+
+@app.post("/incidencias/import", response_model=schemas.ImportResult)
+async def import_incidents_endpoint(
+    request: Request,
+    fmt: Literal["csv", "ndjson"] = Query("ndjson", alias="format"),
+    token: str = Depends(security.oauth2_scheme),
+    _ : int = Depends(security.get_current_user_id)
+):
+    """
+    Carga un fichero CSV o NDJSON (el formato de /incidencias/export) leído en streaming.
+    Cada fila necesita description y user_id; id y created_at se conservan si vienen (un id
+    archivado se omite). Cada lote confirmado publica un único 'reset' en el feed.
+    """
+    result = await transfer.import_incidents(engine, request.stream(), fmt, token)
+    if result.imported:
+        # Las importaciones escriben sin sesión: el token queda 'pegado' al primario igualmente
+        recent_writers.mark(request.headers.get("authorization"))
+    return result
+
+# --- FEED DE CAMBIOS (Server-Sent Events) ---
+# Declarado antes de /incidencias/{incident_id} para que "eventos" no se interprete como un ID
+
+def _event_stream(last_event_id: Optional[str]) -> StreamingResponse:
+    # El cliente reanuda enviando la cabecera estándar Last-Event-ID
+    return StreamingResponse(
+        broker.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/incidencias/eventos")
+async def incident_events_endpoint(
+    last_event_id: Optional[str] = Header(None),
+    _ : int = Depends(security.get_current_user_id)
+):
+    return _event_stream(last_event_id)
+
+@app.get("/incidencias/eventos/interno", include_in_schema=False)
+async def internal_incident_events_endpoint(
+    last_event_id: Optional[str] = Header(None),
+    _ : None = Depends(security.require_internal_service)
+):
+    # El mismo feed para el Gateway (invalidación de cachés), con la credencial interna
+    return _event_stream(last_event_id)
+
+# --- OPERACIONES EN BLOQUE ---
+# Declaradas antes de /incidencias/{incident_id} para que "bulk" no se interprete como un ID
+
+BULK_MAX_ITEMS = 1000
+
+@app.post("/incidencias/bulk", response_model=list[schemas.BulkItemResult])
+async def create_incidents_bulk_endpoint(
+    payload: list[schemas.IncidentCreate] = Body(..., max_length=BULK_MAX_ITEMS),
+    db: AsyncSession = Depends(get_db),
+    token: str = Depends(security.oauth2_scheme),
+    current_user_id: int = Depends(security.get_current_user_id)
+):
+    owner = await external.owner_snapshot(current_user_id, token)
+    return await crud.create_incidents_bulk(db, payload, user_id=current_user_id, owner=owner)
+
+@app.patch("/incidencias/bulk", response_model=list[schemas.BulkItemResult])
+async def update_incidents_bulk_endpoint(
+    payload: list[schemas.IncidentBulkUpdate] = Body(..., max_length=BULK_MAX_ITEMS),
+    db: AsyncSession = Depends(get_db),
+    token: str = Depends(security.oauth2_scheme),
+    _ : int = Depends(security.get_current_user_id)
+):
+    # Validamos todos los nuevos propietarios del lote en una sola llamada (con caché)
+    user_ids = {item.user_id for item in payload if item.user_id is not None}
+    owners = await external.lookup_owners(user_ids, token) if user_ids else {}
+    return await crud.update_incidents_bulk(db, payload, owners)
+
+@app.delete("/incidencias/bulk", response_model=list[schemas.BulkItemResult])
+async def delete_incidents_bulk_endpoint(
+    incident_ids: list[int] = Body(..., max_length=BULK_MAX_ITEMS),
+    db: AsyncSession = Depends(get_db),
+    _ : int = Depends(security.get_current_user_id)
+):
+    return await crud.delete_incidents_bulk(db, incident_ids)
 
 @app.get("/incidencias/{incident_id}", response_model=schemas.IncidentOut)
-def get_incident_endpoint(
+async def get_incident_endpoint(
     incident_id:int, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
+    include_archived: bool = Query(False, description="Busca también entre las incidencias archivadas"),
     _ : int = Depends(security.get_current_user_id) # <--- Protegido
 ):
-    return crud.get_incident(db, incident_id)
+    incident = await crud.find_incident(db, incident_id, include_archived)
+    if incident is None:
+        # La réplica puede no tener aún una incidencia recién creada: confirmamos en el primario
+        async with primary_for(db) as primary:
+            incident = await crud.get_incident(primary, incident_id, include_archived)
+    return incident
 
 @app.delete("/incidencias/{incident_id}", status_code=204)
-def delete_incident_endpoint(
+async def delete_incident_endpoint(
     incident_id: int, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     _ : int = Depends(security.get_current_user_id) # <--- Protegido
 ):
-    crud.delete_incident(db, incident_id)
+    await crud.delete_incident(db, incident_id)
     return
 
 @app.put("/incidencias/{incident_id}", response_model=schemas.IncidentOut)
-def update_incident_endpoint(
+async def update_incident_endpoint(
     incident_id:int, 
     payload: schemas.IncidentUpdate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
+    token: str = Depends(security.oauth2_scheme),
     _ : int = Depends(security.get_current_user_id) # <--- Protegido
 ):
-    return crud.update_incident(db, incident_id, payload)
\ No newline at end of file
+    # Si cambia el propietario, comprobamos que exista (caché + circuit breaker)
+    owner = None
+    if payload.user_id is not None:
+        owner = await external.validate_user_exists(payload.user_id, token)
+    return await crud.update_incident(db, incident_id, payload, owner=owner)
\ No newline at end of file
@@ -0,0 +1,191 @@
+import os
+import time
+import httpx
+from fastapi import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, GCCollector, Histogram, PlatformCollector,
+    ProcessCollector, generate_latest, multiprocess,
+)
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Con varios workers (uvicorn --workers) cada proceso escribe sus métricas en este
+# directorio y /metrics las agrega todas (modo multiproceso de prometheus_client)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Registro propio del servicio (no el global): así varios servicios pueden convivir
+# en un mismo proceso, como en los benchmarks
+registry = CollectorRegistry()
+if not PROMETHEUS_MULTIPROC_DIR:
+    # Las métricas del proceso solo tienen sentido con un único proceso
+    ProcessCollector(registry=registry)
+    PlatformCollector(registry=registry)
+    GCCollector(registry=registry)
+
+# --- Peticiones HTTP ---
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Tiempo hasta enviar la respuesta (cabeceras), por ruta",
+    ["method", "route", "status"],
+    registry=registry,
+)
+# Los Gauge usan multiprocess_mode="livesum": suma de los workers vivos (ignorado con un solo proceso)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Peticiones en curso", multiprocess_mode="livesum", registry=registry
+)
+
+# --- Base de datos ---
+
+DB_POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Espera para obtener una conexión del pool",
+    ["engine"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    registry=registry,
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Conexiones del pool en uso", ["engine"], multiprocess_mode="livesum", registry=registry
+)
+DB_POOL_SIZE = Gauge(
+    "db_pool_size", "Tamaño configurado del pool", ["engine"], multiprocess_mode="livesum", registry=registry
+)
+DB_POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "Conexiones abiertas por encima del tamaño del pool", ["engine"],
+    multiprocess_mode="livesum", registry=registry,
+)
+
+# --- Llamadas a otros servicios y JWT ---
+
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds",
+    "Latencia de las llamadas a otros servicios",
+    ["target", "method", "status"],
+    registry=registry,
+)
+JWT_DECODE_SECONDS = Histogram(
+    "jwt_decode_seconds",
+    "Tiempo de verificación de un JWT (solo fallos de caché)",
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01),
+    registry=registry,
+)
+JWT_CACHE_LOOKUPS = Counter("jwt_cache_lookups_total", "Consultas a la caché de tokens", ["result"], registry=registry)
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: latencia por plantilla de ruta (/incidencias/{incident_id}) y peticiones en curso."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status_code):
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            # La ruta se resuelve durante la petición; sin ruta (404) no usamos la URL (cardinalidad)
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                scope["method"], route.path if route else "unmatched", str(status_code)
+            ).observe(time.perf_counter() - started)
+
+        async def send_wrapper(message):
+            # Medimos hasta las cabeceras: un stream (SSE) no infla la latencia de su ruta
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            record(500)
+            raise
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+
+
+class TimedPool(AsyncAdaptedQueuePool):
+    """Pool de SQLAlchemy que mide cuánto se espera por una conexión libre."""
+
+    metrics_name = "primary"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_WAIT.labels(self.metrics_name).observe(time.perf_counter() - started)
+
+
+def instrument_engine(engine, name: str = "primary"):
+    """Publica el uso del pool del engine (en uso, tamaño y overflow) con la etiqueta 'name'."""
+    pool = engine.sync_engine.pool
+    if isinstance(pool, TimedPool):
+        pool.metrics_name = name
+    if not hasattr(pool, "checkedout"):
+        return
+
+    # Se actualizan con los eventos del pool (no con set_function, que no funciona con
+    # varios workers): así cada proceso escribe su valor y /metrics los suma
+    def publish(checked_out: int):
+        DB_POOL_CHECKED_OUT.labels(name).set(checked_out)
+        # Las conexiones extra se cierran al devolverse: las abiertas de más son las usadas de más
+        DB_POOL_OVERFLOW.labels(name).set(max(0, checked_out - pool.size()))
+
+    def on_checkout(*_):
+        publish(pool.checkedout())
+
+    def on_checkin(*_):
+        # 'checkin' se emite antes de devolver la conexión a la cola
+        publish(max(0, pool.checkedout() - 1))
+
+    DB_POOL_SIZE.labels(name).set(pool.size())
+    publish(0)
+    event.listen(pool, "checkout", on_checkout)
+    event.listen(pool, "checkin", on_checkin)
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """Envuelve el transporte de un cliente httpx y mide la latencia de cada llamada al upstream."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, target: str):
+        self.transport = transport
+        self.target = target
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status_label = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status_label = str(response.status_code)
+            return response
+        finally:
+            UPSTREAM_LATENCY.labels(self.target, request.method, status_label).observe(
+                time.perf_counter() - started
+            )
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def metrics_response() -> Response:
+    if PROMETHEUS_MULTIPROC_DIR:
+        # Agregamos los ficheros de todos los workers en un registro nuevo por petición
+        scrape_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(scrape_registry)
+        return Response(generate_latest(scrape_registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead():
+    """Al parar el worker: sus Gauge 'livesum' dejan de contar en la agregación."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,31 @@
+"""
+Migración del esquema de incidencias. Se ejecuta una sola vez antes de arrancar los
+workers (en docker-compose, el servicio incidents-migrate):
+
+    python -m app.migrate
+"""
+import asyncio
+from .db import Base, engine, add_missing_columns, add_missing_indexes
+from . import models, archive
+
+
+async def migrate():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # Columnas añadidas después (copia del propietario) en tablas ya existentes
+        await conn.run_sync(add_missing_columns, models.Incident.__table__)
+        # Índices añadidos después en tablas ya existentes: keyset (created_at, id), título
+        # único y, en Postgres, el GIN de búsqueda (ddl_if lo omite en otras BD)
+        await conn.run_sync(add_missing_indexes, models.Incident.__table__)
+        if conn.dialect.name == "postgresql":
+            # incidents_archive está particionada: las mensuales las crea archive.py
+            await archive.create_default_partition(conn)
+
+
+async def main():
+    await migrate()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,18 +1,79 @@
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, Integer, ForeignKey, Enum, DateTime
-from sqlalchemy.sql import func
+from sqlalchemy import String, Integer, ForeignKey, Enum, DateTime, Index
+from sqlalchemy.dialects import postgresql, sqlite  # postgresql registra to_tsvector & co.
+from sqlalchemy.sql import func, text
 from .db import Base
 from .enums import StatusEnum
 import datetime
 
+_SQLITE_DATETIME = sqlite.DATETIME(
+    storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"
+)
+
 class Incident(Base):
     __tablename__ = "incidents"
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    title: Mapped[str] = mapped_column(String(100), nullable=True)
+    # Índice único: la BD garantiza que no haya dos incidencias con el mismo título
+    title: Mapped[str] = mapped_column(String(100), nullable=True, unique=True)
     description: Mapped[str] = mapped_column(String(200), nullable=False)
     status: Mapped[str] = mapped_column(Enum(StatusEnum), default=StatusEnum.abierta, nullable=False)
     user_id:  Mapped[int] = mapped_column(Integer, nullable=False)
     created_at: Mapped[datetime.datetime] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+        # En SQLite (benchmarks locales) now() se guarda como texto sin microsegundos:
+        # usamos el mismo formato al comparar para que el cursor (created_at, id) funcione
+        DateTime(timezone=True).with_variant(_SQLITE_DATETIME, "sqlite"), server_default=func.now()
+    )
+    # Copia desnormalizada del propietario (users-service) para servir el listado hidratado
+    # con una sola consulta. NULL = sin copia: el Gateway lo completa con users-service
+    owner_name: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    owner_email: Mapped[str | None] = mapped_column(String(255), nullable=True)
+
+    # Índices compuestos para la paginación por cursor (created_at, id) y sus filtros
+    __table_args__ = (
+        Index("ix_incidents_created_at_id", "created_at", "id"),
+        Index("ix_incidents_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_incidents_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
+
+class IncidentArchive(Base):
+    """
+    Incidencias cerradas antiguas (tabla fría, solo lectura): las mueve aquí archive.py.
+    En Postgres está particionada por meses de created_at, por eso la clave primaria
+    incluye created_at. El título no es único: la unicidad solo se exige entre las vivas.
+    """
+    __tablename__ = "incidents_archive"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
+    title: Mapped[str] = mapped_column(String(100), nullable=True)
+    description: Mapped[str] = mapped_column(String(200), nullable=False)
+    status: Mapped[str] = mapped_column(Enum(StatusEnum), nullable=False)
+    user_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime(timezone=True).with_variant(_SQLITE_DATETIME, "sqlite"), primary_key=True
+    )
+    owner_name: Mapped[str | None] = mapped_column(String(100), nullable=True)
+    owner_email: Mapped[str | None] = mapped_column(String(255), nullable=True)
+
+    __table_args__ = (
+        Index("ix_incidents_archive_created_at_id", "created_at", "id"),
+        Index("ix_incidents_archive_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_incidents_archive_user_id_created_at_id", "user_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
     )
-    
\ No newline at end of file
+
+
+# --- Búsqueda de texto completo (solo Postgres) ---
+# Las constantes van como literales (no parámetros) para que la expresión de las
+# consultas coincida con la del índice y el planificador pueda usarlo.
+SEARCH_CONFIG = text("'spanish'::regconfig")
+
+_columns = Incident.__table__.c
+search_document = func.to_tsvector(
+    SEARCH_CONFIG,
+    func.coalesce(_columns.title, text("''"))
+    .op("||")(text("' '"))
+    .op("||")(func.coalesce(_columns.description, text("''"))),
+)
+
+# En SQLite (tests/benchmarks) no existe to_tsvector: se usa el índice en memoria de search.py
+search_index = Index("ix_incidents_search", search_document, postgresql_using="gin").ddl_if(dialect="postgresql")
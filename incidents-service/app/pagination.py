@@ -0,0 +1,22 @@
+import base64
+from datetime import datetime
+from fastapi import HTTPException, status
+
+# El cursor es opaco para el cliente: codifica (created_at, id) de la última fila devuelta
+
+
+def encode_cursor(created_at: datetime, incident_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{incident_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at_str, incident_id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at_str), int(incident_id)
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cursor de paginación inválido"
+        )
@@ -0,0 +1,39 @@
+from typing import Any
+from fastapi import HTTPException, Response, status
+from pydantic import TypeAdapter
+
+# Serializador compilado una sola vez (pydantic-core): convierte datetime, Enum, etc.
+# igual que lo haría el response_model, pero sin instanciar un modelo por fila
+_rows_adapter = TypeAdapter(list[dict[str, Any]])
+
+
+class RawJSONResponse(Response):
+    """Respuesta con un cuerpo JSON ya serializado (bytes): no se vuelve a codificar."""
+
+    media_type = "application/json"
+
+
+def parse_fields(raw: str | None, allowed) -> list[str] | None:
+    """
+    Convierte "id,title,status" en una lista de campos validada contra el esquema de salida.
+    None (o vacío) significa "todos los campos".
+    """
+    if not raw:
+        return None
+    fields = list(dict.fromkeys(field.strip() for field in raw.split(",") if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Campos no permitidos: {', '.join(unknown)}. Disponibles: {', '.join(allowed)}"
+        )
+    return fields or None
+
+
+def rows_response(rows, fields: list[str], headers: dict | None = None) -> RawJSONResponse:
+    """
+    Serializa filas de SQLAlchemy Core (RowMapping) directamente a bytes JSON.
+    Las filas ya vienen de un SELECT de esas columnas, así que no pasan por el modelo Pydantic.
+    """
+    body = _rows_adapter.dump_json([{field: row[field] for field in fields} for row in rows])
+    return RawJSONResponse(body, headers=headers)
@@ -22,5 +22,87 @@ class IncidentOut(IncidentBase):
     status: StatusEnum
     created_at: datetime
 
+    # Configuración Pydantic V2 (antes orm_mode)
     class Config:
-        orm_mode = True
+        from_attributes = True
+
+# --- Propietario desnormalizado (copia de users-service) ---
+
+class OwnerOut(BaseModel):
+    id: int
+    name: str
+    email: str
+
+class IncidentDetailOut(IncidentOut):
+    # None si la incidencia aún no tiene copia del propietario
+    owner: OwnerOut | None = None
+
+# --- Operaciones en bloque (bulk) ---
+
+class IncidentBulkUpdate(IncidentUpdate):
+    id: int
+
+class BulkItemResult(BaseModel):
+    # Posición del elemento en el array de la petición
+    index: int
+    status_code: int
+    id: int | None = None
+    incident: IncidentOut | None = None
+    detail: str | None = None
+
+# --- Exportación / importación masiva (ver transfer.py) ---
+
+class IncidentImport(IncidentCreate):
+    # Una fila del fichero: id y created_at se conservan si vienen (clonado de entornos)
+    id: int | None = None
+    description: str = Field(max_length=200)
+    user_id: int
+    created_at: datetime | None = None
+
+class ImportRowError(BaseModel):
+    # Línea del fichero (en CSV, la cabecera es la 1)
+    line: int
+    detail: str
+
+class ImportResult(BaseModel):
+    imported: int
+    # Ya existían (mismo id o título): se omiten sin error
+    skipped: int
+    # Inválidas; 'errors' detalla las primeras IMPORT_MAX_ERRORS
+    rejected: int
+    errors: list[ImportRowError]
+
+# --- Estadísticas (agregadas en SQL) ---
+
+class UserIncidentCount(BaseModel):
+    user_id: int
+    count: int
+
+class DailyCount(BaseModel):
+    day: str
+    count: int
+
+class OpenAgePercentiles(BaseModel):
+    # Antigüedad en segundos de las incidencias no cerradas (None si no hay ninguna)
+    p50: float | None = None
+    p90: float | None = None
+    p99: float | None = None
+    max: float | None = None
+
+class IncidentStats(BaseModel):
+    total: int
+    by_status: dict[StatusEnum, int]
+    by_user: list[UserIncidentCount]
+    open_age_seconds: OpenAgePercentiles
+    created_per_day: list[DailyCount]
+
+# --- Búsqueda ---
+
+class SearchHighlights(BaseModel):
+    # Fragmentos con los términos encontrados entre <mark></mark>
+    title: str | None = None
+    description: str | None = None
+
+class IncidentSearchResult(IncidentOut):
+    rank: float
+    highlights: SearchHighlights
@@ -0,0 +1,239 @@
+import asyncio
+import html
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas
+from .events import broker
+
+# Marcas de resaltado (las mismas en Postgres y en el índice en memoria). El texto se
+# escapa como HTML antes de añadirlas: el frontend puede pintar el resultado tal cual
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_STOP = "</mark>"
+HEADLINE_OPTIONS = f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, HighlightAll=true"
+# En el índice en memoria, una coincidencia en el título pesa más que en la descripción
+TITLE_WEIGHT = 2.0
+
+_WORD = re.compile(r"\w+")
+
+
+def _normalize(word: str) -> str:
+    # Minúsculas y sin tildes: "Conexión" y "conexion" son el mismo término
+    decomposed = unicodedata.normalize("NFKD", word.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _terms(text: str | None) -> list[str]:
+    return [_normalize(word) for word in _WORD.findall(text or "") if len(word) > 1]
+
+
+def _highlight(text: str | None, query_terms: list[str]) -> str | None:
+    if text is None:
+        return None
+
+    parts, last = [], 0
+    for match in _WORD.finditer(text):
+        parts.append(html.escape(text[last:match.start()]))
+        word = html.escape(match.group(0))
+        if any(_normalize(match.group(0)).startswith(term) for term in query_terms):
+            word = f"{HIGHLIGHT_START}{word}{HIGHLIGHT_STOP}"
+        parts.append(word)
+        last = match.end()
+    parts.append(html.escape(text[last:]))
+    return "".join(parts)
+
+
+def _escape_html(column):
+    # Mismo escapado que html.escape, en SQL: ts_headline recibe el texto ya escapado
+    # (el parser de Postgres trata "&lt;" y compañía como entidades, no como palabras)
+    for char, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ('"', "&quot;"), ("'", "&#x27;")):
+        column = func.replace(column, char, entity)
+    return column
+
+
+class InvertedIndex:
+    """
+    Índice invertido en memoria para cuando la BD no es Postgres (SQLite en tests y
+    benchmarks). Se construye desde la BD en la primera búsqueda y después se mantiene
+    con los eventos del broker, así que solo refleja los cambios hechos en este proceso.
+    Un 'reset' (cambio en bloque) hace que se vuelva a cargar en la siguiente búsqueda.
+
+    Todos los términos de la consulta deben aparecer (el último admite prefijo) y el
+    ranking es TF-IDF con más peso para el título.
+    """
+
+    def __init__(self):
+        self.built = False
+        self._building: list | None = None
+        self._lock = asyncio.Lock()
+        self._postings: dict[str, dict[int, float]] = defaultdict(dict)
+        self._documents: dict[int, tuple[str | None, str | None, set[str]]] = {}
+
+    def _add(self, incident_id: int, title: str | None, description: str | None):
+        self._remove(incident_id)
+        weights: dict[str, float] = defaultdict(float)
+        for term in _terms(title):
+            weights[term] += TITLE_WEIGHT
+        for term in _terms(description):
+            weights[term] += 1.0
+        for term, weight in weights.items():
+            self._postings[term][incident_id] = weight
+        self._documents[incident_id] = (title, description, set(weights))
+
+    def _remove(self, incident_id: int):
+        document = self._documents.pop(incident_id, None)
+        if document is None:
+            return
+        for term in document[2]:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(incident_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def on_event(self, event_type: str, data: dict):
+        if self._building is not None:
+            # Durante la carga inicial se guardan y se aplican al terminar
+            self._building.append((event_type, data))
+        elif event_type == "reset":
+            # Cambio en bloque (archivado, importación): se vuelve a cargar en la siguiente búsqueda
+            self.built = False
+        elif self.built:
+            self._apply(event_type, data)
+
+    def _apply(self, event_type: str, data: dict):
+        if event_type == "deleted":
+            self._remove(data["id"])
+        else:
+            self._add(data["id"], data.get("title"), data.get("description"))
+
+    async def ensure_built(self, db: AsyncSession):
+        if self.built:
+            return
+        async with self._lock:
+            # Si llega un 'reset' durante la carga, se vuelve a cargar
+            while not self.built:
+                self._postings.clear()
+                self._documents.clear()
+                self._building = []
+                try:
+                    Incident = models.Incident
+                    rows = await db.stream(select(Incident.id, Incident.title, Incident.description))
+                    async for incident_id, title, description in rows:
+                        self._add(incident_id, title, description)
+                    pending = self._building
+                finally:
+                    self._building = None
+                if any(event_type == "reset" for event_type, _ in pending):
+                    continue
+                for event_type, data in pending:
+                    self._apply(event_type, data)
+                self.built = True
+
+    def _matching(self, term: str, prefix: bool) -> dict[int, float]:
+        if not prefix:
+            return self._postings.get(term, {})
+        matches: dict[int, float] = defaultdict(float)
+        for candidate, postings in self._postings.items():
+            if candidate.startswith(term):
+                for incident_id, weight in postings.items():
+                    matches[incident_id] += weight
+        return matches
+
+    def search(self, q: str, limit: int, offset: int) -> tuple[list[tuple[int, float]], list[str]]:
+        query_terms = _terms(q)
+        if not query_terms:
+            return [], query_terms
+        total = max(len(self._documents), 1)
+        scores: dict[int, float] | None = None
+        for position, term in enumerate(query_terms):
+            matches = self._matching(term, prefix=position == len(query_terms) - 1)
+            idf = math.log(1 + total / (1 + len(matches)))
+            if scores is None:
+                scores = {incident_id: weight * idf for incident_id, weight in matches.items()}
+            else:
+                scores = {
+                    incident_id: score + matches[incident_id] * idf
+                    for incident_id, score in scores.items() if incident_id in matches
+                }
+            if not scores:
+                return [], query_terms
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[offset:offset + limit], query_terms
+
+
+memory_index = InvertedIndex()
+broker.add_listener(memory_index.on_event)
+
+
+async def _search_postgres(db: AsyncSession, q: str, limit: int, offset: int):
+    Incident = models.Incident
+    query = func.websearch_to_tsquery(models.SEARCH_CONFIG, q)
+    rank = func.ts_rank_cd(models.search_document, query)
+
+    # 1. Página de resultados (usa el índice GIN ix_incidents_search)
+    page = (
+        select(Incident.id, rank.label("rank"))
+        .where(models.search_document.op("@@")(query))
+        .order_by(rank.desc(), Incident.id.desc())
+        .limit(limit)
+        .offset(offset)
+        .subquery()
+    )
+    # 2. ts_headline es caro: solo se calcula para las filas de la página
+    stmt = (
+        select(
+            Incident,
+            page.c.rank,
+            func.ts_headline(models.SEARCH_CONFIG, _escape_html(func.coalesce(Incident.title, "")), query, HEADLINE_OPTIONS),
+            func.ts_headline(models.SEARCH_CONFIG, _escape_html(Incident.description), query, HEADLINE_OPTIONS),
+        )
+        .join(page, page.c.id == Incident.id)
+        .order_by(page.c.rank.desc(), Incident.id.desc())
+    )
+    rows = await db.execute(stmt)
+    return [
+        (incident, rank_value, schemas.SearchHighlights(title=title, description=description))
+        for incident, rank_value, title, description in rows
+    ]
+
+
+async def _search_memory(db: AsyncSession, q: str, limit: int, offset: int):
+    await memory_index.ensure_built(db)
+    ranked, query_terms = memory_index.search(q, limit, offset)
+    if not ranked:
+        return []
+    Incident = models.Incident
+    incidents = {
+        incident.id: incident
+        for incident in await db.scalars(select(Incident).where(Incident.id.in_([i for i, _ in ranked])))
+    }
+    results = []
+    for incident_id, score in ranked:
+        incident = incidents.get(incident_id)
+        if incident is None:
+            continue
+        highlights = schemas.SearchHighlights(
+            title=_highlight(incident.title, query_terms),
+            description=_highlight(incident.description, query_terms),
+        )
+        results.append((incident, round(score, 4), highlights))
+    return results
+
+
+async def search_incidents(db: AsyncSession, q: str, limit: int, offset: int) -> list[schemas.IncidentSearchResult]:
+    if db.bind.dialect.name == "postgresql":
+        rows = await _search_postgres(db, q, limit, offset)
+    else:
+        rows = await _search_memory(db, q, limit, offset)
+    return [
+        schemas.IncidentSearchResult(
+            **schemas.IncidentOut.model_validate(incident, from_attributes=True).model_dump(),
+            rank=rank_value,
+            highlights=highlights,
+        )
+        for incident, rank_value, highlights in rows
+    ]
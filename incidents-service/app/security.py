@@ -1,16 +1,40 @@
+import hmac
 import os
-from fastapi import HTTPException, status, Depends
+from typing import Optional
+from fastapi import HTTPException, Header, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from .metrics import JWT_CACHE_LOOKUPS, JWT_DECODE_SECONDS
+from .token_cache import TokenCache
 
 # Leemos los secretos inyectados por Docker 
 SECRET_KEY = os.getenv("JWT_SECRET")
 ALGORITHM = os.getenv("JWT_ALGORITHM")
 
+# Credencial de las llamadas entre servicios (users-service, Gateway), distinta del secreto
+# JWT: quien la tiene no puede firmar tokens de usuario. Sin configurar, las rutas internas
+# responden 403 a todos
+INTERNAL_SERVICE_TOKEN = os.getenv("INTERNAL_SERVICE_TOKEN")
+
 # Define que esperamos el token en el header 'Authorization: Bearer <token>'
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
-def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
+# Tokens ya verificados: evita repetir HMAC + parseo + validación en cada petición
+# (sin lock: el servicio es async y solo se usa desde el bucle de eventos)
+token_cache = TokenCache(threadsafe=False)
+
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is None:
+        JWT_CACHE_LOOKUPS.labels("miss").inc()
+        with JWT_DECODE_SECONDS.time():
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.put(token, payload)
+    else:
+        JWT_CACHE_LOOKUPS.labels("hit").inc()
+    return payload
+
+async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
     # Preparamos la excepción 401
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -20,7 +44,7 @@ def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
     
     try:
         # Valida firma y expiración automáticamente (SCRUM-92)
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         
         # Extraemos el ID (user_id) del 'sub'
         user_id_str: str = payload.get("sub")
@@ -31,4 +55,14 @@ def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
         
     except JWTError:
         # Si el token está mal formado, caducado o firma falsa -> 401 (SCRUM-93)
-        raise credentials_exception
\ No newline at end of file
+        raise credentials_exception
+
+async def require_internal_service(x_internal_token: Optional[str] = Header(None)):
+    """Solo para otros servicios: cabecera X-Internal-Token con INTERNAL_SERVICE_TOKEN."""
+    if not INTERNAL_SERVICE_TOKEN or not x_internal_token or not hmac.compare_digest(
+        x_internal_token.encode(), INTERNAL_SERVICE_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Operación reservada a los servicios internos"
+        )
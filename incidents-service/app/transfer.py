@@ -0,0 +1,179 @@
+"""
+Exportación e importación masiva en CSV o NDJSON, en streaming y con memoria constante.
+
+- Exportar: en Postgres, COPY (SELECT ...) TO STDOUT reenvía los bloques tal cual los
+  produce la BD; en otras BD (SQLite en los benchmarks) se recorre la consulta por lotes
+  ordenados por id.
+- Importar: el cuerpo se lee a trozos, cada fila se valida y se cargan lotes de
+  IMPORT_BATCH_SIZE filas con COPY ... FROM STDIN en una tabla temporal y un único
+  INSERT ... SELECT ... ON CONFLICT DO NOTHING (las filas repetidas se omiten). Cada lote
+  confirmado se publica como un único evento 'reset' (no uno por fila).
+
+El formato (serialización y lectura del fichero) está en transfer_format.py.
+"""
+import os
+from datetime import datetime, timezone
+from typing import AsyncIterator
+from pydantic import ValidationError
+from sqlalchemy import Table, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from . import models, schemas, external
+from .crud import owner_columns
+from .events import broker
+from .transfer_format import (
+    ImportReport, copy_statement, copy_value, csv_chunk, ndjson_chunk, read_rows, validation_detail,
+)
+
+# Filas por consulta al exportar sin COPY (SQLite)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# Filas por transacción al importar
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+
+
+# --- Exportación ---
+
+async def _copy_out(engine, stmt, fmt: str) -> AsyncIterator[bytes]:
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        async with raw.driver_connection.cursor() as cursor:
+            async with cursor.copy(copy_statement(stmt, fmt, conn.dialect)) as copy:
+                async for block in copy:
+                    yield bytes(block)
+
+
+async def _export_batches(engine, stmt, fmt: str) -> AsyncIterator[bytes]:
+    # Sin COPY: lotes por clave (id > último), cada uno con su propia conexión del pool
+    columns = stmt.selected_columns
+    if fmt == "csv":
+        yield csv_chunk([[column.name for column in columns]])
+    last_id = None
+    while True:
+        page = stmt if last_id is None else stmt.where(columns.id > last_id)
+        async with engine.connect() as conn:
+            rows = (await conn.execute(page.limit(EXPORT_BATCH_SIZE))).mappings().all()
+        if not rows:
+            break
+        if fmt == "csv":
+            yield csv_chunk(row.values() for row in rows)
+        else:
+            yield ndjson_chunk(rows)
+        last_id = rows[-1]["id"]
+
+
+async def export_rows(engine, stmt, fmt: str) -> AsyncIterator[bytes]:
+    """Cuerpo de la respuesta de exportación. 'stmt' debe ir ordenada por id."""
+    rows = _copy_out(engine, stmt, fmt) if engine.dialect.name == "postgresql" else _export_batches(engine, stmt, fmt)
+    async for chunk in rows:
+        yield chunk
+
+
+# --- Escritura ---
+
+async def _archived_ids(conn, incident_ids: list[int]) -> set[int]:
+    Archive = models.IncidentArchive
+    return set(await conn.scalars(select(Archive.id).where(Archive.id.in_(incident_ids))))
+
+
+async def insert_rows(engine, table: Table, rows: list[dict]) -> int:
+    """
+    Inserta un lote (todas las filas con las mismas columnas) y devuelve cuántas entraron.
+    Un id que ya está en el archivo también se omite: volvería a existir dos veces al
+    listar con include_archived.
+    """
+    columns = list(rows[0])
+    async with engine.begin() as conn:
+        if "id" in columns:
+            archived = await _archived_ids(conn, [row["id"] for row in rows])
+            rows = [row for row in rows if row["id"] not in archived]
+            if not rows:
+                return 0
+
+        if conn.dialect.name != "postgresql":
+            result = await conn.execute(pg_insert(table).on_conflict_do_nothing(), rows)
+            return result.rowcount
+
+        column_list = ", ".join(columns)
+        staging = f"{table.name}_import"
+        # Tabla temporal sin restricciones: COPY no se detiene por filas repetidas
+        await conn.exec_driver_sql(
+            f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {column_list} FROM {table.name} WITH NO DATA"
+        )
+        raw = await conn.get_raw_connection()
+        async with raw.driver_connection.cursor() as cursor:
+            async with cursor.copy(f"COPY {staging} ({column_list}) FROM STDIN") as copy:
+                for row in rows:
+                    await copy.write_row([copy_value(row[column]) for column in columns])
+        result = await conn.exec_driver_sql(
+            f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging} "
+            f"ON CONFLICT DO NOTHING"
+        )
+        if "id" in columns:
+            # IDs explícitos (clonado de entornos): la secuencia sigue después del mayor,
+            # contando también los archivados
+            await conn.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"(SELECT max(id) FROM (SELECT id FROM {table.name} "
+                f"UNION ALL SELECT id FROM {models.IncidentArchive.__tablename__}) AS ids))"
+            )
+        return result.rowcount
+
+
+# --- Importación de incidencias ---
+
+IMPORT_FIELDS = [*schemas.IncidentImport.model_fields, "owner_name", "owner_email"]
+
+
+async def _import_batch(engine, batch: list[tuple[int, schemas.IncidentImport]], token: str, report: ImportReport):
+    # Propietarios validados (y su copia) con una sola llamada a users-service por lote
+    owners = await external.lookup_owners({incident.user_id for _, incident in batch}, token)
+    now = datetime.now(timezone.utc)
+    with_id, without_id = [], []
+    for line, incident in batch:
+        owner = owners.get(incident.user_id)
+        if owner is None:
+            report.reject(line, f"El usuario con ID {incident.user_id} no existe.")
+            continue
+        values = {
+            "title": incident.title,
+            "description": incident.description,
+            "status": incident.status,
+            "user_id": incident.user_id,
+            "created_at": incident.created_at or now,
+            **owner_columns(owner),
+        }
+        if incident.id is None:
+            without_id.append(values)
+        else:
+            with_id.append({"id": incident.id, **values})
+
+    inserted = 0
+    for rows in (with_id, without_id):
+        if rows:
+            count = await insert_rows(engine, models.Incident.__table__, rows)
+            inserted += count
+            report.skipped += len(rows) - count
+    report.imported += inserted
+    # Tras el COMMIT: un solo 'reset' por lote (los clientes SSE recargan, el índice de
+    # búsqueda en memoria se reconstruye una vez y el Gateway vacía su caché)
+    if inserted:
+        broker.publish("reset", {})
+
+
+async def import_incidents(engine, chunks: AsyncIterator[bytes], fmt: str, token: str) -> schemas.ImportResult:
+    report = ImportReport()
+    batch = []
+    async for line, row, error in read_rows(chunks, fmt, IMPORT_FIELDS):
+        if error is not None:
+            report.reject(line, error)
+            continue
+        try:
+            batch.append((line, schemas.IncidentImport.model_validate(row)))
+        except ValidationError as exc:
+            report.reject(line, validation_detail(exc))
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await _import_batch(engine, batch, token, report)
+            batch = []
+    if batch:
+        await _import_batch(engine, batch, token, report)
+    return report.result()
@@ -0,0 +1,49 @@
+"""
+Los tests levantan el Gateway y los dos microservicios en un único proceso con
+benchmarks/stack.py, sobre SQLite en un directorio temporal.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# bcrypt con el coste mínimo: los tests no miden el hash
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+from benchmarks.stack import Stack  # noqa: E402
+
+# Las apps se importan una sola vez por proceso (la configuración se lee al importar),
+# así que todos los tests comparten las mismas BD: cada uno usa sus propios datos
+DATA_DIR = tempfile.mkdtemp(prefix="incidencias-tests-")
+INTERNAL_TOKEN = "tests-internal-token"
+
+
+@pytest.fixture
+def run_stack():
+    """run_stack(escenario): ejecuta 'async escenario(stack)' con el stack arrancado."""
+    def run(scenario):
+        async def main():
+            stack = Stack(
+                f"sqlite:///{DATA_DIR}/users.db",
+                f"sqlite+aiosqlite:///{DATA_DIR}/incidents.db",
+                internal_token=INTERNAL_TOKEN,
+            )
+            async with stack:
+                await scenario(stack)
+        asyncio.run(main())
+    return run
+
+
+async def signup(stack, email: str, password: str = "password123") -> tuple[dict, int]:
+    """Da de alta un usuario nuevo y devuelve (cabecera Authorization, id)."""
+    response = await stack.users.post("/usuarios", json={"name": email.split("@")[0], "email": email, "password": password})
+    assert response.status_code == 201, response.text
+    user_id = response.json()["id"]
+    response = await stack.users.post("/auth/login", data={"username": email, "password": password})
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}, user_id
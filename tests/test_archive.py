@@ -0,0 +1,37 @@
+import importlib
+import sqlite3
+
+from conftest import DATA_DIR, signup
+
+
+def test_archiving_publishes_a_reset_per_batch(run_stack):
+    async def scenario(stack):
+        archive = importlib.import_module("incidents_app.archive")
+        search = importlib.import_module("incidents_app.search")
+        events = []
+        search.broker.add_listener(lambda event_type, data: events.append(event_type))
+        headers, _ = await signup(stack, "archive-user@example.com")
+        created = await stack.incidents.post(
+            "/incidencias", json={"title": "Archivable zafiro", "description": "d", "status": "cerrada"}, headers=headers
+        )
+        assert created.status_code == 201, created.text
+        incident_id = created.json()["id"]
+
+        # Primera búsqueda: el índice en memoria se carga con la incidencia
+        found = await stack.incidents.get("/incidencias/search", params={"q": "zafiro"}, headers=headers)
+        assert [row["id"] for row in found.json()] == [incident_id]
+
+        with sqlite3.connect(f"{DATA_DIR}/incidents.db") as conn:
+            conn.execute("UPDATE incidents SET created_at = '2000-01-01 00:00:00' WHERE id = ?", (incident_id,))
+        events.clear()
+        assert await archive.archive_closed() >= 1
+        # Feed SSE y cachés reciben un 'reset'; el índice se vuelve a cargar sin la archivada
+        assert events and set(events) == {"reset"}
+        assert not search.memory_index.built
+
+        found = await stack.incidents.get("/incidencias/search", params={"q": "zafiro"}, headers=headers)
+        assert found.json() == []
+        assert search.memory_index.built
+        assert incident_id not in search.memory_index._documents
+
+    run_stack(scenario)
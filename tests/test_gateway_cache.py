@@ -0,0 +1,43 @@
+import importlib
+import json
+
+from conftest import signup
+
+
+def test_feed_events_evict_only_affected_responses(run_stack):
+    async def scenario(stack):
+        invalidation = importlib.import_module("invalidation")
+        response_cache = importlib.import_module("response_cache").response_cache
+        response_cache.clear()
+        headers, user_id = await signup(stack, "gateway-cache@example.com")
+        other, other_id = await signup(stack, "gateway-cache-other@example.com")
+        created = await stack.incidents.post(
+            "/incidencias", json={"title": "Caché por etiquetas", "description": "d"}, headers=headers
+        )
+        incident = created.json()
+
+        def cached_keys():
+            return set(response_cache._entries)
+
+        await stack.gateway.get("/incidencias-detalladas", params={"user_id": user_id}, headers=headers)
+        own_list = cached_keys()
+        await stack.gateway.get("/incidencias-detalladas", params={"user_id": other_id}, headers=headers)
+        other_list = cached_keys() - own_list
+        await stack.gateway.get("/estadisticas", headers=headers)
+        stats = cached_keys() - own_list - other_list
+        assert len(own_list) == len(other_list) == len(stats) == 1
+
+        # Editar una incidencia del usuario no toca el listado del otro, sí las estadísticas
+        invalidation.apply_event("updated", json.dumps({**incident, "status": "en_progreso"}))
+        assert cached_keys() == other_list
+
+        # Una incidencia nueva del otro usuario entra en su listado
+        invalidation.apply_event("created", json.dumps({**incident, "id": incident["id"] + 1000, "user_id": other_id}))
+        assert cached_keys() == set()
+
+        await stack.gateway.get("/incidencias-detalladas", params={"user_id": other_id}, headers=other)
+        assert cached_keys()
+        invalidation.apply_event("reset", "{}")
+        assert cached_keys() == set()
+
+    run_stack(scenario)
@@ -0,0 +1,42 @@
+from conftest import INTERNAL_TOKEN, signup
+
+
+def test_owner_snapshot_route_rejects_user_tokens(run_stack):
+    async def scenario(stack):
+        headers, user_id = await signup(stack, "owners-user@example.com")
+
+        response = await stack.incidents.delete(f"/incidencias/owners/{user_id}", headers=headers)
+        assert response.status_code == 403
+
+        response = await stack.incidents.delete(
+            f"/incidencias/owners/{user_id}", headers={"X-Internal-Token": "otro"}
+        )
+        assert response.status_code == 403
+
+        response = await stack.incidents.delete(
+            f"/incidencias/owners/{user_id}", headers={"X-Internal-Token": INTERNAL_TOKEN}
+        )
+        assert response.status_code == 204
+
+    run_stack(scenario)
+
+
+def test_deleting_a_user_clears_its_owner_snapshot(run_stack):
+    async def scenario(stack):
+        admin, _ = await signup(stack, "owners-admin@example.com")
+        owner, owner_id = await signup(stack, "owners-gone@example.com")
+        created = await stack.incidents.post(
+            "/incidencias", json={"title": "Copia del propietario", "description": "d"}, headers=owner
+        )
+        assert created.status_code == 201, created.text
+
+        response = await stack.users.delete(f"/usuarios/{owner_id}", headers=admin)
+        assert response.status_code == 204
+
+        # El aviso de users-service (en segundo plano) usa la credencial interna
+        rows = (await stack.incidents.get(
+            "/incidencias/detalladas", params={"user_id": owner_id, "fields": "id,owner"}, headers=admin
+        )).json()
+        assert rows == [{"id": created.json()["id"], "owner": None}]
+
+    run_stack(scenario)
@@ -0,0 +1,71 @@
+import importlib
+import json
+
+from conftest import INTERNAL_TOKEN, signup
+
+
+def test_users_export_with_hashes_round_trips(run_stack):
+    async def scenario(stack):
+        headers, user_id = await signup(stack, "transfer-origin@example.com", password="clave-original")
+
+        response = await stack.users.get("/usuarios/export", params={"include_password_hash": "true"}, headers=headers)
+        assert response.status_code == 403
+        response = await stack.users.get(
+            "/usuarios/export", params={"include_password_hash": "true"},
+            headers={**headers, "X-Internal-Token": "otro"},
+        )
+        assert response.status_code == 403
+
+        plain = await stack.users.get("/usuarios/export", headers=headers)
+        assert all("password_hash" not in json.loads(line) for line in plain.text.splitlines())
+
+        response = await stack.users.get(
+            "/usuarios/export", params={"include_password_hash": "true"},
+            headers={**headers, "X-Internal-Token": INTERNAL_TOKEN},
+        )
+        assert response.status_code == 200, response.text
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert all(row["password_hash"] for row in rows)
+
+        # El mismo fichero se vuelve a importar: nada se rechaza, todo ya existía
+        result = await stack.users.post("/usuarios/import", content=response.content, headers=headers)
+        assert result.status_code == 200, result.text
+        assert result.json()["rejected"] == 0
+        assert result.json()["skipped"] == len(rows)
+
+        # En otro entorno (otro email y sin id) la contraseña sigue siendo la misma
+        origin = next(row for row in rows if row["id"] == user_id)
+        clone = {"name": origin["name"], "email": "transfer-clone@example.com", "password_hash": origin["password_hash"]}
+        result = await stack.users.post("/usuarios/import", content=json.dumps(clone), headers=headers)
+        assert result.json()["imported"] == 1, result.text
+        login = await stack.users.post(
+            "/auth/login", data={"username": "transfer-clone@example.com", "password": "clave-original"}
+        )
+        assert login.status_code == 200, login.text
+
+    run_stack(scenario)
+
+
+def test_incidents_import_publishes_one_reset_per_batch(run_stack):
+    async def scenario(stack):
+        events = importlib.import_module("incidents_app.events")
+        published = []
+        events.broker.add_listener(lambda event_type, data: published.append(event_type))
+        headers, user_id = await signup(stack, "transfer-incidents@example.com")
+        body = "\n".join(
+            json.dumps({"title": f"Importada {i}", "description": "d", "user_id": user_id}) for i in range(5)
+        )
+
+        published.clear()
+        result = await stack.incidents.post("/incidencias/import", content=body, headers=headers)
+        assert result.status_code == 200, result.text
+        assert result.json()["imported"] == 5
+        assert published == ["reset"]
+
+        # Sin filas nuevas no se publica nada
+        published.clear()
+        result = await stack.incidents.post("/incidencias/import", content=body, headers=headers)
+        assert result.json()["skipped"] == 5
+        assert published == []
+
+    run_stack(scenario)
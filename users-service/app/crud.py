@@ -1,42 +1,86 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 
 # Usamos importación relativa porque estos archivos están en el mismo paquete 'app'
 from . import models, schemas, security
+from .user_cache import user_cache
 
 
-def create_user(db: Session, data: schemas.UserCreate):
-    # Verificamos si ya existe el email
-    if db.scalar(select(models.User).where(models.User.email == data.email)):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail="Email ya registrado"
-        )
+def _email_taken():
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email ya registrado")
+
+
+def email_registered(db: Session, email: str) -> bool:
+    return db.scalar(select(models.User.id).where(models.User.email == email)) is not None
 
-    #Generamos el hash de la contraseña recibida
-    hashed_pwd = security.get_password_hash(data.password)
 
+def insert_user(db: Session, data: schemas.UserCreate, hashed_pwd: str):
     #Creamos el usuario guardando el hash, NO la contraseña plana
-    user = models.User(
-        name=data.name, 
-        email=data.email, 
-        password_hash=hashed_pwd 
+    # El índice único de la BD sigue siendo la garantía frente a altas simultáneas:
+    # si el email ya existe, ON CONFLICT DO NOTHING no devuelve fila
+    stmt = (
+        pg_insert(models.User)
+        .values(
+            name=data.name, 
+            email=data.email, 
+            password_hash=hashed_pwd 
+        )
+        .on_conflict_do_nothing(index_elements=[models.User.email])
+        .returning(models.User)
     )
-    # -------------------------
+    user = db.scalar(stmt)
+    if user is None:
+        raise _email_taken()
 
-    db.add(user)
     db.commit()
-    db.refresh(user)
     return user
 
 
-def list_users(db: Session, limit: int = 100, offset: int = 0):
-    stmt = select(models.User).offset(offset).limit(limit)
-    return list(db.scalars(stmt).all())
+async def create_user(db: Session, data: schemas.UserCreate):
+    # La BD es síncrona (hilo aparte); bcrypt se espera sin ocupar ningún hilo
+    # Comprobación barata antes del hash: un email repetido no ocupa el pool de bcrypt
+    if await run_in_threadpool(email_registered, db, data.email):
+        raise _email_taken()
+
+    #Generamos el hash de la contraseña recibida
+    hashed_pwd = await security.get_password_hash(data.password)
+    return await run_in_threadpool(insert_user, db, data, hashed_pwd)
+
+
+def _select_users(fields: list[str] | None):
+    # Columnas de UserOut (o solo las pedidas), nunca el hash de la contraseña: las filas
+    # son RowMapping de SQLAlchemy Core y se serializan sin crear entidades ORM
+    columns = fields or schemas.UserOut.model_fields
+    return select(*(getattr(models.User, column) for column in columns))
+
+def _fetch(db: Session, stmt):
+    return list(db.execute(stmt).mappings().all())
+
+def list_users(db: Session, limit: int = 100, offset: int = 0, fields: list[str] | None = None):
+    stmt = _select_users(fields).order_by(models.User.id).offset(offset).limit(limit)
+    return _fetch(db, stmt)
+
+
+def export_query(include_password_hash: bool = False):
+    """
+    Consulta de /usuarios/export: las columnas de UserOut, por id. El hash solo se añade
+    a petición (clonado de entornos), y /usuarios/import lo acepta tal cual.
+    """
+    stmt = _select_users(None)
+    if include_password_hash:
+        stmt = stmt.add_columns(models.User.password_hash)
+    return stmt.order_by(models.User.id)
+
+
+def find_user(db: Session, user_id: int) -> models.User | None:
+    return db.get(models.User, user_id)
 
 
 def get_user(db: Session, user_id: int):
-    user = db.get(models.User, user_id)
+    user = find_user(db, user_id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Usuario no encontrado"
@@ -48,13 +92,25 @@ def delete_user(db: Session, user_id: int):
     # Reutilizamos get_user para asegurar que existe o lanzar 404
     user = get_user(db, user_id)
     db.delete(user)
+    # Registramos la revocación en la misma transacción para que el resto de procesos
+    # dejen de aceptar sus tokens
+    db.add(models.RevokedUser(user_id=user_id))
     db.commit()
+    user_cache.mark_deleted(user_id)
 
 # Recupera una lista de usuarios basada en una lista de IDs.
 # Útil para operaciones en bloque (batch) desde el Gateway.
-def get_users_by_ids(db: Session, user_ids: list[int]):
-    stmt = select(models.User).where(models.User.id.in_(user_ids))
-    return list(db.scalars(stmt).all())
+def get_users_by_ids(db: Session, user_ids: list[int], fields: list[str] | None = None):
+    stmt = _select_users(fields).where(models.User.id.in_(user_ids))
+    return _fetch(db, stmt)
+
+def update_password_hash(db: Session, user_id: int, password_hash: str):
+    """
+    Guarda un hash regenerado (rehash transparente al cambiar el coste de bcrypt).
+    UPDATE directo: el usuario puede haberse leído en otra sesión (la réplica).
+    """
+    db.execute(update(models.User).where(models.User.id == user_id).values(password_hash=password_hash))
+    db.commit()
 
 def get_user_by_email(db: Session, email: str):
     """Busca un usuario por su email. Necesario para el Login."""
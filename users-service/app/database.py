@@ -1,6 +1,10 @@
 import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+import time
+from contextlib import ExitStack, contextmanager
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
+from .metrics import TimedPool
 
 # 1. Recuperamos las variables (Mantén los nombres genéricos)
 # Docker se encargará de asignar aquí los valores de la BD de usuarios
@@ -12,29 +16,131 @@ DB_NAME = os.getenv("DB_NAME")
 
 # 2. Construimos la URL
 # Usamos postgresql+psycopg para aprovechar el driver moderno que tienes en requirements
-DATABASE_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Una DATABASE_URL completa tiene prioridad (p. ej. SQLite en los benchmarks locales)
+DATABASE_URL = os.getenv("DATABASE_URL") or f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 # 3. Validación básica (Mejorada)
 # Verificar componentes individuales es más seguro que verificar la URL completa construida
-if not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
+if not os.getenv("DATABASE_URL") and not all([DB_HOST, DB_USER, DB_PASSWORD, DB_NAME]):
    # Esto lanzará error si falta alguna variable crítica, evitando conexiones a "None"
    print("Advertencia: Faltan variables de entorno para la base de datos.")
 
+# Réplica de solo lectura opcional: URL completa o DB_REPLICA_HOST con las mismas credenciales.
+# Sin réplica todas las lecturas van al primario
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST")
+if not DATABASE_REPLICA_URL and DB_REPLICA_HOST:
+    DATABASE_REPLICA_URL = f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_REPLICA_HOST}:{DB_PORT}/{DB_NAME}"
+# Segundos que las lecturas de un token que acaba de escribir siguen yendo al primario
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+REPLICA_STICKY_MAXSIZE = int(os.getenv("REPLICA_STICKY_MAXSIZE", 10000))
+
 # 4. Definición de Base para SQLAlchemy 2.0
 class Base(DeclarativeBase):
     pass
 
 # 5. Creación del Engine
 # pool_pre_ping=True ayuda a recuperar conexiones perdidas silenciosamente
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+# TimedPool mide la espera por una conexión libre (ver metrics.py)
+engine = create_engine(DATABASE_URL, pool_pre_ping=True, poolclass=TimedPool)
+replica_engine = (
+    create_engine(DATABASE_REPLICA_URL, pool_pre_ping=True, poolclass=TimedPool) if DATABASE_REPLICA_URL else None
+)
+# Conexiones que cada worker abre al arrancar, antes de declararse listo (/ready)
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", 2))
 
 # 6. SessionLocal
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+ReplicaSessionLocal = (
+    sessionmaker(bind=replica_engine, autoflush=False, autocommit=False, info={"replica": True})
+    if replica_engine is not None else None
+)
+
+class RecentWriters:
+    """
+    Read-your-writes: recuerda qué tokens han confirmado escrituras en los últimos
+    REPLICA_STICKY_SECONDS. Sus lecturas van al primario hasta que la réplica se pone al día.
+    Es por proceso: con varios workers solo cubre las peticiones que caen en el mismo worker.
+    """
+
+    def __init__(self, seconds: float = REPLICA_STICKY_SECONDS, maxsize: int = REPLICA_STICKY_MAXSIZE):
+        self.seconds = seconds
+        self.maxsize = maxsize
+        self._until: dict[str, float] = {}
+
+    def mark(self, key: str):
+        now = time.monotonic()
+        if len(self._until) >= self.maxsize:
+            self._until = {k: until for k, until in self._until.items() if until > now}
+            if len(self._until) >= self.maxsize:
+                self._until.clear()
+        self._until[key] = now + self.seconds
+
+    def is_recent(self, key: str | None) -> bool:
+        until = self._until.get(key) if key else None
+        return until is not None and until > time.monotonic()
+
+
+recent_writers = RecentWriters()
+
+@event.listens_for(SessionLocal, "after_commit")
+def _remember_writer(session):
+    writer = session.info.get("writer")
+    if writer:
+        recent_writers.mark(writer)
+
+def warm_pool(connections: int = DB_POOL_WARMUP):
+    """Abre 'connections' conexiones a la vez (en cada engine) y las deja en el pool para la primera petición."""
+    with ExitStack() as stack:
+        for pool_engine in filter(None, (engine, replica_engine)):
+            for _ in range(min(connections, pool_engine.pool.size())):
+                stack.enter_context(pool_engine.connect()).exec_driver_sql("SELECT 1")
 
-# 7. Dependencia para inyección en rutas
-def get_db():
+# 7. Dependencias para inyección en rutas
+def get_db(request: Request):
+    """Sesión del primario (escrituras). Al confirmar, el token queda 'pegado' al primario."""
     db = SessionLocal()
+    db.info["writer"] = request.headers.get("authorization")
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def _reads_from_primary(request: Request) -> bool:
+    return replica_engine is None or recent_writers.is_recent(request.headers.get("authorization"))
+
+def get_read_db(request: Request):
+    """
+    Sesión de lectura: la réplica si está configurada y el token no ha escrito en los
+    últimos REPLICA_STICKY_SECONDS; si no, el primario.
+    """
+    if _reads_from_primary(request):
+        db = SessionLocal()
+    else:
+        db = ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_engine(request: Request):
+    """
+    Engine de lectura para consultas fuera de sesión (exportaciones en streaming), con el
+    mismo criterio que get_read_db.
+    """
+    return engine if _reads_from_primary(request) else replica_engine
+
+def is_replica(db: Session) -> bool:
+    return db.info.get("replica", False)
+
+@contextmanager
+def primary_for(db: Session):
+    """
+    La propia sesión si ya es del primario; si es de la réplica, una del primario. Para
+    confirmar una búsqueda que falla en la réplica (p. ej. un usuario recién creado).
+    """
+    if not is_replica(db):
+        yield db
+        return
+    with SessionLocal() as primary:
+        yield primary
\ No newline at end of file
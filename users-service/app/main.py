@@ -1,17 +1,42 @@
-from fastapi import FastAPI, Depends, Query, HTTPException, status
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+from fastapi import FastAPI, BackgroundTasks, Depends, Header, Query, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from fastapi import Body
+from fastapi.concurrency import run_in_threadpool
 
 # Importaciones relativas (Crucial para que funcione dentro del paquete 'app')
-from .database import Base, engine, get_db
-from . import models, schemas, crud, security
+from .database import engine, replica_engine, recent_writers, get_db, get_read_db, get_read_engine, is_replica, primary_for, warm_pool
+from .readiness import Readiness
+from . import models, schemas, crud, security, passwords, metrics, notifier, projection, transfer, transfer_format
 
-# Crear las tablas de la BD de Usuarios al arrancar
-Base.metadata.create_all(bind=engine)
+# El esquema lo crea el paso de migración (python -m app.migrate), no cada worker
 
-app = FastAPI(title="Microservicio de Usuarios")
+async def warm_up():
+    await run_in_threadpool(warm_pool)
+    await notifier.warm_up()
+
+readiness = Readiness(warm_up)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await notifier.start_client()
+    # Pools calientes antes de aceptar tráfico (si falla, /ready lo reintenta)
+    await readiness.check()
+    yield
+    await notifier.close_client()
+    # Cerramos los procesos de hashing al apagar
+    passwords.password_pool.shutdown()
+    metrics.mark_process_dead()
+
+app = FastAPI(title="Microservicio de Usuarios", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.instrument_engine(engine)
+if replica_engine is not None:
+    metrics.instrument_engine(replica_engine, "replica")
 
 # Middleware CORS 
 app.add_middleware(
@@ -25,65 +50,159 @@ app.add_middleware(
 def health():
     return {"status": "ok"}
 
+@app.get("/ready")
+async def ready():
+    # Listo = pools de BD y HTTP calientes (distinto de /health: el proceso vive)
+    if not await readiness.check():
+        raise HTTPException(status_code=503, detail="Servicio no preparado")
+    return {"status": "ready"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    # Formato de exposición de Prometheus
+    return metrics.metrics_response()
+
 @app.post("/usuarios", response_model=schemas.UserOut, status_code=201)
-def create_user_endpoint(payload: schemas.UserCreate, db: Session = Depends(get_db)):
-    return crud.create_user(db, payload)
+async def create_user_endpoint(payload: schemas.UserCreate, db: Session = Depends(get_db)):
+    return await crud.create_user(db, payload)
 
 @app.get("/usuarios", response_model=list[schemas.UserOut])
 def list_users_endpoint(
-    db: Session = Depends(get_db), 
+    db: Session = Depends(get_read_db), 
     limit: int = Query(100, ge=1, le=1000), 
     offset: int = Query(0, ge=0),
+    fields: str | None = Query(None, description="Campos a devolver separados por comas (p. ej. id,name)"),
     # Si no hay token válido, lanza 401 y no ejecuta la función
-    current_user: schemas.UserOut = Depends(security.get_current_user)
+    current_user: schemas.CurrentUser = Depends(security.get_current_user)
+):
+    selected = projection.parse_fields(fields, schemas.UserOut.model_fields)
+    users = crud.list_users(db, limit, offset, fields=selected)
+    # response_model solo documenta: las filas se serializan directamente a bytes JSON
+    return projection.rows_response(users, selected or list(schemas.UserOut.model_fields))
+
+# --- Exportación / importación masiva ---
+# Declaradas antes de /usuarios/{user_id} para que "export" no se interprete como un ID
+
+@app.get("/usuarios/export", response_class=StreamingResponse)
+def export_users_endpoint(
+    fmt: Literal["csv", "ndjson"] = Query("ndjson", alias="format"),
+    include_password_hash: bool = Query(False, description="Incluye password_hash (requiere X-Internal-Token)"),
+    x_internal_token: Optional[str] = Header(None),
+    read_engine = Depends(get_read_engine),
+    current_user: schemas.CurrentUser = Depends(security.get_current_user)
 ):
-    return crud.list_users(db, limit, offset)
+    """
+    Todos los usuarios (id, name, email) en streaming: COPY TO STDOUT en Postgres. Con
+    include_password_hash también el hash, solo con la credencial interna: así un entorno
+    se clona con /usuarios/import sin acceso directo a la BD.
+    """
+    if include_password_hash:
+        security.require_internal_service(x_internal_token)
+    # Las extracciones largas van a la réplica si la hay (salvo tras escribir: read-your-writes)
+    return StreamingResponse(
+        transfer.export_rows(read_engine, crud.export_query(include_password_hash), fmt),
+        media_type=transfer_format.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="usuarios.{fmt}"'},
+    )
+
+@app.post("/usuarios/import", response_model=schemas.ImportResult)
+async def import_users_endpoint(
+    request: Request,
+    fmt: Literal["csv", "ndjson"] = Query("ndjson", alias="format"),
+    current_user: schemas.CurrentUser = Depends(security.get_current_user)
+):
+    """
+    Carga un fichero CSV o NDJSON leído en streaming. Cada fila necesita name, email y
+    password (se hashea en el pool de bcrypt) o password_hash (bcrypt, se guarda tal cual).
+    El id se conserva si viene, salvo el de un usuario borrado (se rechaza la fila).
+    """
+    result = await transfer.import_users(engine, request.stream(), fmt)
+    if result.imported:
+        # Las importaciones escriben sin sesión: el token queda 'pegado' al primario igualmente
+        recent_writers.mark(request.headers.get("authorization"))
+    return result
 
 @app.get("/usuarios/{user_id}", response_model=schemas.UserOut)
 def get_user_endpoint(
     user_id: int, 
-    db: Session = Depends(get_db),
-    current_user: schemas.UserOut = Depends(security.get_current_user)
+    db: Session = Depends(get_read_db),
+    current_user: schemas.CurrentUser = Depends(security.get_current_user)
 ):
-    return crud.get_user(db, user_id)
+    user = crud.find_user(db, user_id)
+    if user is None:
+        # Puede ser un alta reciente que la réplica aún no tiene: el 404 lo decide el primario
+        with primary_for(db) as primary:
+            user = crud.get_user(primary, user_id)
+    return user
 
 @app.delete("/usuarios/{user_id}", status_code=204)
 def delete_user_endpoint(
     user_id: int, 
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     # PROTECCIÓN: Si no hay token válido, lanza 401 y no ejecuta la función
-    current_user: schemas.UserOut = Depends(security.get_current_user)
+    current_user: schemas.CurrentUser = Depends(security.get_current_user)
 ):
     crud.delete_user(db, user_id)
+    # incidents-service vacía la copia del propietario en sus incidencias (tras responder)
+    background_tasks.add_task(notifier.notify_user_deleted, user_id)
     # Nota: Con status_code=204, no se debe retornar contenido en el body.
     return
 
 
 #Endpoint interno para el Gateway.
-#Devuelve los datos completos de los usuarios solicitados por sus IDs.
+#Devuelve los datos de los usuarios solicitados por sus IDs (todos o solo los de 'fields').
 @app.post("/usuarios/batch", response_model=list[schemas.UserOut])
 def get_users_batch(
     user_ids: list[int], 
-    db: Session = Depends(get_db),
-    current_user: schemas.UserOut = Depends(security.get_current_user)
+    fields: str | None = Query(None, description="Campos a devolver separados por comas (p. ej. id,name)"),
+    db: Session = Depends(get_read_db),
+    current_user: schemas.CurrentUser = Depends(security.get_current_user)
 ): 
-    return crud.get_users_by_ids(db, user_ids)
+    selected = projection.parse_fields(fields, schemas.UserOut.model_fields)
+    users = crud.get_users_by_ids(db, user_ids, fields=selected)
+    if is_replica(db) and len(users) < len(set(user_ids)):
+        # Falta alguno en la réplica (¿alta reciente?): la respuesta la da el primario
+        with primary_for(db) as primary:
+            users = crud.get_users_by_ids(primary, user_ids, fields=selected)
+    return projection.rows_response(users, selected or list(schemas.UserOut.model_fields))
+
+def _find_login_user(db: Session, email: str):
+    # Si la réplica no lo tiene (registro recién hecho), se busca en el primario
+    user = crud.get_user_by_email(db, email=email)
+    if user is None and is_replica(db):
+        with primary_for(db) as primary:
+            user = crud.get_user_by_email(primary, email=email)
+    return user
+
+def _rehash_password(db: Session, user_id: int, new_hash: str):
+    with primary_for(db) as primary:
+        crud.update_password_hash(primary, user_id, new_hash)
 
 @app.post("/auth/login")
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
+    # Asíncrono para esperar a bcrypt sin ocupar un hilo; la BD (síncrona) va al threadpool
     # 1. Buscamos al usuario por email (el formulario usa 'username' genérico)
-    user = crud.get_user_by_email(db, email=form_data.username)
+    user = await run_in_threadpool(_find_login_user, db, form_data.username)
     
     # 2. Verificamos si el usuario existe y si la contraseña coincide
-    if not user or not security.verify_password(form_data.password, user.password_hash):
+    #    (bcrypt se ejecuta en el pool de procesos; si está saturado -> 503)
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await security.verify_password(form_data.password, user.password_hash)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    # Si el hash usa un coste de bcrypt distinto del configurado, lo regeneramos ya
+    if new_hash:
+        await run_in_threadpool(_rehash_password, db, user.id, new_hash)
     
     # 3. Si todo es correcto, generamos el Token JWT
     # Guardamos el ID (sub) y el email en el token
@@ -100,7 +219,7 @@ def login_for_access_token(
 def refresh_token_endpoint(
     # Esperamos un JSON: { "refresh_token": "..." }
     refresh_token: str = Body(..., embed=True), 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     # 1. Validamos el refresh token
     user_id = security.verify_refresh_token(refresh_token)
@@ -111,7 +230,10 @@ def refresh_token_endpoint(
         )
     
     # 2. Buscamos al usuario (por si fue borrado en estos 7 días)
-    user = crud.get_user(db, user_id=int(user_id))
+    user = crud.find_user(db, int(user_id))
+    if user is None and is_replica(db):
+        with primary_for(db) as primary:
+            user = crud.find_user(primary, int(user_id))
     if not user:
         raise HTTPException(status_code=401, detail="Usuario no encontrado")
 
@@ -0,0 +1,17 @@
+"""
+Migración del esquema de usuarios. Se ejecuta una sola vez antes de arrancar los
+workers (en docker-compose, el servicio users-migrate):
+
+    python -m app.migrate
+"""
+from .database import Base, engine
+from . import models  # registra las tablas en Base.metadata
+
+
+def migrate():
+    Base.metadata.create_all(bind=engine)
+
+
+if __name__ == "__main__":
+    migrate()
+    engine.dispose()
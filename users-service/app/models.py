@@ -4,9 +4,21 @@ from .database import Base
 
 class User(Base):
     __tablename__ = "users"
+    # En SQLite (benchmarks, tests) el id de un usuario borrado no se reutiliza, igual que
+    # con la secuencia de Postgres: un alta nueva heredaría su revocación
+    __table_args__ = {"sqlite_autoincrement": True}
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String(100), nullable=False)
     email: Mapped[str] = mapped_column(String(255), unique=True, nullable=False)
     # Guardamos el hash, no la contraseña real. String(255) es suficiente para bcrypt.
-    password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
\ No newline at end of file
+    password_hash: Mapped[str] = mapped_column(String(255), nullable=False)
+
+
+# Lista de revocación: un registro por usuario borrado.
+# Permite que cada proceso sepa qué tokens dejar de aceptar sin consultar 'users' en cada petición.
+class RevokedUser(Base):
+    __tablename__ = "revoked_users"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(Integer, unique=True, nullable=False)
@@ -0,0 +1,59 @@
+import os
+import httpx
+from .metrics import OWNER_SYNC_FAILURES
+
+# incidents-service guarda una copia (nombre y email) del propietario de cada incidencia.
+# Sin URL configurada no se envían avisos.
+INCIDENTS_SERVICE_URL = os.getenv("INCIDENTS_SERVICE_URL")
+INCIDENTS_SERVICE_TIMEOUT = float(os.getenv("INCIDENTS_SERVICE_TIMEOUT", 5))
+# Credencial de las rutas internas de incidents-service (la misma en ambos servicios)
+INTERNAL_SERVICE_TOKEN = os.getenv("INTERNAL_SERVICE_TOKEN")
+
+# Cliente con pool de conexiones compartido (se abre y se cierra en el lifespan de la app)
+_client: httpx.AsyncClient | None = None
+
+
+async def start_client(transport: httpx.AsyncBaseTransport | None = None):
+    global _client
+    # 'transport' permite sustituir la red (p. ej. ASGI en los benchmarks)
+    if INCIDENTS_SERVICE_URL:
+        _client = httpx.AsyncClient(
+            base_url=INCIDENTS_SERVICE_URL, timeout=INCIDENTS_SERVICE_TIMEOUT, transport=transport
+        )
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def warm_up():
+    """Abre la conexión con incidents-service antes del primer aviso (si no responde, se sigue)."""
+    if _client is None:
+        return
+    try:
+        await _client.get("/health")
+    except httpx.HTTPError:
+        pass
+
+
+async def notify_user_deleted(user_id: int):
+    """
+    Avisa a incidents-service para que vacíe la copia del propietario en sus incidencias.
+    Se ejecuta en segundo plano tras responder: un fallo no afecta al borrado, solo se
+    cuenta en la métrica owner_sync_failures_total (el Gateway ya devuelve owner: null
+    para usuarios inexistentes cuando la fila no tiene copia).
+    """
+    if _client is None:
+        return
+    try:
+        # Ruta interna: solo se acepta con la credencial de servicio, no con un token de usuario
+        response = await _client.delete(
+            f"/incidencias/owners/{user_id}", headers={"X-Internal-Token": INTERNAL_SERVICE_TOKEN or ""}
+        )
+        if response.status_code >= 400:
+            OWNER_SYNC_FAILURES.inc()
+    except httpx.HTTPError:
+        OWNER_SYNC_FAILURES.inc()
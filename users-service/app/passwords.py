@@ -0,0 +1,131 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from .metrics import PASSWORD_PENDING, PASSWORD_REJECTED, PASSWORD_SECONDS
+
+# Coste de bcrypt (log2 de las iteraciones). Al cambiarlo, los hashes antiguos
+# se regeneran de forma transparente en el siguiente login correcto.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# Procesos dedicados al hashing (bcrypt consume CPU y retiene el GIL). Cada worker de
+# uvicorn tiene su propio pool: por defecto se reparten las CPUs entre los WEB_CONCURRENCY workers
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", max(1, (os.cpu_count() or 2) // max(1, WEB_CONCURRENCY))))
+# Operaciones admitidas a la vez (en ejecución + en cola). Por encima -> 503 inmediato
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", 64))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# --- Funciones que se ejecutan en los procesos del pool ---
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    # Devuelve un hash nuevo si el actual usa un coste distinto del configurado
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+class PasswordPool:
+    """
+    Pool de procesos acotado para bcrypt. Las peticiones que lo usan esperan su
+    resultado sin bloquear al resto de endpoints, y si hay demasiadas operaciones
+    pendientes se rechaza la petición al momento en vez de encolarla sin límite.
+    """
+
+    def __init__(self, workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        # Todas las operaciones llegan desde el bucle de eventos del worker
+        self._slots = asyncio.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # 'spawn': no duplicamos los hilos ni las conexiones del proceso web
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    async def run(self, fn, *args, wait: bool = False):
+        """
+        Ejecuta fn en el pool y espera el resultado sin ocupar ningún hilo. Si no quedan
+        huecos, wait=False responde 503 al momento y wait=True espera a que se libere uno.
+        """
+        if not wait and self._slots.locked():
+            PASSWORD_REJECTED.inc()
+            with self._lock:
+                self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Servicio de autenticación saturado, inténtelo de nuevo",
+                headers={"Retry-After": "1"},
+            )
+        await self._slots.acquire()
+        with self._lock:
+            self.pending += 1
+        PASSWORD_PENDING.inc()
+        try:
+            return await asyncio.wrap_future(self._get_executor().submit(fn, *args))
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+            PASSWORD_PENDING.dec()
+            self._slots.release()
+
+    async def map(self, fn, items) -> list:
+        """
+        Aplica fn a muchos elementos (importaciones masivas) por el mismo camino que run():
+        cuentan en max_pending y en las métricas, pero esperan hueco en vez de rechazarse y
+        como mucho hay 'workers' a la vez, así los logins se siguen intercalando.
+        """
+        window = asyncio.Semaphore(self.workers)
+
+        async def run_one(item):
+            async with window:
+                return await self.run(fn, item, wait=True)
+
+        return list(await asyncio.gather(*(run_one(item) for item in items)))
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_pool = PasswordPool()
+
+
+async def hash_password(password: str) -> str:
+    with PASSWORD_SECONDS.labels("hash").time():
+        return await password_pool.run(_hash, password)
+
+async def hash_passwords(passwords: list[str]) -> list[str]:
+    """Hashes de una importación, en el orden recibido (ver PasswordPool.map)."""
+    return await password_pool.map(_hash, passwords)
+
+async def verify_and_update(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    with PASSWORD_SECONDS.labels("verify").time():
+        return await password_pool.run(_verify_and_update, password, hashed_password)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, model_validator
 
 # 1. Definición base común
 class UserBase(BaseModel):
@@ -15,4 +15,34 @@ class UserOut(UserBase):
 
     # 4. Configuración Pydantic V2
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# 5. Fila de una importación masiva (ver transfer.py): contraseña en claro o hash bcrypt ya hecho
+class UserImport(UserBase):
+    id: int | None = None
+    password: str | None = Field(default=None, min_length=4)
+    password_hash: str | None = Field(default=None, pattern=r"^\$2[abxy]?\$\d{2}\$")
+
+    @model_validator(mode="after")
+    def _with_password(self):
+        if self.password is None and self.password_hash is None:
+            raise ValueError("Falta password o password_hash (se exporta con include_password_hash=true)")
+        return self
+
+class ImportRowError(BaseModel):
+    # Línea del fichero (en CSV, la cabecera es la 1)
+    line: int
+    detail: str
+
+class ImportResult(BaseModel):
+    imported: int
+    # Ya existían (mismo id o email): se omiten sin error
+    skipped: int
+    # Inválidas; 'errors' detalla las primeras IMPORT_MAX_ERRORS
+    rejected: int
+    errors: list[ImportRowError]
+
+# 6. Usuario autenticado (extraído del token, sin consultar la BD)
+class CurrentUser(BaseModel):
+    id: int
+    email: EmailStr | None = None
@@ -1,15 +1,17 @@
+import hmac
 import os
 from datetime import datetime, timedelta, timezone
-from typing import Union
-from passlib.context import CryptContext
+from typing import Optional, Union
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Header, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
-from . import crud, schemas, database
+from . import schemas, database, passwords
+from .metrics import JWT_CACHE_LOOKUPS, JWT_DECODE_SECONDS
+from .token_cache import TokenCache
+from .user_cache import user_cache
 
-# 1. Configuración de Hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# 1. Configuración de Hashing: bcrypt se ejecuta en un pool de procesos (ver passwords.py)
 
 # 2. Configuración JWT
 SECRET_KEY = os.getenv("JWT_SECRET", "secret_fallback")
@@ -17,15 +19,23 @@ ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
+# Credencial de las operaciones entre servicios y de mantenimiento (la misma en ambos
+# servicios). Sin configurar, esas operaciones responden 403 a todos
+INTERNAL_SERVICE_TOKEN = os.getenv("INTERNAL_SERVICE_TOKEN")
+
 # Esquema de autenticación: Le dice a FastAPI que el token viene en
 # la cabecera "Authorization: Bearer <token>" y que el login es en "/auth/login"
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password) -> tuple[bool, str | None]:
+    """
+    Devuelve (válida, hash_nuevo). hash_nuevo no es None si cambió el coste configurado:
+    quien verifica debe guardarlo para que la contraseña se actualice a las nuevas rondas.
+    """
+    return await passwords.verify_and_update(plain_password, hashed_password)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await passwords.hash_password(password)
 
 def create_access_token(data: dict, expires_delta: Union[timedelta, None] = None):
     """
@@ -65,10 +75,24 @@ def verify_refresh_token(token: str):
     except JWTError:
         return None
 
+# Tokens de acceso ya verificados: evita repetir la validación completa en cada petición
+token_cache = TokenCache()
+
+def decode_token(token: str) -> dict:
+    payload = token_cache.get(token)
+    if payload is None:
+        JWT_CACHE_LOOKUPS.labels("miss").inc()
+        with JWT_DECODE_SECONDS.time():
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_cache.put(token, payload)
+    else:
+        JWT_CACHE_LOOKUPS.labels("hit").inc()
+    return payload
+
 def get_current_user(
     token: str = Depends(oauth2_scheme), 
-    db: Session = Depends(database.get_db)
-) -> schemas.UserOut:
+    db: Session = Depends(database.get_read_db)
+) -> schemas.CurrentUser:
     
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -77,8 +101,8 @@ def get_current_user(
     )
     
     try:
-        # Decodificar el token
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        # Decodificar el token (o recuperarlo de la caché si ya fue verificado)
+        payload = decode_token(token)
         
         # Extraer el ID del usuario ('sub' es el estándar JWT para subject)
         user_id: str = payload.get("sub")
@@ -89,11 +113,19 @@ def get_current_user(
         # Si el token está mal formado, firma incorrecta o expirado
         raise credentials_exception
 
-    # Verificar que el usuario sigue existiendo en la BD
+    # Verificar que el usuario sigue existiendo (caché de existencia + lista de revocación)
     # Esto evita que un usuario borrado siga entrando con un token viejo.
-    user = crud.get_user(db, user_id=int(user_id))
-    
-    if user is None:
+    if not user_cache.is_active(db, int(user_id)):
         raise credentials_exception
         
-    return user
\ No newline at end of file
+    return schemas.CurrentUser(id=int(user_id), email=payload.get("email"))
+
+def require_internal_service(x_internal_token: Optional[str] = Header(None)):
+    """Solo para otros servicios y operadores: cabecera X-Internal-Token con INTERNAL_SERVICE_TOKEN."""
+    if not INTERNAL_SERVICE_TOKEN or not x_internal_token or not hmac.compare_digest(
+        x_internal_token.encode(), INTERNAL_SERVICE_TOKEN.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Operación reservada a los servicios internos"
+        )
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""
+Caché de tokens JWT verificados. El mismo módulo está en users-service e incidents-service
+(cada servicio se construye por separado); solo cambia cómo se crea la instancia.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+
+# Número máximo de tokens verificados que se mantienen en memoria
+JWT_CACHE_MAXSIZE = int(os.getenv("JWT_CACHE_MAXSIZE", 10000))
+
+
+class TokenCache:
+    """
+    Caché LRU acotada de tokens JWT ya verificados.
+    La clave es el SHA-256 del token (no guardamos el token en claro) y cada entrada
+    caduca exactamente en el 'exp' del propio token.
+    """
+
+    def __init__(self, maxsize: int = JWT_CACHE_MAXSIZE, threadsafe: bool = True):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, tuple[float, dict]] = OrderedDict()
+        # Con endpoints síncronos (users-service) se consulta desde el threadpool: hace falta
+        # el lock. En un servicio async (incidents-service) todo corre en el bucle de eventos
+        self._lock = threading.Lock() if threadsafe else nullcontext()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> dict | None:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            exp, claims = entry
+            if exp <= time.time():
+                # Token caducado: lo expulsamos y forzamos la validación completa (-> 401)
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: dict):
+        exp = claims.get("exp")
+        # Sin 'exp' no sabemos cuándo invalidar la entrada: no se cachea
+        if self.maxsize <= 0 or not isinstance(exp, (int, float)):
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (exp, claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
@@ -0,0 +1,162 @@
+"""
+Exportación e importación masiva en CSV o NDJSON, en streaming y con memoria constante.
+
+- Exportar: en Postgres, COPY (SELECT ...) TO STDOUT reenvía los bloques tal cual los
+  produce la BD; en otras BD (SQLite en los benchmarks) se recorre la consulta por lotes
+  ordenados por id.
+- Importar: el cuerpo se lee a trozos, cada fila se valida y se cargan lotes de
+  IMPORT_BATCH_SIZE filas con COPY ... FROM STDIN en una tabla temporal y un único
+  INSERT ... SELECT ... ON CONFLICT DO NOTHING (las filas repetidas se omiten).
+
+El formato (serialización y lectura del fichero) está en transfer_format.py.
+"""
+import os
+from typing import AsyncIterator, Iterator
+from pydantic import ValidationError
+from sqlalchemy import Table, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from fastapi.concurrency import run_in_threadpool
+from . import models, schemas, passwords
+from .transfer_format import (
+    ImportReport, copy_statement, copy_value, csv_chunk, ndjson_chunk, read_rows, validation_detail,
+)
+
+# Filas por consulta al exportar sin COPY (SQLite)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# Filas por transacción al importar
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 1000))
+
+
+# --- Exportación ---
+
+def _copy_out(engine, stmt, fmt: str) -> Iterator[bytes]:
+    with engine.connect() as conn:
+        with conn.connection.driver_connection.cursor() as cursor:
+            with cursor.copy(copy_statement(stmt, fmt, conn.dialect)) as copy:
+                for block in copy:
+                    yield bytes(block)
+
+
+def _export_batches(engine, stmt, fmt: str) -> Iterator[bytes]:
+    # Sin COPY: lotes por clave (id > último), cada uno con su propia conexión del pool
+    columns = stmt.selected_columns
+    if fmt == "csv":
+        yield csv_chunk([[column.name for column in columns]])
+    last_id = None
+    while True:
+        page = stmt if last_id is None else stmt.where(columns.id > last_id)
+        with engine.connect() as conn:
+            rows = conn.execute(page.limit(EXPORT_BATCH_SIZE)).mappings().all()
+        if not rows:
+            break
+        if fmt == "csv":
+            yield csv_chunk(row.values() for row in rows)
+        else:
+            yield ndjson_chunk(rows)
+        last_id = rows[-1]["id"]
+
+
+def export_rows(engine, stmt, fmt: str) -> Iterator[bytes]:
+    """
+    Cuerpo de la respuesta de exportación. 'stmt' debe ir ordenada por id. Es un generador
+    síncrono: StreamingResponse lo recorre en el pool de hilos.
+    """
+    if engine.dialect.name == "postgresql":
+        yield from _copy_out(engine, stmt, fmt)
+    else:
+        yield from _export_batches(engine, stmt, fmt)
+
+
+# --- Escritura ---
+
+def insert_rows(engine, table: Table, rows: list[dict]) -> int:
+    """Inserta un lote (todas las filas con las mismas columnas) y devuelve cuántas entraron."""
+    columns = list(rows[0])
+    with engine.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            return conn.execute(pg_insert(table).on_conflict_do_nothing(), rows).rowcount
+
+        column_list = ", ".join(columns)
+        staging = f"{table.name}_import"
+        # Tabla temporal sin restricciones: COPY no se detiene por filas repetidas
+        conn.exec_driver_sql(
+            f"CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {column_list} FROM {table.name} WITH NO DATA"
+        )
+        with conn.connection.driver_connection.cursor() as cursor:
+            with cursor.copy(f"COPY {staging} ({column_list}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row([copy_value(row[column]) for column in columns])
+        result = conn.exec_driver_sql(
+            f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING"
+        )
+        if "id" in columns:
+            # IDs explícitos (clonado de entornos): la secuencia sigue después del mayor
+            conn.exec_driver_sql(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), (SELECT max(id) FROM {table.name}))"
+            )
+        return result.rowcount
+
+
+# --- Importación de usuarios ---
+
+def _import_batch(engine, batch: list[tuple[int, schemas.UserImport]], hashes: list[str], report: ImportReport):
+    # 'hashes': los de las contraseñas en claro del lote, en orden
+    hashes = iter(hashes)
+    with_id, without_id = [], []
+    for _, user in batch:
+        values = {"name": user.name, "email": user.email, "password_hash": user.password_hash or next(hashes)}
+        if user.id is None:
+            without_id.append(values)
+        else:
+            with_id.append({"id": user.id, **values})
+
+    for rows in (with_id, without_id):
+        if rows:
+            inserted = insert_rows(engine, models.User.__table__, rows)
+            report.imported += inserted
+            report.skipped += len(rows) - inserted
+
+
+def _revoked_ids(engine, user_ids: list[int]) -> set[int]:
+    with engine.connect() as conn:
+        RevokedUser = models.RevokedUser
+        return set(conn.scalars(select(RevokedUser.user_id).where(RevokedUser.user_id.in_(user_ids))))
+
+
+async def _hash_and_import(engine, batch: list[tuple[int, schemas.UserImport]], report: ImportReport):
+    # Un ID revocado es el de un usuario borrado: sus tokens siguen rechazándose, así que
+    # un usuario importado con ese ID no podría usar la API
+    explicit_ids = [user.id for _, user in batch if user.id is not None]
+    revoked = await run_in_threadpool(_revoked_ids, engine, explicit_ids) if explicit_ids else set()
+    accepted = []
+    for line, user in batch:
+        if user.id in revoked:
+            report.reject(line, f"El ID {user.id} pertenece a un usuario borrado.")
+        else:
+            accepted.append((line, user))
+    if not accepted:
+        return
+    # Las contraseñas en claro se hashean en paralelo en el pool de bcrypt
+    hashes = await passwords.hash_passwords([user.password for _, user in accepted if user.password_hash is None])
+    # La BD es síncrona: fuera del bucle de eventos
+    await run_in_threadpool(_import_batch, engine, accepted, hashes, report)
+
+
+async def import_users(engine, chunks: AsyncIterator[bytes], fmt: str) -> schemas.ImportResult:
+    report = ImportReport()
+    batch = []
+    async for line, row, error in read_rows(chunks, fmt, list(schemas.UserImport.model_fields)):
+        if error is not None:
+            report.reject(line, error)
+            continue
+        try:
+            batch.append((line, schemas.UserImport.model_validate(row)))
+        except ValidationError as exc:
+            report.reject(line, validation_detail(exc))
+            continue
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await _hash_and_import(engine, batch, report)
+            batch = []
+    if batch:
+        await _hash_and_import(engine, batch, report)
+    return report.result()
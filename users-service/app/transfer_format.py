@@ -0,0 +1,174 @@
+"""
+Formatos de exportación e importación (CSV y NDJSON): serialización, lectura del fichero
+en streaming y totales de una importación. Sin acceso a la BD: el mismo módulo está en
+users-service e incidents-service (cada transfer.py tiene solo su parte de BD).
+"""
+import codecs
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from enum import Enum
+from typing import Any, AsyncIterator
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import DateTime, func, select, text
+from fastapi import HTTPException, status
+from . import schemas
+
+# Errores de fila detallados en la respuesta de una importación (el resto solo se cuentan)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", 100))
+
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+# Opciones de COPY: CSV con cabecera, o una columna JSON por línea. Para NDJSON se usa
+# FORMAT csv con comilla y separador que JSON nunca contiene sin escapar: así el JSON sale
+# tal cual (FORMAT text duplicaría las barras invertidas)
+_COPY_OPTIONS = {
+    "csv": "FORMAT csv, HEADER true",
+    "ndjson": "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'",
+}
+
+_row_adapter = TypeAdapter(dict[str, Any])
+
+
+# --- Exportación ---
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_chunk(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows([[_csv_value(value) for value in row] for row in rows])
+    return buffer.getvalue().encode()
+
+
+def ndjson_chunk(rows) -> bytes:
+    return b"".join(_row_adapter.dump_json(dict(row)) + b"\n" for row in rows)
+
+
+def copy_statement(stmt, fmt: str, dialect) -> str:
+    """COPY (SELECT ...) TO STDOUT con los parámetros ya incrustados (COPY no admite binds)."""
+    inner = stmt.subquery("exported")
+    if fmt == "ndjson":
+        query = select(func.row_to_json(text("exported"))).select_from(inner)
+    else:
+        # Fechas en ISO 8601 (el formato de texto de Postgres, "+00", no lo lee pydantic)
+        query = select(*(
+            func.to_json(column).op("#>>")(text("'{}'")).label(column.name)
+            if isinstance(column.type, DateTime) else column
+            for column in inner.c
+        ))
+    sql = query.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    return f"COPY ({sql}) TO STDOUT WITH ({_COPY_OPTIONS[fmt]})"
+
+
+def copy_value(value):
+    return value.value if isinstance(value, Enum) else value
+
+
+# --- Lectura del fichero importado ---
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Solo se parte por "\n": los separadores Unicode (U+2028...) pueden ir dentro de un valor
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        lines = buffer.split("\n")
+        buffer = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def read_rows(chunks: AsyncIterator[bytes], fmt: str, allowed) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    Devuelve (línea, fila, error) por cada registro. En CSV la primera línea es la
+    cabecera: si trae columnas desconocidas se rechaza el fichero entero (400) antes de
+    importar nada. Los valores vacíos de CSV se leen como None.
+    """
+    header = None
+    pending, quotes, start = [], 0, 0
+    number = 0
+    async for line in _lines(chunks):
+        number += 1
+        if fmt == "ndjson":
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield number, None, "JSON inválido"
+                continue
+            if not isinstance(row, dict):
+                yield number, None, "Se esperaba un objeto JSON"
+            elif unknown := [field for field in row if field not in allowed]:
+                yield number, None, f"Campos no permitidos: {', '.join(unknown)}"
+            else:
+                yield number, row, None
+            continue
+
+        # CSV: un registro puede ocupar varias líneas (saltos de línea entre comillas)
+        if not pending:
+            start = number
+        pending.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        record = next(csv.reader(pending), [])
+        pending, quotes = [], 0
+        if not any(record):
+            continue
+        if header is None:
+            header = [column.strip() for column in record]
+            if unknown := [column for column in header if column not in allowed]:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Columnas no permitidas: {', '.join(unknown)}. Disponibles: {', '.join(allowed)}"
+                )
+            continue
+        if len(record) != len(header):
+            yield start, None, f"Se esperaban {len(header)} columnas y hay {len(record)}"
+            continue
+        yield start, {column: value or None for column, value in zip(header, record)}, None
+    if pending:
+        yield start, None, "Comillas sin cerrar al final del fichero"
+
+
+def validation_detail(exc: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(map(str, error['loc']))}: {error['msg']}" if error["loc"] else error["msg"]
+        for error in exc.errors()
+    )
+
+
+class ImportReport:
+    """Totales de una importación: importadas, omitidas (ya existían) y rechazadas (inválidas)."""
+
+    def __init__(self):
+        self.imported = 0
+        self.skipped = 0
+        self.rejected = 0
+        self.errors: list[schemas.ImportRowError] = []
+
+    def reject(self, line: int, detail: str):
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(schemas.ImportRowError(line=line, detail=detail))
+
+    def result(self) -> schemas.ImportResult:
+        return schemas.ImportResult(
+            imported=self.imported, skipped=self.skipped, rejected=self.rejected,
+            # Algunas filas se rechazan al cargar su lote (p. ej. propietario inexistente)
+            errors=sorted(self.errors, key=lambda error: error.line),
+        )
@@ -0,0 +1,78 @@
+import os
+import threading
+import time
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from . import models
+from .database import primary_for
+
+# Cada cuántos segundos sincroniza cada proceso la lista de usuarios revocados (borrados)
+USER_REVOCATION_SYNC_SECONDS = float(os.getenv("USER_REVOCATION_SYNC_SECONDS", 5))
+# Número máximo de IDs de usuarios activos recordados por proceso
+USER_EXISTS_CACHE_MAXSIZE = int(os.getenv("USER_EXISTS_CACHE_MAXSIZE", 100000))
+
+
+class UserExistenceCache:
+    """
+    Sustituye la consulta a la BD que hacía cada petición autenticada para comprobar
+    que el 'sub' del token sigue existiendo.
+
+    - Un usuario se consulta en la BD solo la primera vez que se ve su token.
+    - Los borrados se registran en la tabla 'revoked_users' (misma transacción que el DELETE)
+      y cada proceso la sincroniza de forma incremental como mucho cada
+      USER_REVOCATION_SYNC_SECONDS. El proceso que borra lo aplica al instante.
+    """
+
+    def __init__(self):
+        self._active: set[int] = set()
+        self._revoked: set[int] = set()
+        self._last_revocation_id = 0
+        self._next_sync = 0.0
+        self._lock = threading.Lock()
+
+    def _sync_revocations(self, db: Session):
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        with self._lock:
+            if now < self._next_sync:
+                return
+            stmt = (
+                select(models.RevokedUser.id, models.RevokedUser.user_id)
+                .where(models.RevokedUser.id > self._last_revocation_id)
+                .order_by(models.RevokedUser.id)
+            )
+            # Las revocaciones se leen siempre del primario: la réplica podría ir con retraso
+            with primary_for(db) as primary:
+                for revocation_id, user_id in primary.execute(stmt):
+                    self._revoked.add(user_id)
+                    self._active.discard(user_id)
+                    self._last_revocation_id = revocation_id
+            self._next_sync = now + USER_REVOCATION_SYNC_SECONDS
+
+    def is_active(self, db: Session, user_id: int) -> bool:
+        self._sync_revocations(db)
+        if user_id in self._revoked:
+            return False
+        if user_id in self._active:
+            return True
+
+        # Primera vez que vemos a este usuario: lo comprobamos contra la BD
+        # (si la réplica aún no lo tiene, se confirma en el primario)
+        if db.get(models.User, user_id) is None:
+            with primary_for(db) as primary:
+                if primary is db or primary.get(models.User, user_id) is None:
+                    return False
+        with self._lock:
+            if len(self._active) >= USER_EXISTS_CACHE_MAXSIZE:
+                self._active.clear()
+            self._active.add(user_id)
+        return True
+
+    def mark_deleted(self, user_id: int):
+        with self._lock:
+            self._revoked.add(user_id)
+            self._active.discard(user_id)
+
+
+user_cache = UserExistenceCache()